@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+# Запуск: "python benchmark.py" (из папки проекта), подробности — "python benchmark.py -h"
+
+"""
+Бенчмарк и регрессионная проверка для script.py.
+
+1) Во временной папке синтезируется воспроизводимый набор изображений
+   (фиксированный seed) разных разрешений и форматов.
+2) script.py запускается на нём в нескольких режимах (последовательно
+   и параллельно) отдельным процессом: замеряется время, изображения
+   в секунду и пиковая память процесса (RSS).
+3) Результаты каждого режима сверяются с эталоном (golden):
+   гистограммы должны совпадать точно, число углов — в пределах допуска.
+   Эталон берётся из файла --golden или из первого режима.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Скрипт, который измеряем
+SCRIPT_PATH = Path(__file__).resolve().parent / "script.py"
+
+# Режимы запуска: имя -> дополнительные аргументы script.py
+MODES = {
+    "serial": ["--workers", "1", "--writer-threads", "0"],
+    "parallel": ["--workers", str(os.cpu_count() or 2), "--writer-threads", "2"],
+}
+
+# Допуск по числу углов: абсолютный и относительный
+CORNER_ABS_TOLERANCE = 2
+CORNER_REL_TOLERANCE = 0.05
+
+
+# ------------------------------------------------------
+#          СИНТЕЗ ВОСПРОИЗВОДИМОГО НАБОРА
+# ------------------------------------------------------
+
+def synth_image(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """
+    Синтетическая картинка: градиент, случайные прямоугольники
+    и круги (дают границы и углы) и немного шума.
+    """
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = (xx * 255 // max(1, width - 1)).astype(np.uint8)
+    img = np.dstack([base, base[::-1], (yy * 255 // max(1, height - 1)).astype(np.uint8)])
+    img = np.ascontiguousarray(img)
+
+    for _ in range(12):
+        x0, x1 = sorted(rng.integers(0, width, 2))
+        y0, y1 = sorted(rng.integers(0, height, 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(img, (int(x0), int(y0)), (int(x1), int(y1)), color, -1)
+    for _ in range(6):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(5, max(6, min(width, height) // 4)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, radius, color, -1)
+
+    noise = rng.integers(0, 16, img.shape, dtype=np.uint8)
+    return cv2.add(img, noise)
+
+
+def make_corpus(folder: Path, sizes, formats, count: int, seed: int) -> int:
+    """
+    Создаёт в folder по count картинок каждого размера и формата.
+    Одинаковые аргументы всегда дают одинаковые файлы.
+    Возвращает число созданных файлов.
+    """
+    rng = np.random.default_rng(seed)
+    total = 0
+    for width, height in sizes:
+        for ext in formats:
+            sub = folder / f"{width}x{height}_{ext}"
+            sub.mkdir(parents=True, exist_ok=True)
+            for i in range(count):
+                img = synth_image(rng, width, height)
+                cv2.imwrite(str(sub / f"img_{width}x{height}_{i:03d}.{ext}"), img)
+                total += 1
+    return total
+
+
+# ------------------------------------------------------
+#              ЗАПУСК И ЗАМЕР ОДНОГО РЕЖИМА
+# ------------------------------------------------------
+
+def run_mode(corpus: Path, work: Path, name: str, extra_args) -> dict:
+    """
+    Запускает script.py на корпусе отдельным процессом (всегда --full,
+    чтобы манифест не пропускал файлы). Возвращает замеры режима:
+    время, изображения/с, пиковый RSS в МБ (None, если ОС не даёт)
+    и сводку Metrics самого скрипта.
+    """
+    db_path = work / f"{name}.db"
+    metrics_path = work / f"{name}_metrics.json"
+    db_path.unlink(missing_ok=True)
+    cmd = [
+        sys.executable, str(SCRIPT_PATH), str(corpus), "--full",
+        "--db", str(db_path), "--metrics", str(metrics_path), *extra_args,
+    ]
+
+    # stderr — в файл: канал (PIPE) мог бы переполниться во время wait4
+    log_path = work / f"{name}.log"
+    t0 = time.perf_counter()
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=log)
+        peak_rss_mb = None
+        if hasattr(os, "wait4"):
+            # wait4 возвращает ресурсы именно этого процесса
+            _, status, usage = os.wait4(proc.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            proc.returncode = returncode
+            # ru_maxrss: килобайты в Linux, байты в macOS
+            scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+            peak_rss_mb = usage.ru_maxrss / scale
+        else:
+            returncode = proc.wait()
+    elapsed = time.perf_counter() - t0
+
+    if returncode != 0:
+        stderr = log_path.read_text(encoding="utf-8", errors="replace")
+        raise RuntimeError(f"Режим {name} завершился с кодом {returncode}:\n{stderr}")
+
+    summary = json.loads(metrics_path.read_text(encoding="utf-8"))
+    return {
+        "mode": name,
+        "args": list(extra_args),
+        "elapsed": elapsed,
+        "images": summary["images"],
+        "images_per_second": summary["images"] / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb,
+        "db": str(db_path),
+        "steps": summary["steps"],
+    }
+
+
+# ------------------------------------------------------
+#              СВЕРКА С ЭТАЛОНОМ
+# ------------------------------------------------------
+
+def load_features(db_path: Path, corpus: Path) -> dict:
+    """
+    Признаки из базы прогона: {путь относительно корпуса:
+    {"histogram": [...], "corner_count": n}}.
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        rows = conn.execute(
+            "SELECT image_path, histogram, corner_count FROM image_features"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    features = {}
+    for path_str, hist, corners in rows:
+        rel = os.path.relpath(path_str, corpus).replace(os.sep, "/")
+        features[rel] = {
+            "histogram": None if hist is None else np.frombuffer(hist, dtype="<u4").tolist(),
+            "corner_count": corners,
+        }
+    return features
+
+
+def compare_features(golden: dict, actual: dict) -> list:
+    """
+    Сверяет признаки прогона с эталоном. Возвращает список
+    расхождений (пустой — всё совпало).
+    """
+    problems = []
+    for rel in sorted(set(golden) - set(actual)):
+        problems.append(f"{rel}: нет в результатах")
+    for rel in sorted(set(actual) - set(golden)):
+        problems.append(f"{rel}: нет в эталоне")
+
+    for rel in sorted(set(golden) & set(actual)):
+        want, got = golden[rel], actual[rel]
+        if want["histogram"] != got["histogram"]:
+            problems.append(f"{rel}: гистограмма отличается")
+        if want["corner_count"] is not None and got["corner_count"] is not None:
+            diff = abs(want["corner_count"] - got["corner_count"])
+            allowed = max(CORNER_ABS_TOLERANCE, CORNER_REL_TOLERANCE * want["corner_count"])
+            if diff > allowed:
+                problems.append(
+                    f"{rel}: углов {got['corner_count']} вместо {want['corner_count']}"
+                )
+    return problems
+
+
+# ------------------------------------------------------
+#                     ОСНОВНАЯ ФУНКЦИЯ
+# ------------------------------------------------------
+
+def parse_sizes(text: str):
+    """'320x240,1280x720' -> [(320, 240), (1280, 720)]"""
+    sizes = []
+    for item in text.split(","):
+        w, _, h = item.strip().lower().partition("x")
+        sizes.append((int(w), int(h)))
+    return sizes
+
+
+def main():
+    """
+    Основная точка входа:
+    - Синтезирует корпус
+    - Прогоняет режимы
+    - Сверяет с эталоном и печатает/сохраняет таблицу
+    """
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера script.py.")
+    parser.add_argument(
+        "--sizes", default="320x240,1280x720,3000x2000",
+        help="разрешения корпуса через запятую (по умолчанию 320x240,1280x720,3000x2000)",
+    )
+    parser.add_argument(
+        "--formats", default="jpg,png",
+        help="форматы корпуса через запятую (по умолчанию jpg,png)",
+    )
+    parser.add_argument("--count", type=int, default=8, help="картинок на размер и формат (по умолчанию 8)")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора корпуса")
+    parser.add_argument(
+        "--modes", default=",".join(MODES),
+        help=f"режимы через запятую (доступны: {', '.join(MODES)})",
+    )
+    parser.add_argument(
+        "--script-args", default="",
+        help="общие доп. аргументы script.py для всех режимов, например \"--stages histogram\"",
+    )
+    parser.add_argument("--golden", default=None, help="JSON эталона; если файла нет — будет создан")
+    parser.add_argument("--update-golden", action="store_true", help="перезаписать эталон текущим прогоном")
+    parser.add_argument("--output", default=None, help="сохранить результаты в JSON файл")
+    parser.add_argument("--keep", default=None, help="папка для корпуса вместо временной (не удаляется)")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        print(f"[ERROR] Неизвестные режимы: {', '.join(unknown)}")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="imgbench_") as tmp:
+        root = Path(args.keep).expanduser().resolve() if args.keep else Path(tmp)
+        corpus = root / "corpus"
+        work = root / "work"
+        work.mkdir(parents=True, exist_ok=True)
+
+        count = make_corpus(
+            corpus, parse_sizes(args.sizes), [f.strip() for f in args.formats.split(",")],
+            args.count, args.seed,
+        )
+        print(f"[INFO] Корпус: {count} изображений в {corpus}")
+
+        golden = None
+        golden_path = Path(args.golden).expanduser() if args.golden else None
+        if golden_path is not None and golden_path.exists() and not args.update_golden:
+            golden = json.loads(golden_path.read_text(encoding="utf-8"))["features"]
+
+        results = []
+        failed = False
+        for name in modes:
+            print(f"[INFO] Режим {name}...")
+            res = run_mode(corpus, work, name, MODES[name] + args.script_args.split())
+            features = load_features(Path(res["db"]), corpus)
+
+            if golden is None:
+                # Первый прогон становится эталоном
+                golden = features
+                res["golden"] = "reference"
+                if golden_path is not None:
+                    golden_path.write_text(
+                        json.dumps({"seed": args.seed, "sizes": args.sizes, "formats": args.formats,
+                                    "count": args.count, "features": features}),
+                        encoding="utf-8",
+                    )
+                    print(f"[INFO] Эталон сохранён в: {golden_path}")
+            else:
+                problems = compare_features(golden, features)
+                res["golden"] = "ok" if not problems else "mismatch"
+                res["problems"] = problems
+                if problems:
+                    failed = True
+                    for line in problems[:20]:
+                        print(f"    [DIFF] {line}")
+            results.append(res)
+
+    # Итоговая таблица
+    print()
+    print(f"{'mode':<10} {'images':>7} {'time, s':>9} {'img/s':>8} {'peak RSS, MB':>13}  golden")
+    for res in results:
+        rss = "-" if res["peak_rss_mb"] is None else f"{res['peak_rss_mb']:.0f}"
+        print(
+            f"{res['mode']:<10} {res['images']:>7} {res['elapsed']:>9.2f} "
+            f"{res['images_per_second']:>8.1f} {rss:>13}  {res['golden']}"
+        )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[INFO] Результаты сохранены в: {args.output}")
+
+    if failed:
+        sys.exit(1)
+
+
+# Точка входа
+if __name__ == "__main__":
+    main()
@@ -5,31 +5,153 @@
 """
 Этот скрипт:
 1) Получает путь к папке с изображениями (.jpg/.jpeg/.png)
-2) Обрабатывает каждое изображение:
-   - переводит в серый цвет
-   - извлекает границы (Canny)
-   - извлекает углы (Shi-Tomasi)
-   - строит гистограмму яркости
+2) Обрабатывает каждое изображение конвейером этапов (см. STAGES):
+   - переводит в серый цвет (общий буфер для всех этапов)
+   - grayscale: сохраняет серую картинку
+   - edges: извлекает границы (Canny)
+   - corners: извлекает углы (Shi-Tomasi)
+   - histogram: строит гистограмму яркости (в базе — упакованный BLOB uint32)
+   - histogram_plot: рисует гистограмму (matplotlib)
+   - orb, blur, phash: число ключевых точек ORB, резкость, перцептивный хеш
 3) Сохраняет обработанные изображения
-4) Создаёт SQL файл с полной таблицей и INSERT строками
+4) Записывает признаки в базу SQLite (image_features.db) пакетными
+   вставками в одной транзакции; по желанию (--format sql/both)
+   дополнительно создаёт SQL файл с таблицей и UPSERT строками
+
+Повторный запуск инкрементальный: в output/manifest.json запоминаются
+размер и время изменения каждого файла, а также параметры обработки
+и приёмники результатов (--format, --db): если они изменились или база
+пуста, обработка будет полной. Неизменённые изображения пропускаются,
+а в базу (и SQL файл) попадают только UPSERT/DELETE для новых,
+изменённых и удалённых файлов. Картинки называются по имени файла
+и короткому хешу полного пути (tree_<хеш>_gray.png), поэтому одноимённые
+файлы из разных папок не затирают картинки друг друга.
+Флаг --full заставляет пересчитать всё и пересоздать таблицу.
+
+Набор этапов и их параметры задаются списком (--stages), отдельными
+параметрами (--param edges.threshold1=50) или JSON файлом (--pipeline):
+   {"stages": {"histogram": {}, "edges": {"threshold1": 50}}}
+Невыбранные этапы не считаются и их картинки не кодируются, например
+"--stages histogram" не тратит время на Canny, углы и PNG.
+По умолчанию работают этапы DEFAULT_STAGES (как в исходной версии).
+
+Поиск файлов идёт потоково (os.scandir) и сразу передаёт найденные
+изображения в ограниченную очередь рабочих потоков (--workers,
+--queue-size), поэтому обработка начинается с первого найденного файла,
+а память не зависит от размера архива. Вместо строки на каждый файл
+периодически печатается сводка прогресса.
+
+Очень большие изображения (--memory-budget МБ): размер узнаётся из
+заголовка файла ещё до декодирования. Если полная обработка не влезает
+в бюджет, картинка декодируется сразу в оттенках серого (при
+необходимости уменьшенной через IMREAD_REDUCED_GRAYSCALE_*), а все
+этапы считаются полосами: гистограмма и резкость копятся полоса
+за полосой, координаты углов и точек ORB переводятся обратно
+в координаты изображения, pHash берётся с миниатюры, собранной
+по полосам.
+
+Запись картинок (OutputWriter) идёт в отдельном пуле потоков
+(--writer-threads), параллельно с вычислениями. Формат настраивается:
+--image-format png/webp (WebP без потерь), --png-level 0..9,
+--skip-images grayscale,edges (не сохранять восстановимые картинки),
+--archive zip/tar (все картинки — в один архив output/derived.zip вместо
+тысяч мелких файлов, что важно для сетевых дисков; каждый запуск
+обновляет этот архив, убирая картинки удалённых изображений).
+
+Замеры (--metrics metrics.json, --trace trace.csv): время каждого шага
+(чтение, декодирование, каждый этап, кодирование и запись картинок,
+запись в базу) копится за весь запуск — count/total/p50/p95/max,
+плюс изображения в секунду и прочитанные/записанные байты.
+Трассировка пишет по строке на изображение.
+
+Поиск по готовой базе (без обработки):
+   python script.py photos --similar photos/tree.jpg --top 5
+   python script.py photos --duplicates 0.05
+Гистограммы всех изображений загружаются в одну матрицу numpy,
+сравнение идёт по расстоянию Хеллингера одним матричным умножением.
 
 Особенность: OpenCV плохо читает русские пути, поэтому
 используется imdecode + tofile, которые поддерживают Unicode.
 """
 
+import io
 import os
 import sys
+import csv
 import json
+import math
+import hashlib
+import struct
+import sqlite3
+import time
+import tarfile
+import zipfile
+import argparse
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 # Поддерживаемые расширения изображений
 VALID_EXTS = {".jpg", ".jpeg", ".png"}
 
+# Этапы конвейера по умолчанию (набор исходной версии скрипта)
+DEFAULT_STAGES = ("grayscale", "edges", "corners", "histogram", "histogram_plot")
+
+# Оценка пиковой памяти на пиксель при обычной обработке:
+# цветная картинка (3) + копия для углов (3) + серый и границы (2)
+# + внутренние буферы Canny / goodFeaturesToTrack (~16)
+FULL_BYTES_PER_PIXEL = 24
+# В режиме полос целиком в памяти только серый, границы и копия для углов
+TILED_BYTES_PER_PIXEL = 3
+# Временные буферы Canny / goodFeaturesToTrack на пиксель одной полосы
+STRIP_BYTES_PER_PIXEL = 16
+# Минимальная высота полосы и перекрытие соседних полос (в строках)
+MIN_STRIP_ROWS = 64
+STRIP_OVERLAP = 16
+# ORB не ищет точки ближе edgeThreshold (31) к краю, поэтому его полосам
+# нужно перекрытие больше
+ORB_OVERLAP = 32
+# В режиме полос pHash считается по промежуточной миниатюре с такой
+# наибольшей стороной, собранной полоса за полосой
+PHASH_THUMB_SIDE = 512
+# Коэффициенты уменьшения, которые умеет imdecode
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Общие колонки таблицы image_features (кроме id); колонки этапов
+# добавляются из STAGES, см. table_columns()
+BASE_COLUMNS = (
+    ("image_path", "TEXT NOT NULL UNIQUE"),
+    ("width", "INTEGER NOT NULL"),
+    ("height", "INTEGER NOT NULL"),
+)
+
+# Виды сохраняемых картинок: папка в output, суффикс файла, колонка пути
+OUTPUT_KINDS = {
+    "grayscale": ("grayscale", "_gray", "grayscale_path"),
+    "edges": ("edges", "_edges", "edges_path"),
+    "corners": ("corners", "_corners", "corners_path"),
+    "histogram_plot": ("histograms", "_hist", "histogram_image_path"),
+}
+
+# Имя файла манифеста внутри папки output и версия его формата
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 4
+
+# Формат гистограммы в базе: 256 корзин uint32 little-endian
+HIST_BINS = 256
+HIST_DTYPE = np.dtype("<u4")
+
 
 def sql_escape(value: str) -> str:
     """Экранирует одинарные кавычки, чтобы SQL не ломался."""
@@ -40,7 +162,7 @@ def sql_escape(value: str) -> str:
 #  ПОМОЩНИКИ ДЛЯ ЧТЕНИЯ/ЗАПИСИ КАРТИНОК С ЮНИКОД-ПУТЯМИ
 # ------------------------------------------------------
 
-def imread_unicode(path: Path):
+def imread_unicode(path: Path, flags: int = cv2.IMREAD_COLOR):
     """
     Читает изображение через numpy + imdecode, что позволяет
     работать с русскими, арабскими, китайскими путями.
@@ -51,17 +173,107 @@ def imread_unicode(path: Path):
     if data.size == 0:
         return None
     # Декодировать байты как изображение OpenCV
-    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(data, flags)
     return img
 
 
-def imwrite_unicode(path: Path, img) -> bool:
+def exif_orientation(tiff: bytes) -> int:
+    """
+    Значение тега Orientation (1–8) из блока EXIF (TIFF-заголовок
+    и IFD0) или 1, если тега нет или блок не разобрать.
+    """
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1
+    if len(tiff) < 8:
+        return 1
+    (ifd,) = struct.unpack_from(endian + "I", tiff, 4)
+    if ifd + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack_from(endian + "H", tiff, ifd)
+    for k in range(count):
+        offset = ifd + 2 + 12 * k
+        if offset + 12 > len(tiff):
+            break
+        tag, value_type = struct.unpack_from(endian + "HH", tiff, offset)
+        if tag == 0x0112 and value_type == 3:
+            (value,) = struct.unpack_from(endian + "H", tiff, offset + 8)
+            return value
+    return 1
+
+
+def oriented_size(width: int, height: int, orientation: int):
+    """Ориентации 5–8 — поворот на 90°: imdecode меняет ширину и высоту местами."""
+    if 5 <= orientation <= 8:
+        return height, width
+    return width, height
+
+
+def probe_image_size(data: np.ndarray):
+    """
+    Узнаёт (ширина, высота) по заголовку PNG или JPEG без декодирования —
+    такие, какими их вернёт imdecode, т.е. с учётом EXIF-ориентации
+    (сегмент APP1 у JPEG, блок eXIf у PNG).
+    Возвращает None, если формат не распознан.
+    """
+    mv = memoryview(data)
+    head = bytes(mv[:24])
+    n = len(mv)
+
+    # PNG: сигнатура, затем первый блок IHDR с шириной и высотой;
+    # блок eXIf, если он есть, стоит до данных картинки (IDAT)
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", head[16:24])
+        i = 8
+        while i + 8 <= n:
+            length, chunk = struct.unpack(">I4s", bytes(mv[i:i + 8]))
+            if chunk in (b"IDAT", b"IEND"):
+                break
+            if chunk == b"eXIf":
+                tiff = bytes(mv[i + 8:i + 8 + length])
+                return oriented_size(width, height, exif_orientation(tiff))
+            i += 12 + length
+        return width, height
+
+    # JPEG: идём по маркерам до SOFn (кадр), где записаны размеры;
+    # EXIF (APP1) всегда раньше кадра
+    if head[:2] != b"\xff\xd8":
+        return None
+    orientation = 1
+    i = 2
+    while i + 9 <= n:
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:
+            # заполняющий байт
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", bytes(mv[i + 5:i + 9]))
+            return oriented_size(width, height, orientation)
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # маркеры без длины
+            i += 2
+            continue
+        (seg_len,) = struct.unpack(">H", bytes(mv[i + 2:i + 4]))
+        if marker == 0xE1 and bytes(mv[i + 4:i + 10]) == b"Exif\x00\x00":
+            orientation = exif_orientation(bytes(mv[i + 10:i + 2 + seg_len]))
+        i += 2 + seg_len
+    return None
+
+
+def imwrite_unicode(path: Path, img, params=()) -> bool:
     """
     Сохраняет изображение, используя imencode (сжимает картинку в память)
     + tofile, что поддерживает Unicode пути.
+    params — параметры кодека imencode (например, уровень сжатия PNG).
     """
     ext = path.suffix  # например .png
-    success, buf = cv2.imencode(ext, img)
+    success, buf = cv2.imencode(ext, img, list(params))
     if not success:
         return False
     buf.tofile(str(path))  # запись на диск
@@ -72,171 +284,1173 @@ def imwrite_unicode(path: Path, img) -> bool:
 #        ПОИСК ИЗОБРАЖЕНИЙ В ПАПКЕ
 # ------------------------------------------------------
 
-def find_images(input_dir: Path):
+def iter_images(input_dir: Path, exclude_dir: Path = None):
+    """
+    Генератор: рекурсивно обходит папку через os.scandir и отдаёт
+    изображения с нужными расширениями сразу, как только их находит.
+    В памяти хранится только стек ещё не просмотренных папок.
+    Символические ссылки на папки не раскрываются (как и у rglob):
+    ссылка на одну из родительских папок иначе зациклила бы обход.
+    Папка exclude_dir (обычно output) пропускается, чтобы
+    результаты прошлых запусков не обрабатывались как исходники.
+    """
+    exclude_str = str(exclude_dir) if exclude_dir is not None else None
+    stack = [str(input_dir)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"[WARN] Не удалось прочитать папку {current}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path != exclude_str:
+                    subdirs.append(entry.path)
+            elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in VALID_EXTS:
+                yield Path(entry.path)
+        # Кладём в обратном порядке, чтобы обход шёл по алфавиту
+        stack.extend(reversed(subdirs))
+
+
+def find_images(input_dir: Path, exclude_dir: Path = None):
+    """
+    Рекурсивно ищет все изображения с нужными расширениями
+    и возвращает их списком (см. iter_images).
+    """
+    return list(iter_images(input_dir, exclude_dir))
+
+
+# ------------------------------------------------------
+#        ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА И ПРОГРЕСС
+# ------------------------------------------------------
+
+def run_bounded(func, tasks, workers: int, max_pending: int):
+    """
+    Генератор: выполняет func(task) в пуле из workers потоков,
+    пока вызывающий код продолжает перебирать tasks (например, искать
+    файлы). В работе одновременно не больше max_pending задач,
+    поэтому память ограничена. Результаты отдаются парами
+    (task, result) в порядке поступления задач.
+    """
+    max_pending = max(max_pending, workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for task in tasks:
+            pending.append((task, pool.submit(func, task)))
+            if len(pending) >= max_pending:
+                done_task, future = pending.popleft()
+                yield done_task, future.result()
+        while pending:
+            done_task, future = pending.popleft()
+            yield done_task, future.result()
+
+
+class ProgressLog:
     """
-    Рекурсивно ищет все изображения с нужными расширениями.
+    Сводка прогресса: печатается не чаще раза в interval секунд
+    вместо отдельной строки на каждое изображение.
     """
-    images = []
-    for p in input_dir.rglob("*"):
-        if p.is_file() and p.suffix.lower() in VALID_EXTS:
-            images.append(p)
-    return images
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, found: int, processed: int, skipped: int, force: bool = False):
+        """Печатает сводку, если с прошлой прошло достаточно времени."""
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        rate = processed / max(now - self.start, 1e-9)
+        print(
+            f"[INFO] Найдено: {found}, обработано: {processed}, "
+            f"без изменений: {skipped} ({rate:.1f} изобр./с)",
+            flush=True,
+        )
+
+
+class Metrics:
+    """
+    Замеры времени по шагам за весь запуск (потокобезопасно).
+    - timer(name) — контекст-менеджер, добавляет длительность шага,
+    - record_image() — учитывает готовое изображение и пишет строку
+      трассировки CSV (если задан trace_path),
+    - summary() — словарь для JSON: по каждому шагу count, total,
+      p50, p95, max (в секундах), изображения/с и байты.
+    """
+
+    def __init__(self, trace_path: Path = None, trace_steps=()):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.durations = {}
+        self.images = 0
+        self.bytes_read = 0
+        self.trace_file = None
+        self.trace_steps = list(trace_steps)
+        if trace_path is not None:
+            self.trace_file = open(trace_path, "w", newline="", encoding="utf-8")
+            self.trace = csv.writer(self.trace_file)
+            self.trace.writerow(["image_path", "bytes_read", *self.trace_steps, "total"])
+
+    @contextmanager
+    def timer(self, name: str, timings: dict = None):
+        """Замеряет блок кода как шаг name; timings — замеры изображения."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.add(name, elapsed)
+            if timings is not None:
+                timings[name] = elapsed
+
+    def add(self, name: str, seconds: float):
+        """Добавляет одну длительность шага name."""
+        with self.lock:
+            self.durations.setdefault(name, []).append(seconds)
+
+    def record_image(self, path_str: str, bytes_read: int, timings: dict):
+        """Учитывает обработанное изображение и его замеры."""
+        with self.lock:
+            self.images += 1
+            self.bytes_read += bytes_read
+            if self.trace_file is not None:
+                row = [f"{timings.get(step, 0.0):.6f}" for step in self.trace_steps]
+                total = sum(timings.values())
+                self.trace.writerow([path_str, bytes_read, *row, f"{total:.6f}"])
+
+    def summary(self, bytes_written: int = 0) -> dict:
+        """Сводка за запуск для JSON."""
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            steps = {}
+            for name, values in self.durations.items():
+                arr = np.asarray(values)
+                steps[name] = {
+                    "count": int(arr.size),
+                    "total": float(arr.sum()),
+                    "p50": float(np.percentile(arr, 50)),
+                    "p95": float(np.percentile(arr, 95)),
+                    "max": float(arr.max()),
+                }
+            return {
+                "elapsed": elapsed,
+                "images": self.images,
+                "images_per_second": self.images / elapsed if elapsed > 0 else 0.0,
+                "bytes_read": self.bytes_read,
+                "bytes_written": bytes_written,
+                "steps": steps,
+            }
+
+    def close(self):
+        """Закрывает файл трассировки."""
+        if self.trace_file is not None:
+            self.trace_file.close()
+
+
+# ------------------------------------------------------
+#        МАНИФЕСТ ДЛЯ ИНКРЕМЕНТАЛЬНОЙ ОБРАБОТКИ
+# ------------------------------------------------------
+
+def processing_params(pipeline: list, memory_budget: int = 0, output_options: dict = None,
+                      sink_options: dict = None) -> dict:
+    """
+    Параметры, от которых зависит результат обработки;
+    output_options — настройки сохранения картинок (формат, пропуски),
+    sink_options — куда пишутся признаки (--format и путь к базе):
+    новый приёмник не содержит строк прошлых запусков, поэтому его
+    смена тоже требует полной обработки.
+    """
+    return {
+        "stages": [[name, params] for name, params in pipeline],
+        "memory_budget": memory_budget,
+        "output": output_options or {},
+        "sinks": sink_options or {},
+    }
+
+
+def table_has_rows(db_path: Path) -> bool:
+    """Есть ли в базе db_path таблица image_features хотя бы с одной строкой."""
+    if not db_path.exists():
+        return False
+    conn = sqlite3.connect(str(db_path))
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_features'"
+        ).fetchone()
+        return row is not None and conn.execute("SELECT 1 FROM image_features LIMIT 1").fetchone() is not None
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+
+def load_manifest(manifest_path: Path, params: dict) -> dict:
+    """
+    Загружает манифест прошлого запуска.
+    Если файла нет, он повреждён или параметры обработки (params)
+    изменились — возвращает пустой манифест (значит, нужно пересчитать всё).
+    """
+    empty = {"version": MANIFEST_VERSION, "params": params, "files": {}}
+    if not manifest_path.exists():
+        return empty
+    try:
+        data = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        print(f"[WARN] Манифест повреждён, обработка будет полной: {manifest_path}")
+        return empty
+    if data.get("version") != MANIFEST_VERSION or data.get("params") != params:
+        print("[INFO] Параметры обработки изменились, обработка будет полной.")
+        return empty
+    return data
+
+
+def save_manifest(manifest: dict, manifest_path: Path):
+    """
+    Атомарно сохраняет манифест: сначала во временный файл,
+    затем переименование, чтобы прерванный запуск не испортил его.
+    """
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+
+def file_signature(path: Path) -> list:
+    """Подпись файла для манифеста: [размер, время изменения в нс]."""
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
 
 
 # ------------------------------------------------------
 #                ОБРАБОТКА ОДНОГО ИЗОБРАЖЕНИЯ
 # ------------------------------------------------------
 
-def process_image(path: Path, output_dirs: dict, base_output_dir: Path):
+def plan_decode(data: np.ndarray, memory_budget: int):
+    """
+    Решает, как декодировать файл, чтобы уложиться в memory_budget байт.
+    Возвращает (исходный_размер, коэффициент_уменьшения, высота_полосы):
+    - коэффициент 0 — обычная обработка в цвете целиком;
+    - иначе серый режим полосами с уменьшением в 1, 2, 4 или 8 раз.
+    Исходный размер — (ширина, высота) из заголовка или None.
+    """
+    size = probe_image_size(data)
+    if not memory_budget or size is None:
+        return size, 0, None
+    width, height = size
+    if width * height * FULL_BYTES_PER_PIXEL <= memory_budget:
+        return size, 0, None
+
+    # Подбираем минимальное уменьшение, при котором влезает хотя бы
+    # минимальная полоса поверх постоянных буферов
+    for factor in sorted(REDUCED_GRAYSCALE_FLAGS):
+        w = -(-width // factor)
+        h = -(-height // factor)
+        rest = memory_budget - w * h * TILED_BYTES_PER_PIXEL
+        strip_rows = rest // (w * STRIP_BYTES_PER_PIXEL) if rest > 0 else 0
+        if strip_rows >= MIN_STRIP_ROWS:
+            return size, factor, strip_rows
+    print(f"[WARN] Изображение {width}x{height} не влезает в бюджет памяти даже с уменьшением в 8 раз")
+    return size, 8, MIN_STRIP_ROWS
+
+
+def iter_strips(height: int, strip_rows: int, overlap: int):
+    """
+    Делит строки [0, height) на полосы по strip_rows строк.
+    Отдаёт (y0, y1, a, b): полоса [y0, y1) — её «собственные» строки,
+    [a, b) — она же с перекрытием overlap строк сверху и снизу,
+    чтобы фильтры на краях полосы видели соседние пиксели.
+    """
+    for y0 in range(0, height, strip_rows):
+        y1 = min(height, y0 + strip_rows)
+        yield y0, y1, max(0, y0 - overlap), min(height, y1 + overlap)
+
+
+def compute_histogram(gray, strip_rows: int = None) -> np.ndarray:
+    """
+    Гистограмма яркости: массив из 256 счётчиков uint32.
+    Если задан strip_rows, гистограмма копится полоса за полосой.
+    """
+    height = gray.shape[0]
+    if strip_rows is None or strip_rows >= height:
+        hist = cv2.calcHist([gray], [0], None, [HIST_BINS], [0, 256]).ravel()
+        return hist.astype(HIST_DTYPE)
+
+    total = np.zeros(HIST_BINS, dtype=np.float64)
+    for y0, y1, _, _ in iter_strips(height, strip_rows, 0):
+        total += cv2.calcHist([gray[y0:y1]], [0], None, [HIST_BINS], [0, 256]).ravel()
+    return total.astype(HIST_DTYPE)
+
+
+def detect_edges(gray, threshold1: float, threshold2: float, strip_rows: int = None):
+    """
+    Границы Canny. Если задан strip_rows, Canny считается по полосам
+    с перекрытием, и в результат копируются только собственные строки.
+    """
+    height = gray.shape[0]
+    if strip_rows is None or strip_rows >= height:
+        return cv2.Canny(gray, threshold1, threshold2)
+
+    edges = np.empty_like(gray)
+    for y0, y1, a, b in iter_strips(height, strip_rows, STRIP_OVERLAP):
+        part = cv2.Canny(gray[a:b], threshold1, threshold2)
+        edges[y0:y1] = part[y0 - a:y1 - a]
+    return edges
+
+
+def detect_corners(gray, params: dict, strip_rows: int = None) -> np.ndarray:
+    """
+    Углы Shi-Tomasi как массив N x 2 целых координат (x, y);
+    params — аргументы goodFeaturesToTrack.
+    Если задан strip_rows, углы ищутся по полосам: квота maxCorners
+    делится пропорционально высоте полос, координаты переводятся
+    обратно в систему всего изображения, а на стыках полос повторно
+    соблюдается minDistance.
+    """
+    height = gray.shape[0]
+    if strip_rows is None or strip_rows >= height:
+        corners = cv2.goodFeaturesToTrack(gray, **params)
+        if corners is None:
+            return np.empty((0, 2), dtype=np.intp)
+        return np.intp(corners).reshape(-1, 2)
+
+    max_corners = params["maxCorners"]
+    min_dist_sq = params["minDistance"] ** 2
+    found = []
+    for y0, y1, a, b in iter_strips(height, strip_rows, STRIP_OVERLAP):
+        quota = max(1, math.ceil(max_corners * (y1 - y0) / height))
+        part = cv2.goodFeaturesToTrack(gray[a:b], **dict(params, maxCorners=quota))
+        if part is None:
+            continue
+        part = part.reshape(-1, 2)
+        part[:, 1] += a  # обратно в координаты изображения
+        found.append(part[(part[:, 1] >= y0) & (part[:, 1] < y1)])
+
+    kept = []
+    for point in np.concatenate(found) if found else ():
+        if all(((point - q) ** 2).sum() >= min_dist_sq for q in kept):
+            kept.append(point)
+            if len(kept) == max_corners:
+                break
+    if not kept:
+        return np.empty((0, 2), dtype=np.intp)
+    return np.intp(kept)
+
+
+def count_orb(gray, nfeatures: int, strip_rows: int = None) -> int:
     """
-    Выполняет полную обработку изображения:
+    Число ключевых точек ORB (не больше nfeatures).
+    Если задан strip_rows, точки ищутся по полосам с перекрытием
+    ORB_OVERLAP: пирамида ORB строится для полосы, а не для всей
+    картинки, квота nfeatures делится пропорционально высоте полос,
+    и считаются только точки собственных строк полосы.
+    """
+    height = gray.shape[0]
+    if strip_rows is None or strip_rows >= height:
+        return len(cv2.ORB_create(nfeatures=nfeatures).detect(gray, None))
+
+    total = 0
+    for y0, y1, a, b in iter_strips(height, strip_rows, ORB_OVERLAP):
+        quota = max(1, math.ceil(nfeatures * (y1 - y0) / height))
+        keypoints = cv2.ORB_create(nfeatures=quota).detect(gray[a:b], None)
+        total += sum(1 for kp in keypoints if y0 <= kp.pt[1] + a < y1)
+    return min(total, nfeatures)
+
+
+def shrink_by_strips(gray, max_side: int, strip_rows: int):
+    """
+    Уменьшает серую картинку в целое число раз f (наибольшая сторона —
+    не больше max_side) усреднением (INTER_AREA), полоса за полосой:
+    высота полосы кратна f, поэтому блоки усреднения не пересекают
+    границы полос. Целиком в памяти только результат.
+    """
+    height, width = gray.shape[:2]
+    f = -(-max(height, width) // max_side)
+    if f <= 1:
+        return gray
+    rows = max(f, strip_rows // f * f)
+    out_width = -(-width // f)
+    parts = []
+    for y0, y1, _, _ in iter_strips(height, rows, 0):
+        out_height = -(-(y1 - y0) // f)
+        parts.append(cv2.resize(gray[y0:y1], (out_width, out_height), interpolation=cv2.INTER_AREA))
+    return np.vstack(parts)
+
+
+# ------------------------------------------------------
+#          АСИНХРОННАЯ ЗАПИСЬ КАРТИНОК
+# ------------------------------------------------------
+
+class OutputWriter:
+    """
+    Кодирует и записывает картинки этапов в пуле потоков, чтобы
+    сжатие и запись на диск шли параллельно с вычислениями.
+    - image_format — "png" или "webp" (WebP без потерь),
+    - png_level — уровень сжатия PNG 0..9 (None — по умолчанию OpenCV),
+    - skip — виды картинок (OUTPUT_KINDS), которые не сохраняются вовсе,
+    - archive — "zip" или "tar": все картинки в один архив
+      output/derived.zip (.tar), который обновляется каждым запуском
+      (см. close),
+    - threads — потоки записи (0 — писать синхронно),
+    - max_pending — сколько картинок может ждать записи; дальше
+      submit() блокируется, чтобы очередь не съела память,
+    - metrics — Metrics для замеров шагов encode и write.
+    """
+
+    def __init__(self, output_dir: Path, image_format: str = "png", png_level: int = None,
+                 skip=(), archive: str = None, threads: int = 2, max_pending: int = 16,
+                 metrics: "Metrics" = None):
+        self.output_dir = output_dir
+        self.metrics = metrics or Metrics()
+        self.skip = set(skip)
+        self.ext = "." + image_format
+        if image_format == "webp":
+            # качество > 100 у OpenCV означает WebP без потерь
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+        elif png_level is not None:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+        else:
+            self.params = []
+
+        self.archive = None
+        self.archive_name = None
+        self.archived = set()   # картинки, записанные в архив этим запуском
+        if archive:
+            # Новые картинки пишутся во временный архив; close() переносит
+            # в него нужные картинки из прошлого и подменяет старый
+            self.archive_name = f"derived.{archive}"
+            self.archive_path = output_dir / self.archive_name
+            self.archive_tmp = self.archive_path.with_name(self.archive_name + ".tmp")
+            if archive == "zip":
+                # картинки уже сжаты, поэтому без повторного сжатия
+                self.archive = zipfile.ZipFile(self.archive_tmp, "w", zipfile.ZIP_STORED)
+            else:
+                self.archive = tarfile.open(self.archive_tmp, "w")
+
+        self.lock = threading.Lock()
+        self.made_dirs = set()
+        self.errors = []
+        self.bytes_written = 0
+        self.pool = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    def wants(self, kind: str) -> bool:
+        """Нужно ли вообще сохранять картинки этого вида."""
+        return kind not in self.skip
+
+    def submit(self, folder: str, name: str, img) -> tuple:
+        """
+        Ставит картинку в очередь записи.
+        img — массив OpenCV или функция render(file), которая сама
+        пишет PNG в файловый объект (например, matplotlib).
+        Возвращает (путь для базы, путь для манифеста): путь файла
+        относительно output или, в режиме архива, имя архива/путь внутри.
+        """
+        ext = ".png" if callable(img) else self.ext
+        rel = f"{folder}/{name}{ext}"
+        if self.pool is None:
+            self._write(rel, img)
+        else:
+            self.slots.acquire()
+            future = self.pool.submit(self._write, rel, img)
+            future.add_done_callback(self._done)
+        if self.archive is not None:
+            stored = f"{self.archive_name}/{rel}"
+            return stored, stored
+        return rel, rel
+
+    def _done(self, future):
+        """Освобождает место в очереди и запоминает ошибку записи."""
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def _write(self, rel: str, img):
+        """Кодирует одну картинку и пишет её в файл или архив."""
+        with self.metrics.timer("encode"):
+            if callable(img):
+                buf = io.BytesIO()
+                img(buf)
+                data = buf.getbuffer()
+            else:
+                success, data = cv2.imencode(self.ext, img, self.params)
+                if not success:
+                    raise ValueError(f"Не удалось закодировать {rel}")
+
+        with self.metrics.timer("write"):
+            self._store(rel, data)
+        with self.lock:
+            self.bytes_written += len(data)
+
+    def _store(self, rel: str, data):
+        """Пишет закодированные байты в файл или архив."""
+        if self.archive is None:
+            path = self.output_dir / rel
+            folder = path.parent
+            if folder not in self.made_dirs:
+                folder.mkdir(parents=True, exist_ok=True)
+                self.made_dirs.add(folder)
+            # Буфер кодировщика пишется на диск как есть, без копии
+            with open(path, "wb") as f:
+                f.write(data)
+        else:
+            data = bytes(data)
+            with self.lock:
+                self.archived.add(rel)
+                if isinstance(self.archive, zipfile.ZipFile):
+                    self.archive.writestr(rel, data)
+                else:
+                    info = tarfile.TarInfo(rel)
+                    info.size = len(data)
+                    info.mtime = int(time.time())
+                    self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self, keep=()):
+        """
+        Дожидается всех записей и закрывает архив.
+        keep — пути картинок (как в манифесте), которые должны остаться
+        в архиве: из архива прошлого запуска переносятся только они,
+        если этот запуск их не переписал, так что картинки удалённых
+        изображений из архива пропадают. Если ничего не записано
+        и не удалено, старый архив остаётся как есть.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        if self.archive is not None:
+            self._merge_archive(keep)
+        if self.errors:
+            raise self.errors[0]
+
+    def _merge_archive(self, keep):
+        """Переносит картинки keep из старого архива и подменяет его новым."""
+        prefix = self.archive_name + "/"
+        keep = {k[len(prefix):] for k in keep if k.startswith(prefix)}
+        is_zip = isinstance(self.archive, zipfile.ZipFile)
+        old = None
+        if self.archive_path.exists():
+            old = zipfile.ZipFile(self.archive_path) if is_zip else tarfile.open(self.archive_path)
+        try:
+            if old is not None:
+                names = old.namelist() if is_zip else old.getnames()
+                if not self.archived and set(names) <= keep:
+                    # Ничего нового и нечего удалять: старый архив не трогаем
+                    self.archive.close()
+                    self.archive_tmp.unlink()
+                    return
+                for name in names:
+                    if name not in keep or name in self.archived:
+                        continue
+                    if is_zip:
+                        self.archive.writestr(old.getinfo(name), old.read(name))
+                    else:
+                        member = old.getmember(name)
+                        self.archive.addfile(member, old.extractfile(member))
+        finally:
+            if old is not None:
+                old.close()
+        self.archive.close()
+        os.replace(self.archive_tmp, self.archive_path)
+
+
+# ------------------------------------------------------
+#          КОНВЕЙЕР ЭТАПОВ ОБРАБОТКИ
+# ------------------------------------------------------
+
+# Реестр этапов: имя -> описание (см. декоратор stage)
+STAGES = {}
+
+
+def stage(name: str, requires=(), columns=(), outputs=(), **defaults):
+    """
+    Декоратор: регистрирует функцию func(ctx, params) как этап конвейера.
+    - requires — этапы, которые должны выполниться раньше (добавляются сами),
+    - columns — колонки таблицы, которые этап заполняет в ctx["fields"],
+    - outputs — виды картинок из OUTPUT_KINDS, которые этап сохраняет,
+    - defaults — параметры этапа по умолчанию.
+    Новый этап достаточно объявить этим декоратором.
+    """
+    def decorator(func):
+        STAGES[name] = {
+            "func": func,
+            "requires": tuple(requires),
+            "columns": tuple(columns),
+            "outputs": tuple(outputs),
+            "defaults": defaults,
+        }
+        return func
+    return decorator
+
+
+def table_columns():
+    """Все колонки таблицы: общие + колонки всех этапов + пути картинок."""
+    columns = list(BASE_COLUMNS)
+    for info in STAGES.values():
+        columns.extend(info["columns"])
+        for kind in info["outputs"]:
+            columns.append((OUTPUT_KINDS[kind][2], "TEXT"))
+    return columns
+
+
+def parse_param_value(text: str):
+    """Значение параметра из командной строки: число/JSON или строка."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def coerce_param(stage_name: str, name: str, value, default):
+    """
+    Приводит значение параметра к типу значения по умолчанию:
+    для int годится целое (в том числе 5.0), для float — любое число,
+    для bool — true/false. Иначе ValueError, чтобы ошибка была видна
+    при сборке конвейера, а не в каждом рабочем потоке.
+    """
+    expected = type(default)
+    if expected is bool:
+        if isinstance(value, bool):
+            return value
+    elif expected is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+    elif expected is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif isinstance(value, expected):
+        return value
+    raise ValueError(
+        f"Параметр {stage_name}.{name}: ожидается {expected.__name__}, получено {value!r}"
+    )
+
+
+def parse_pipeline_config(config) -> tuple:
+    """
+    Разбирает содержимое файла --pipeline:
+    {"stages": {"этап": {параметры} или null, ...}}.
+    Возвращает (имена этапов по порядку, {этап: параметры}).
+    Другая структура — ValueError с описанием, что не так.
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("stages"), dict):
+        raise ValueError('ожидается {"stages": {"этап": {параметры}, ...}}')
+    overrides = {}
+    for name, params in config["stages"].items():
+        if params is None:
+            params = {}
+        if not isinstance(params, dict):
+            raise ValueError(f"параметры этапа {name} должны быть объектом, получено {params!r}")
+        overrides[name] = dict(params)
+    return list(overrides), overrides
+
+
+def build_pipeline(stage_names, overrides: dict) -> list:
+    """
+    Собирает конвейер: список (имя, параметры) в порядке выполнения.
+    Зависимости (requires) добавляются перед зависимыми этапами.
+    overrides — {этап: {параметр: значение}}; значения приводятся
+    к типу значения по умолчанию (coerce_param).
+    Неизвестный этап, параметр или значение не того типа — ValueError.
+    """
+    checked = {}
+    for name, params in overrides.items():
+        if name not in STAGES:
+            raise ValueError(f"Неизвестный этап: {name}")
+        defaults = STAGES[name]["defaults"]
+        unknown = set(params) - set(defaults)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры этапа {name}: {', '.join(sorted(unknown))}")
+        checked[name] = {
+            key: coerce_param(name, key, value, defaults[key]) for key, value in params.items()
+        }
+    overrides = checked
+
+    order = []
+
+    def add(name):
+        if name not in STAGES:
+            raise ValueError(f"Неизвестный этап: {name}. Доступны: {', '.join(STAGES)}")
+        if name in order:
+            return
+        for dep in STAGES[name]["requires"]:
+            add(dep)
+        order.append(name)
+
+    for name in stage_names:
+        add(name)
+    return [(name, dict(STAGES[name]["defaults"], **overrides.get(name, {}))) for name in order]
+
+
+def output_stem(path_str: str) -> str:
+    """
+    Начало имени картинок изображения: имя файла без расширения и короткий
+    хеш полного пути, чтобы p/tree.jpg, p/sub/tree.jpg и p/tree.png
+    не записывали картинки в одни и те же файлы.
+    """
+    digest = hashlib.sha1(path_str.encode("utf-8")).hexdigest()[:10]
+    return f"{Path(path_str).stem}_{digest}"
+
+
+def save_output(ctx: dict, kind: str, img):
+    """
+    Отдаёт картинку этапа писателю (OutputWriter) и записывает
+    путь к ней в поля записи. img — массив или функция render(file).
+    """
+    folder, suffix, column = OUTPUT_KINDS[kind]
+    name = output_stem(ctx["fields"]["image_path"]) + suffix
+    stored, rel = ctx["writer"].submit(folder, name, img)
+    ctx["fields"][column] = stored
+    if rel is not None:
+        ctx["outputs"].append(rel)
+
+
+def wants_output(ctx: dict, kind: str) -> bool:
+    """Нужно ли готовить картинку этого вида (не отключена ли она)."""
+    return ctx["writer"].wants(kind)
+
+
+@stage("grayscale", outputs=("grayscale",))
+def stage_grayscale(ctx, params):
+    """Сохраняет серую картинку (общий буфер ctx["gray"])."""
+    if wants_output(ctx, "grayscale"):
+        save_output(ctx, "grayscale", ctx["gray"])
+
+
+@stage("edges", columns=(("edge_density", "REAL"),), outputs=("edges",),
+       threshold1=100.0, threshold2=200.0)
+def stage_edges(ctx, params):
+    """Алгоритм Canny находит "границы" (контуры); доля пикселей-границ 0..1."""
+    edges = detect_edges(ctx["gray"], params["threshold1"], params["threshold2"], ctx["strip_rows"])
+    ctx["fields"]["edge_density"] = float(np.count_nonzero(edges)) / edges.size
+    if wants_output(ctx, "edges"):
+        save_output(ctx, "edges", edges)
+
+
+@stage("corners", columns=(("corner_count", "INTEGER"),), outputs=("corners",),
+       maxCorners=200, qualityLevel=0.01, minDistance=10.0)
+def stage_corners(ctx, params):
+    """
+    Поиск углов методом Shi-Tomasi и картинка с отмеченными углами:
+    - maxCorners — максимум углов,
+    - qualityLevel — минимальное качество угла,
+    - minDistance — минимальное расстояние между углами.
+    """
+    corners = detect_corners(ctx["gray"], params, ctx["strip_rows"])
+    ctx["fields"]["corner_count"] = len(corners)
+    if not wants_output(ctx, "corners"):
+        return
+
+    # Копия изображения для рисования найденных углов
+    # (в режиме полос — копия серого, чтобы не держать цветной буфер)
+    if ctx["img"] is not None:
+        corners_img = ctx["img"].copy()
+        color = (0, 0, 255)
+    else:
+        corners_img = ctx["gray"].copy()
+        color = 255
+    for x, y in corners:
+        cv2.circle(corners_img, (int(x), int(y)), 4, color, 1, lineType=cv2.LINE_AA)
+    save_output(ctx, "corners", corners_img)
+
+
+@stage("histogram", columns=(("histogram", "BLOB"),))
+def stage_histogram(ctx, params):
+    """Гистограмма яркости (0–255): 256 x uint32 little-endian."""
+    ctx["hist"] = compute_histogram(ctx["gray"], ctx["strip_rows"])
+    ctx["fields"]["histogram"] = ctx["hist"].tobytes()
+
+
+@stage("histogram_plot", requires=("histogram",), outputs=("histogram_plot",))
+def stage_histogram_plot(ctx, params):
+    """
+    Сохраняет гистограмму через matplotlib (он поддерживает Unicode).
+    Используем объект Figure без pyplot: он не трогает глобальное
+    состояние и поэтому безопасен в рабочих потоках. matplotlib
+    импортируется только здесь: его импорт — около полусекунды,
+    а запуски без этого этапа он не нужен.
+    """
+    if not wants_output(ctx, "histogram_plot"):
+        return
+
+    def render(out_file):
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.plot(ctx["hist"])
+        ax.set_title(f"Histogram for {ctx['path'].stem}")
+        ax.set_xlabel("Intensity")
+        ax.set_ylabel("Pixel count")
+        ax.set_xlim([0, 256])
+        fig.tight_layout()
+        fig.savefig(out_file, format="png")
+
+    save_output(ctx, "histogram_plot", render)
+
+
+@stage("orb", columns=(("orb_count", "INTEGER"),), nfeatures=500)
+def stage_orb(ctx, params):
+    """Число ключевых точек ORB (в режиме полос — по полосам)."""
+    ctx["fields"]["orb_count"] = count_orb(ctx["gray"], params["nfeatures"], ctx["strip_rows"])
+
+
+@stage("blur", columns=(("blur_score", "REAL"),))
+def stage_blur(ctx, params):
+    """
+    Резкость: дисперсия лапласиана (чем меньше, тем более размыто).
+    Считается по полосам, сумма и сумма квадратов копятся постепенно.
+    """
+    gray = ctx["gray"]
+    height = gray.shape[0]
+    strip_rows = ctx["strip_rows"] or height
+    total = total_sq = 0.0
+    for y0, y1, a, b in iter_strips(height, strip_rows, 1):
+        lap = cv2.Laplacian(gray[a:b], cv2.CV_32F)[y0 - a:y1 - a]
+        total += float(lap.sum(dtype=np.float64))
+        total_sq += float(np.square(lap, dtype=np.float64).sum())
+    n = gray.size
+    ctx["fields"]["blur_score"] = total_sq / n - (total / n) ** 2
+
+
+@stage("phash", columns=(("phash", "TEXT"),))
+def stage_phash(ctx, params):
+    """
+    Перцептивный хеш (pHash): DCT уменьшенной до 32x32 картинки,
+    64 бита «выше/ниже медианы» низких частот, записанные в hex.
+    В режиме полос картинка сначала уменьшается полосами до
+    PHASH_THUMB_SIDE, и 32x32 получается уже из этой миниатюры.
+    """
+    gray = ctx["gray"]
+    if ctx["strip_rows"] is not None:
+        gray = shrink_by_strips(gray, PHASH_THUMB_SIDE, ctx["strip_rows"])
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small.astype(np.float32))[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    ctx["fields"]["phash"] = f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def process_image(path: Path, pipeline: list, writer: OutputWriter, memory_budget: int = 0,
+                  metrics: Metrics = None):
+    """
+    Обрабатывает изображение конвейером pipeline (см. build_pipeline):
     1. Чтение безопасным способом
-    2. Перевод в grayscale
-    3. Детекция границ (Canny)
-    4. Детекция углов (Shi-Tomasi)
-    5. Рассчёт гистограммы
-    6. Сохранение всех результатов
+    2. Перевод в grayscale — общий буфер для всех этапов
+    3. Выполнение выбранных этапов по порядку; картинки этапов
+       кодируются и пишутся асинхронно через writer
+    Возвращает (запись для базы, список сохранённых картинок) или None.
+
+    memory_budget — бюджет памяти на изображение в байтах (0 — без
+    ограничения). Если обработка не влезает, включается серый режим
+    полосами (см. plan_decode); ширина и высота в записи остаются
+    исходными, а сохранённые картинки — в уменьшенном масштабе.
+
+    metrics — Metrics: время чтения, декодирования и каждого этапа.
     """
+    metrics = metrics or Metrics()
+    timings = {}
+
+    # Читаем файл безопасным способом (Unicode-пути)
+    with metrics.timer("read", timings):
+        data = np.fromfile(str(path), dtype=np.uint8)
+    bytes_read = data.size
 
-    # Читаем картинку безопасно
-    img = imread_unicode(path)
-    if img is None:
+    with metrics.timer("decode", timings):
+        size, factor, strip_rows = plan_decode(data, memory_budget) if data.size else (None, 0, None)
+        if factor == 0:
+            # Обычный режим: цветная картинка целиком
+            img = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+            gray = None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            # Режим для больших картинок: сразу серый, возможно уменьшенный
+            img = None
+            gray = cv2.imdecode(data, REDUCED_GRAYSCALE_FLAGS[factor])
+    del data
+
+    if gray is None:
         print(f"[WARN] Не удалось прочитать файл: {path}")
         return None
 
-    # Перевод в оттенки серого
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
     # Размер исходной картинки
     height, width = gray.shape[:2]
+    if factor > 1:
+        width, height = size
 
-    # Алгоритм Canny находищает "границы" (контуры)
-    edges = cv2.Canny(gray, 100, 200)
+    # Контекст: общие промежуточные данные этапов и поля записи
+    ctx = {
+        "path": path,
+        "img": img,
+        "gray": gray,
+        "strip_rows": strip_rows,
+        "writer": writer,
+        "outputs": [],
+        "fields": {
+            "image_path": str(path.resolve()),
+            "width": width,
+            "height": height,
+        },
+    }
+    for name, params in pipeline:
+        with metrics.timer(name, timings):
+            STAGES[name]["func"](ctx, params)
+
+    metrics.record_image(ctx["fields"]["image_path"], bytes_read, timings)
+    return ctx["fields"], ctx["outputs"]
 
-    # Поиск углов методом Shi-Tomasi
-    corners = cv2.goodFeaturesToTrack(
-        gray,
-        maxCorners=200,      # максимум 200 углов
-        qualityLevel=0.01,   # минимальное качество угла
-        minDistance=10       # минимальное расстояние между углами
+
+# ------------------------------------------------------
+#          ЗАПИСЬ РЕЗУЛЬТАТОВ: SQLITE И SQL ФАЙЛ
+# ------------------------------------------------------
+
+def create_table_sql() -> str:
+    """Текст CREATE TABLE IF NOT EXISTS для таблицы image_features."""
+    columns = table_columns()
+    lines = ["CREATE TABLE IF NOT EXISTS image_features ("]
+    lines.append("    id INTEGER PRIMARY KEY AUTOINCREMENT,")
+    for i, (name, decl) in enumerate(columns):
+        comma = "," if i < len(columns) - 1 else ""
+        lines.append(f"    {name} {decl}{comma}")
+    lines.append(");")
+    return "\n".join(lines)
+
+
+def upsert_sql(names, values_sql: str) -> str:
+    """
+    Текст UPSERT для таблицы image_features по колонкам names
+    (первая — image_path). Обновляются только переданные колонки.
+    values_sql — либо плейсхолдеры "?, ?, ...", либо готовые литералы.
+    """
+    updates = ", ".join(f"{name} = excluded.{name}" for name in names[1:])
+    return (
+        f"INSERT INTO image_features ({', '.join(names)}) VALUES ({values_sql}) "
+        f"ON CONFLICT(image_path) DO UPDATE SET {updates}"
     )
 
-    # Создаём копию изображения для рисования найденных углов
-    corners_img = img.copy()
-
-    # Если углы нашлись — рисуем точки
-    if corners is not None:
-        corners = np.intp(corners)  # преобразуем к целым координатам
-        for c in corners:
-            x, y = c.ravel()
-            cv2.circle(corners_img, (x, y), 4, (0, 0, 255), 1, lineType=cv2.LINE_AA)
-
-    # Вычисление гистограммы яркости (0–255)
-    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).flatten()
-
-    # Преобразуем в список и затем в JSON, чтобы вставить в SQL
-    hist_list = [int(v) for v in hist]
-    hist_json = json.dumps(hist_list)
-
-    # Подготавливаем пути для сохранения
-    base_name = path.stem
-    gray_path = output_dirs["grayscale"] / f"{base_name}_gray.png"
-    edges_path = output_dirs["edges"] / f"{base_name}_edges.png"
-    corners_path = output_dirs["corners"] / f"{base_name}_corners.png"
-    hist_img_path = output_dirs["histograms"] / f"{base_name}_hist.png"
-
-    # Сохраняем через Unicode-friendly функцию
-    imwrite_unicode(gray_path, gray)
-    imwrite_unicode(edges_path, edges)
-    imwrite_unicode(corners_path, corners_img)
-
-    # Сохраняем гистограмму через matplotlib (он поддерживает Unicode)
-    plt.figure()
-    plt.plot(hist)
-    plt.title(f"Histogram for {base_name}")
-    plt.xlabel("Intensity")
-    plt.ylabel("Pixel count")
-    plt.xlim([0, 256])
-    plt.tight_layout()
-    plt.savefig(str(hist_img_path))
-    plt.close()
-
-    # Приводим пути к относительным для вставки в SQL
-    orig_path_str = str(path.resolve())
-    rel_gray = os.path.relpath(gray_path, base_output_dir).replace(os.sep, "/")
-    rel_edges = os.path.relpath(edges_path, base_output_dir).replace(os.sep, "/")
-    rel_corners = os.path.relpath(corners_path, base_output_dir).replace(os.sep, "/")
-    rel_hist_img = os.path.relpath(hist_img_path, base_output_dir).replace(os.sep, "/")
-
-    # Возвращаем словарь с данными для записи в SQL
-    return {
-        "image_path": orig_path_str,
-        "width": width,
-        "height": height,
-        "hist_json": hist_json,
-        "grayscale_path": rel_gray,
-        "edges_path": rel_edges,
-        "corners_path": rel_corners,
-        "histogram_image_path": rel_hist_img,
-    }
+
+class SqliteSink:
+    """
+    Пишет записи прямо в базу SQLite:
+    - режим WAL и synchronous=NORMAL,
+    - весь запуск — одна транзакция,
+    - подготовленный UPSERT через executemany пачками по batch_size,
+      поэтому строки уходят в базу по мере готовности изображений.
+    """
+
+    def __init__(self, db_path: Path, full: bool, batch_size: int = 500):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        # Пачки строк по наборам колонок: {колонки: [значения, ...]}
+        self.pending = {}
+        self.pending_rows = 0
+        self.count = 0
+
+        # isolation_level=None — транзакцией управляем сами
+        self.conn = sqlite3.connect(str(db_path), isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("BEGIN")
+        if full:
+            self.conn.execute("DROP TABLE IF EXISTS image_features")
+        self.conn.execute(create_table_sql())
+
+    def add(self, rec: dict):
+        """Добавляет запись; вставка происходит пачками."""
+        self.pending.setdefault(tuple(rec), []).append(tuple(rec.values()))
+        self.pending_rows += 1
+        if self.pending_rows >= self.batch_size:
+            self.flush()
+
+    def delete(self, path_str: str):
+        """Удаляет запись об исчезнувшем файле."""
+        self.conn.execute("DELETE FROM image_features WHERE image_path = ?", (path_str,))
+
+    def flush(self):
+        """Вставляет накопленную пачку одним executemany на набор колонок."""
+        for names, rows in self.pending.items():
+            # sqlite3 кэширует подготовленные запросы по тексту
+            self.conn.executemany(upsert_sql(names, ", ".join("?" * len(names))), rows)
+            self.count += len(rows)
+        self.pending = {}
+        self.pending_rows = 0
+
+    def close(self):
+        """Досылает остаток и фиксирует транзакцию."""
+        self.flush()
+        self.conn.execute("COMMIT")
+        self.conn.close()
+
+
+class SqlFileSink:
+    """
+    Потоково пишет SQL файл (формат для ручного воспроизведения):
+    - команда DROP TABLE (только при полной обработке, full=True)
+    - команда CREATE TABLE IF NOT EXISTS
+    - DELETE строки для изображений, которых больше нет в папке
+    - UPSERT строки для новых и изменённых изображений
+    """
+
+    def __init__(self, sql_path: Path, full: bool):
+        self.sql_path = sql_path
+        self.count = 0
+        self.file = open(sql_path, "w", encoding="utf-8")
+        self.file.write("-- SQL script generated by image processing script\n\n")
+        if full:
+            self.file.write("DROP TABLE IF EXISTS image_features;\n\n")
+        self.file.write(create_table_sql() + "\n\n")
+
+    def add(self, rec: dict):
+        """Дописывает UPSERT для одной записи."""
+        literals = []
+        for value in rec.values():
+            if value is None:
+                literals.append("NULL")
+            elif isinstance(value, str):
+                # Экранируем строки
+                literals.append(f"'{sql_escape(value)}'")
+            elif isinstance(value, bytes):
+                # BLOB — шестнадцатеричный литерал X'...'
+                literals.append(f"X'{value.hex()}'")
+            else:
+                literals.append(str(value))
+        self.file.write(upsert_sql(tuple(rec), ", ".join(literals)) + ";\n")
+        self.count += 1
+
+    def delete(self, path_str: str):
+        """Дописывает DELETE для исчезнувшего файла."""
+        self.file.write(f"DELETE FROM image_features WHERE image_path = '{sql_escape(path_str)}';\n")
+        self.count += 1
+
+    def close(self):
+        """Закрывает файл; если изменений нет — оставляет предупреждение."""
+        if self.count == 0:
+            self.file.write("-- WARNING: no new or changed images, so there are no INSERT statements.\n")
+        self.file.close()
+
+
+def generate_sql(records, sql_path: Path, deleted_paths=(), full=True):
+    """
+    Создаёт SQL файл целиком из готового списка записей.
+    Оставлено для совместимости; main() пишет файл потоково через SqlFileSink.
+    """
+    sink = SqlFileSink(sql_path, full)
+    for path_str in deleted_paths:
+        sink.delete(path_str)
+    for rec in records:
+        sink.add(rec)
+    sink.close()
 
 
 # ------------------------------------------------------
-#                 ГЕНЕРАЦИЯ SQL ФАЙЛА
+#        ИНДЕКС ПРИЗНАКОВ: ПОХОЖИЕ И ДУБЛИКАТЫ
 # ------------------------------------------------------
 
-def generate_sql(records, sql_path: Path):
+def load_histograms(db_path: Path):
     """
-    Создаёт SQL файл:
-    - команда DROP TABLE
-    - команда CREATE TABLE
-    - INSERT строки для каждого изображения
+    Загружает все гистограммы из базы одной матрицей.
+    Возвращает (ids, paths, matrix), где matrix — массив N x 256 uint32,
+    строка i соответствует ids[i] и paths[i].
     """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        rows = conn.execute(
+            "SELECT id, image_path, histogram FROM image_features "
+            "WHERE histogram IS NOT NULL ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
 
-    lines = []
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    paths = [r[1] for r in rows]
+    # Все BLOB склеиваем и интерпретируем как одну матрицу без разбора текста
+    matrix = np.frombuffer(b"".join(r[2] for r in rows), dtype=HIST_DTYPE)
+    return ids, paths, matrix.reshape(-1, HIST_BINS)
+
+
+def hellinger_embedding(hists: np.ndarray) -> np.ndarray:
+    """
+    Переводит гистограммы в векторы sqrt(p), где p — нормированная
+    гистограмма. Тогда скалярное произведение двух векторов — это
+    коэффициент Бхаттачарьи, а расстояние Хеллингера = sqrt(1 - BC).
+    Нормировка делает сравнение независимым от размера изображения.
+    """
+    hists = np.atleast_2d(hists).astype(np.float32)
+    totals = hists.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return np.sqrt(hists / totals)
 
-    lines.append("-- SQL script generated by image processing script")
-    lines.append("")
-    lines.append("DROP TABLE IF EXISTS image_features;")
-    lines.append("")
-    lines.append("CREATE TABLE image_features (")
-    lines.append("    id INTEGER PRIMARY KEY AUTOINCREMENT,")
-    lines.append("    image_path TEXT NOT NULL,")
-    lines.append("    width INTEGER NOT NULL,")
-    lines.append("    height INTEGER NOT NULL,")
-    lines.append("    histogram TEXT NOT NULL,")
-    lines.append("    grayscale_path TEXT NOT NULL,")
-    lines.append("    edges_path TEXT NOT NULL,")
-    lines.append("    corners_path TEXT NOT NULL,")
-    lines.append("    histogram_image_path TEXT NOT NULL")
-    lines.append(");")
-    lines.append("")
 
-    # Если нет записей — предупреждаем
-    if not records:
-        lines.append("-- WARNING: no images were processed, so there are no INSERT statements.")
+def hellinger_distances(query: np.ndarray, embedded: np.ndarray) -> np.ndarray:
+    """Расстояния Хеллингера от одного вектора-запроса до всех строк матрицы."""
+    bc = embedded @ query
+    return np.sqrt(np.clip(1.0 - bc, 0.0, None))
+
+
+def find_similar(db_path: Path, query_path: Path, top: int = 5):
+    """
+    Ищет изображения с самым похожим распределением яркости.
+    Если запрос уже есть в базе, берётся его гистограмма оттуда,
+    а сам он из результатов исключается (иначе он всегда первый
+    с расстоянием 0); иначе изображение читается и гистограмма
+    считается на лету.
+    Возвращает не больше top пар (расстояние, путь), начиная с самого
+    похожего; top < 1 — ValueError.
+    """
+    if top < 1:
+        raise ValueError(f"top должно быть не меньше 1, получено {top}")
+    ids, paths, matrix = load_histograms(db_path)
+
+    query_str = str(query_path.resolve())
+    if query_str in paths:
+        row = paths.index(query_str)
+        query_hist = matrix[row]
+        matrix = np.delete(matrix, row, axis=0)
+        paths = paths[:row] + paths[row + 1:]
     else:
-        for rec in records:
-            # Экранируем строки
-            image_path = sql_escape(rec["image_path"])
-            hist_json = sql_escape(rec["hist_json"])
-            grayscale = sql_escape(rec["grayscale_path"])
-            edges = sql_escape(rec["edges_path"])
-            corners = sql_escape(rec["corners_path"])
-            histimg = sql_escape(rec["histogram_image_path"])
-
-            # Формируем INSERT
-            line = (
-                "INSERT INTO image_features "
-                "(image_path, width, height, histogram, "
-                "grayscale_path, edges_path, corners_path, histogram_image_path) "
-                f"VALUES ('{image_path}', {rec['width']}, {rec['height']}, "
-                f"'{hist_json}', '{grayscale}', '{edges}', '{corners}', '{histimg}');"
-            )
-            lines.append(line)
+        gray = imread_unicode(query_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"Не удалось прочитать файл: {query_path}")
+        query_hist = compute_histogram(gray)
+    if not paths:
+        return []
+
+    embedded = hellinger_embedding(matrix)
+    dist = hellinger_distances(hellinger_embedding(query_hist)[0], embedded)
+
+    # Частичная сортировка: нужны только top лучших
+    top = min(top, len(paths))
+    best = np.argpartition(dist, top - 1)[:top]
+    best = best[np.argsort(dist[best])]
+    return [(float(dist[i]), paths[i]) for i in best]
 
-    # Записываем SQL-файл
-    sql_path.write_text("\n".join(lines), encoding="utf-8")
+
+def find_duplicates(db_path: Path, threshold: float, chunk_rows: int = 2048):
+    """
+    Находит пары изображений (почти) одинаковой яркости:
+    расстояние Хеллингера <= threshold.
+    Попарное сравнение — матричное умножение E @ E.T, которое
+    считается блоками по chunk_rows строк, чтобы не держать N x N целиком.
+    Возвращает список (расстояние, путь_1, путь_2).
+    """
+    ids, paths, matrix = load_histograms(db_path)
+    embedded = hellinger_embedding(matrix)
+    # BC >= 1 - threshold^2  <=>  расстояние <= threshold
+    min_bc = 1.0 - threshold * threshold
+
+    pairs = []
+    for start in range(0, len(paths), chunk_rows):
+        block = embedded[start:start + chunk_rows] @ embedded.T
+        rows, cols = np.nonzero(block >= min_bc)
+        rows += start
+        # Каждую пару берём один раз и без сравнения с самим собой
+        keep = rows < cols
+        for i, j in zip(rows[keep], cols[keep]):
+            dist = float(np.sqrt(max(0.0, 1.0 - block[i - start, j])))
+            pairs.append((dist, paths[i], paths[j]))
+    pairs.sort()
+    return pairs
 
 
 # ------------------------------------------------------
@@ -246,20 +1460,126 @@ def generate_sql(records, sql_path: Path):
 def main():
     """
     Основная точка входа:
-    - Проверяет аргументы
+    - Разбирает аргументы
     - Создаёт папки output
     - Ищет изображения
-    - Обрабатывает каждое
-    - Создаёт SQL файл
+    - Обрабатывает новые и изменённые (по манифесту)
+    - Сразу пишет результаты в SQLite и/или SQL файл
     """
 
-    # Проверка, что передан 1 аргумент — папка
-    if len(sys.argv) != 2:
-        print("Usage: python script.py /path/to/folder")
+    parser = argparse.ArgumentParser(
+        description="Извлечение признаков из изображений и генерация SQL."
+    )
+    parser.add_argument("folder", help="папка с изображениями")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="игнорировать манифест, пересчитать всё и пересоздать таблицу",
+    )
+    parser.add_argument(
+        "--format", choices=("sqlite", "sql", "both"), default="sqlite",
+        help="куда писать признаки: база SQLite, SQL файл или оба (по умолчанию sqlite)",
+    )
+    parser.add_argument(
+        "--db", default=None,
+        help="путь к базе SQLite (по умолчанию output/image_features.db)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="число рабочих потоков обработки (по умолчанию 1)",
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=64,
+        help="максимум изображений в работе одновременно (по умолчанию 64)",
+    )
+    parser.add_argument(
+        "--memory-budget", metavar="MB", type=int, default=0,
+        help="бюджет памяти на одно изображение в МБ; большие картинки "
+             "обрабатываются полосами/уменьшенными (по умолчанию без ограничения)",
+    )
+    parser.add_argument(
+        "--stages", default=None,
+        help="этапы через запятую, например histogram,edges "
+             f"(доступны: {', '.join(STAGES)}; по умолчанию {','.join(DEFAULT_STAGES)})",
+    )
+    parser.add_argument(
+        "--param", action="append", default=[], metavar="STAGE.NAME=VALUE",
+        help="параметр этапа, например edges.threshold1=50 (можно повторять)",
+    )
+    parser.add_argument(
+        "--pipeline", metavar="JSON", default=None,
+        help='файл конвейера: {"stages": {"этап": {параметры}, ...}}',
+    )
+    parser.add_argument(
+        "--image-format", choices=("png", "webp"), default="png",
+        help="формат сохраняемых картинок: png или webp без потерь (по умолчанию png)",
+    )
+    parser.add_argument(
+        "--png-level", type=int, choices=range(10), default=None, metavar="0..9",
+        help="уровень сжатия PNG (меньше — быстрее, больше файлы)",
+    )
+    parser.add_argument(
+        "--skip-images", default="", metavar="KINDS",
+        help=f"не сохранять картинки этих видов через запятую или all ({', '.join(OUTPUT_KINDS)})",
+    )
+    parser.add_argument(
+        "--archive", choices=("zip", "tar"), default=None,
+        help="складывать картинки в один архив output/derived.zip (.tar), обновляемый каждым запуском",
+    )
+    parser.add_argument(
+        "--writer-threads", type=int, default=2,
+        help="потоки кодирования и записи картинок (0 — синхронно, по умолчанию 2)",
+    )
+    parser.add_argument(
+        "--metrics", metavar="JSON", default=None,
+        help="сохранить сводку замеров по шагам в JSON файл",
+    )
+    parser.add_argument(
+        "--trace", metavar="CSV", default=None,
+        help="сохранить замеры по каждому изображению в CSV файл",
+    )
+    parser.add_argument(
+        "--similar", metavar="IMAGE", default=None,
+        help="не обрабатывать, а найти в базе изображения, похожие на IMAGE",
+    )
+    parser.add_argument(
+        "--top", type=int, default=5,
+        help="сколько похожих изображений выводить (по умолчанию 5)",
+    )
+    parser.add_argument(
+        "--duplicates", metavar="THRESHOLD", type=float, default=None,
+        help="не обрабатывать, а вывести пары с расстоянием Хеллингера <= THRESHOLD",
+    )
+    args = parser.parse_args()
+
+    # Конвейер: файл конфигурации, затем --stages и --param поверх него
+    stage_names = list(DEFAULT_STAGES)
+    overrides = {}
+    try:
+        if args.pipeline:
+            config = json.loads(Path(args.pipeline).read_text(encoding="utf-8"))
+            stage_names, overrides = parse_pipeline_config(config)
+        if args.stages:
+            stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+        for item in args.param:
+            key, sep, value = item.partition("=")
+            stage_name, dot, param_name = key.partition(".")
+            if not sep or not dot:
+                raise ValueError(f"Ожидается STAGE.NAME=VALUE: {item}")
+            overrides.setdefault(stage_name, {})[param_name] = parse_param_value(value)
+        pipeline = build_pipeline(stage_names, overrides)
+        if args.skip_images == "all":
+            skip_images = sorted(OUTPUT_KINDS)
+        else:
+            skip_images = sorted(k.strip() for k in args.skip_images.split(",") if k.strip())
+        unknown = set(skip_images) - set(OUTPUT_KINDS)
+        if unknown:
+            raise ValueError(f"Неизвестные виды картинок: {', '.join(sorted(unknown))}")
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Некорректный конвейер: {e}")
         sys.exit(1)
 
     # Приводим путь к нормальной форме
-    input_dir = Path(sys.argv[1]).expanduser().resolve()
+    input_dir = Path(args.folder).expanduser().resolve()
 
     # Проверка существования
     if not input_dir.exists() or not input_dir.is_dir():
@@ -268,57 +1588,175 @@ def main():
 
     # Создаём папку output внутри входящей папки
     output_dir = input_dir / "output"
-    output_dir.mkdir(exist_ok=True)
+    db_path = Path(args.db).expanduser() if args.db else output_dir / "image_features.db"
 
-    # Подпапки для результатов
-    grayscale_dir = output_dir / "grayscale"
-    edges_dir = output_dir / "edges"
-    corners_dir = output_dir / "corners"
-    histograms_dir = output_dir / "histograms"
-
-    # Создаём подпапки если их нет
-    for d in (grayscale_dir, edges_dir, corners_dir, histograms_dir):
-        d.mkdir(exist_ok=True)
-
-    # Словарь путей — удобно передавать в функцию
-    output_dirs = {
-        "grayscale": grayscale_dir,
-        "edges": edges_dir,
-        "corners": corners_dir,
-        "histograms": histograms_dir,
-    }
+    # Режимы поиска работают по готовой базе и ничего не обрабатывают
+    if args.similar is not None or args.duplicates is not None:
+        if not db_path.exists():
+            print(f"[ERROR] База не найдена: {db_path}")
+            sys.exit(1)
+        if args.similar is not None:
+            query_path = Path(args.similar).expanduser()
+            if args.top < 1:
+                print(f"[ERROR] --top должно быть не меньше 1: {args.top}")
+                sys.exit(1)
+            for dist, path_str in find_similar(db_path, query_path, args.top):
+                print(f"{dist:.4f}  {path_str}")
+        else:
+            for dist, path_a, path_b in find_duplicates(db_path, args.duplicates):
+                print(f"{dist:.4f}  {path_a}  {path_b}")
+        return
+
+    output_dir.mkdir(exist_ok=True)
 
     print(f"[INFO] Input folder:  {input_dir}")
     print(f"[INFO] Output folder: {output_dir}")
+    print(f"[INFO] Этапы: {', '.join(name for name, _ in pipeline)}")
 
-    # Ищем все изображения
-    image_files = find_images(input_dir)
-    print(f"[INFO] Найдено изображений: {len(image_files)}")
-    for p in image_files:
-        print(f"    [IMG] {p}")
+    # Манифест прошлого запуска. Если его нет — обработка полная.
+    manifest_path = output_dir / MANIFEST_NAME
+    memory_budget = args.memory_budget * 1024 * 1024
+    output_options = {
+        "format": args.image_format,
+        "png_level": args.png_level,
+        "skip": skip_images,
+        "archive": args.archive,
+    }
+    use_sqlite = args.format in ("sqlite", "both")
+    sink_options = {
+        "format": args.format,
+        "db": str(db_path.resolve()) if use_sqlite else None,
+    }
+    params = processing_params(pipeline, memory_budget, output_options, sink_options)
+    if args.full:
+        manifest = {"version": MANIFEST_VERSION, "params": params, "files": {}}
+    else:
+        manifest = load_manifest(manifest_path, params)
+        if manifest["files"] and use_sqlite and not table_has_rows(db_path):
+            # Базу удалили или очистили: пропущенных строк в ней нет
+            print(f"[INFO] В базе нет прошлых результатов, обработка будет полной: {db_path}")
+            manifest = {"version": MANIFEST_VERSION, "params": params, "files": {}}
+    old_files = manifest["files"]
+    full = not old_files
+    new_files = {}
 
-    # Если нет — создаём SQL без вставок
-    if not image_files:
-        print("[WARN] Изображения не найдены!")
-        sql_path = output_dir / "image_features.sql"
-        generate_sql([], sql_path)
-        print(f"[INFO] Пустой SQL файл сохранён в: {sql_path}")
-        sys.exit(0)
-
-    # Обрабатываем изображения
-    records = []
-    for img_path in image_files:
-        print(f"[INFO] Обработка: {img_path}")
-        rec = process_image(img_path, output_dirs, output_dir)
-        if rec:
-            records.append(rec)
-
-    # Создаём SQL
+    # Приёмники результатов: строки уходят туда сразу после обработки
+    sinks = []
     sql_path = output_dir / "image_features.sql"
-    generate_sql(records, sql_path)
+    if use_sqlite:
+        sinks.append(SqliteSink(db_path, full))
+    if args.format in ("sql", "both"):
+        sinks.append(SqlFileSink(sql_path, full))
+
+    # Замеры шагов; в трассировке — чтение, декодирование и этапы
+    metrics = Metrics(
+        trace_path=Path(args.trace).expanduser() if args.trace else None,
+        trace_steps=["read", "decode"] + [name for name, _ in pipeline],
+    )
+
+    # Писатель картинок; подпапки создаются только для реально сохраняемых
+    writer = OutputWriter(
+        output_dir,
+        image_format=args.image_format,
+        png_level=args.png_level,
+        skip=skip_images,
+        archive=args.archive,
+        threads=args.writer_threads,
+        metrics=metrics,
+    )
+
+    # Счётчики для сводки прогресса
+    found = 0
+    processed = 0
+    skipped = 0
+    progress = ProgressLog()
+
+    def changed_images():
+        """
+        Потоково ищет изображения (кроме папки output) и отдаёт
+        только новые и изменённые; неизменённые сразу переносятся
+        в новый манифест.
+        """
+        nonlocal found, skipped
+        for img_path in iter_images(input_dir, exclude_dir=output_dir):
+            found += 1
+            with metrics.timer("stat"):
+                path_str = str(img_path.resolve())
+                signature = file_signature(img_path)
+            entry = old_files.get(path_str)
+            if entry is not None and entry["signature"] == signature:
+                new_files[path_str] = entry
+                skipped += 1
+                progress.update(found, processed, skipped)
+                continue
+            yield img_path, path_str, signature
 
-    print(f"[INFO] Готово. Обработано изображений: {len(records)}")
-    print(f"[INFO] SQL файл сохранён в: {sql_path}")
+    def handle(task):
+        return process_image(task[0], pipeline, writer, memory_budget, metrics)
+
+    # Поиск файлов идёт в этом потоке одновременно с обработкой в пуле;
+    # результаты пишем здесь же, т.к. соединение SQLite однопоточное
+    for (img_path, path_str, signature), result in run_bounded(
+        handle, changed_images(), args.workers, args.queue_size
+    ):
+        if result:
+            rec, outputs = result
+            with metrics.timer("db"):
+                for sink in sinks:
+                    sink.add(rec)
+            processed += 1
+            new_files[path_str] = {"signature": signature, "outputs": outputs}
+        progress.update(found, processed, skipped)
+    progress.update(found, processed, skipped, force=True)
+
+    # Файлы, которые были в манифесте, но исчезли из папки
+    deleted_paths = [p for p in old_files if p not in new_files]
+    for path_str in deleted_paths:
+        for sink in sinks:
+            sink.delete(path_str)
+    # Картинки удаляются, только если на них не ссылается ни одна запись
+    # нового манифеста; в режиме архива их отбрасывает writer.close()
+    kept = {rel for entry in new_files.values() for rel in entry["outputs"]}
+    if writer.archive is None:
+        for entry in old_files.values():
+            for rel in entry["outputs"]:
+                if rel not in kept:
+                    (output_dir / rel).unlink(missing_ok=True)
+
+    if found == 0:
+        print("[WARN] Изображения не найдены!")
+
+    # Дожидаемся записи всех картинок, затем фиксируем транзакцию / SQL файл
+    writer.close(keep=kept)
+    with metrics.timer("db"):
+        for sink in sinks:
+            sink.close()
+    metrics.close()
+
+    # Манифест сохраняем последним — после успешной записи результатов
+    manifest["files"] = new_files
+    save_manifest(manifest, manifest_path)
+
+    print(
+        f"[INFO] Готово. Обработано: {processed}, без изменений: {skipped}, "
+        f"удалено: {len(deleted_paths)}"
+    )
+    if args.format in ("sqlite", "both"):
+        print(f"[INFO] База SQLite: {db_path}")
+    if args.format in ("sql", "both"):
+        print(f"[INFO] SQL файл сохранён в: {sql_path}")
+    if args.metrics:
+        summary = metrics.summary(writer.bytes_written)
+        metrics_path = Path(args.metrics).expanduser()
+        metrics_path.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[INFO] Замеры сохранены в: {metrics_path}")
+        for name, step in sorted(summary["steps"].items(), key=lambda kv: -kv[1]["total"]):
+            print(
+                f"    {name:<16} n={step['count']:<6} total={step['total']:.3f}s "
+                f"p50={step['p50'] * 1000:.1f}ms p95={step['p95'] * 1000:.1f}ms"
+            )
+    if args.trace:
+        print(f"[INFO] Трассировка сохранена в: {args.trace}")
 
 
 # Точка входа
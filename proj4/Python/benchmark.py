@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# Запуск: "python benchmark.py" (из папки проекта), подробности — "python benchmark.py -h"
+
+"""
+Бенчмарк деревьев из main.py: все варианты хранения на одних и тех же
+нагрузках, чтобы выбор структуры данных опирался на цифры.
+
+1) Для каждого размера n (10^3 … 10^7) и каждой нагрузки генерируются
+   ключи и запросы с фиксированным seed:
+   - sorted — вставка по возрастанию, поиск и удаление по порядку,
+   - random — вставка и запросы в случайном порядке,
+   - zipf — вставка случайная, поиск по закону Ципфа (s = 1):
+     немногие «горячие» ключи спрашивают намного чаще остальных,
+   - mixed — после загрузки смесь 80% поиска (Ципф), 10% вставки,
+     10% удаления.
+2) Каждый вариант дерева (backend) проходит фазы insert, search, batch
+   (те же запросы одним вызовом search_many, если он есть), mixed
+   (только для mixed), delete и traverse (полный inorder); для каждой
+   фазы считается ops/s. Статические раскладки (BULK_BACKENDS) строятся
+   через bulk_load: вставка по одному ключу у них O(n), поэтому вместо
+   insert/s у них заполнен отдельный столбец bulk/s (build_ops) —
+   ключей в секунду при построении, с этими числами не сравнимый.
+3) Отдельным прогоном под tracemalloc замеряется пиковая память
+   построения; записываются высота дерева и безопасность по рекурсии
+   (высота меньше sys.getrecursionlimit() и ни одна операция не упала
+   с RecursionError).
+4) Таблица печатается и при --output сохраняется в JSON.
+"""
+
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from pathlib import Path
+
+from main import BinarySearchTree, AVLTree, RedBlackTree, EytzingerTree
+
+# Варианты дерева: имя -> фабрика пустого дерева. Бенчмарк вызывает только
+# общие методы (insert, search, search_many, delete, iter_inorder, height)
+BACKENDS = {
+    "plain": lambda: BinarySearchTree(),
+    "avl": lambda: AVLTree(),
+    "rb": lambda: RedBlackTree(),
+    "avl-arena": lambda: AVLTree(arena=True),
+    "rb-arena": lambda: RedBlackTree(arena=True),
+    "rb-persistent": lambda: RedBlackTree(persistent=True),
+    "eytzinger": lambda: EytzingerTree(),
+}
+
+# Варианты, которые строятся bulk_load, а не вставкой по ключу
+BULK_BACKENDS = {"eytzinger"}
+
+WORKLOADS = ("sorted", "random", "zipf", "mixed")
+
+# Обычное BST на отсортированном входе вырождается в список:
+# вставка n ключей — O(n^2), поэтому выше этого n такой случай пропускаем
+PLAIN_SORTED_LIMIT = 10_000
+
+
+# ------------------------------------------------------
+#                   ГЕНЕРАЦИЯ НАГРУЗОК
+# ------------------------------------------------------
+
+def zipf_sample(rng: random.Random, ranked: list, count: int) -> list:
+    """
+    count ключей из ranked по закону Ципфа с s = 1: ранг r выпадает
+    с вероятностью ~1/r. Ранг берётся как n^u (u равномерно в [0, 1)) —
+    у непрерывного аналога ровно такая плотность, и не нужна таблица
+    накопленных весов на n элементов.
+    """
+    n = len(ranked)
+    return [ranked[int(n ** rng.random()) - 1] for _ in range(count)]
+
+
+def make_workload(name: str, n: int, ops: int, seed: int) -> dict:
+    """
+    Ключи и запросы нагрузки name для n ключей и ops запросов на фазу.
+    Ключи дерева — чётные числа 0 … 2n-2, нечётные остаются для вставок
+    в смешанной нагрузке.
+    """
+    rng = random.Random(seed)
+    keys = list(range(0, 2 * n, 2))
+    ops = min(ops, n)
+
+    if name == "sorted":
+        return {"insert": keys, "search": keys[:ops], "delete": keys[:ops]}
+
+    shuffled = keys[:]
+    rng.shuffle(shuffled)
+    work = {"insert": shuffled, "delete": rng.sample(keys, ops)}
+    if name == "random":
+        work["search"] = rng.sample(keys, ops)
+        return work
+
+    # Горячие ключи разбросаны по всему дереву, а не собраны в одном углу
+    ranked = shuffled
+    work["search"] = zipf_sample(rng, ranked, ops)
+    if name == "mixed":
+        reads = zipf_sample(rng, ranked, ops)
+        mixed = []
+        for key in reads:
+            dice = rng.random()
+            if dice < 0.8:
+                mixed.append(("search", key))
+            elif dice < 0.9:
+                mixed.append(("insert", 2 * rng.randrange(n) + 1))
+            else:
+                mixed.append(("delete", rng.choice(keys)))
+        work["mixed"] = mixed
+    return work
+
+
+# ------------------------------------------------------
+#                 ПРОГОН ОДНОГО СЛУЧАЯ
+# ------------------------------------------------------
+
+def timed(func) -> float:
+    """Время выполнения func() в секундах."""
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds > 0 else float("inf")
+
+
+def run_case(backend: str, workload: str, n: int, work: dict, measure_memory: bool) -> dict:
+    """
+    Прогоняет все фазы нагрузки на дереве backend.
+    Возвращает строку итоговой таблицы.
+    """
+    row = {"backend": backend, "workload": workload, "n": n}
+    make_tree = BACKENDS[backend]
+    gc.collect()
+
+    try:
+        tree = make_tree()
+        if backend in BULK_BACKENDS:
+            row["build_ops"] = rate(n, timed(lambda: tree.bulk_load(work["insert"])))
+        else:
+            insert = tree.insert
+            row["insert_ops"] = rate(n, timed(lambda: [insert(k) for k in work["insert"]]))
+        row["height"] = tree.height()
+
+        search = tree.search
+        row["search_ops"] = rate(len(work["search"]), timed(lambda: [search(k) for k in work["search"]]))
+        if hasattr(tree, "search_many"):
+            row["batch_ops"] = rate(len(work["search"]), timed(lambda: tree.search_many(work["search"])))
+
+        if "mixed" in work:
+            def mixed():
+                for op, key in work["mixed"]:
+                    if op == "search":
+                        tree.search(key)
+                    elif op == "insert":
+                        tree.insert(key)
+                    else:
+                        tree.delete(key)
+            row["mixed_ops"] = rate(len(work["mixed"]), timed(mixed))
+
+        count = len(tree)
+        row["traverse_keys"] = rate(count, timed(lambda: sum(1 for _ in tree.iter_inorder())))
+
+        delete = tree.delete
+        row["delete_ops"] = rate(len(work["delete"]), timed(lambda: [delete(k) for k in work["delete"]]))
+        row["recursion_safe"] = row["height"] < sys.getrecursionlimit()
+    except RecursionError:
+        row["recursion_safe"] = False
+        row["error"] = "RecursionError"
+        return row
+
+    if measure_memory:
+        tree = None   # освобождаем дерево до замера памяти
+        gc.collect()
+        tracemalloc.start()
+        try:
+            tree = make_tree()
+            if backend in BULK_BACKENDS:
+                tree.bulk_load(work["insert"])
+            else:
+                for key in work["insert"]:
+                    tree.insert(key)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        row["peak_mb"] = peak / (1024 * 1024)
+        row["bytes_per_key"] = peak / n
+    return row
+
+
+# ------------------------------------------------------
+#                     ОСНОВНАЯ ФУНКЦИЯ
+# ------------------------------------------------------
+
+def parse_list(text: str, allowed) -> list:
+    """'a,b' -> ['a', 'b'] с проверкой по списку допустимых."""
+    items = [x.strip() for x in text.split(",") if x.strip()]
+    unknown = [x for x in items if x not in allowed]
+    if unknown:
+        print(f"[ERROR] Неизвестные значения: {', '.join(unknown)} (доступны: {', '.join(allowed)})")
+        sys.exit(1)
+    return items
+
+
+def fmt_rate(value) -> str:
+    if value is None:
+        return "-"
+    if value >= 1e6:
+        return f"{value / 1e6:.2f}M"
+    if value >= 1e3:
+        return f"{value / 1e3:.1f}k"
+    return f"{value:.0f}"
+
+
+def main():
+    """
+    Основная точка входа:
+    - Генерирует нагрузки
+    - Прогоняет все варианты дерева на каждой нагрузке и размере
+    - Печатает и сохраняет таблицу
+    """
+    parser = argparse.ArgumentParser(description="Бенчмарк вариантов дерева из main.py.")
+    parser.add_argument(
+        "--sizes", default="1e3,1e4,1e5",
+        help="число ключей через запятую, до 1e7 (по умолчанию 1e3,1e4,1e5)",
+    )
+    parser.add_argument(
+        "--backends", default=",".join(BACKENDS),
+        help=f"варианты дерева через запятую (доступны: {', '.join(BACKENDS)})",
+    )
+    parser.add_argument(
+        "--workloads", default=",".join(WORKLOADS),
+        help=f"нагрузки через запятую (доступны: {', '.join(WORKLOADS)})",
+    )
+    parser.add_argument("--ops", type=int, default=100_000, help="запросов на фазу (не больше n)")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора нагрузок")
+    parser.add_argument("--no-memory", action="store_true", help="не замерять память (вдвое быстрее)")
+    parser.add_argument(
+        "--plain-sorted-limit", type=int, default=PLAIN_SORTED_LIMIT,
+        help=f"наибольшее n для plain на sorted — там O(n^2) (по умолчанию {PLAIN_SORTED_LIMIT})",
+    )
+    parser.add_argument("--output", default=None, help="сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    sizes = [int(float(x)) for x in args.sizes.split(",") if x.strip()]
+    backends = parse_list(args.backends, BACKENDS)
+    workloads = parse_list(args.workloads, WORKLOADS)
+
+    results = []
+    for n in sizes:
+        for workload in workloads:
+            work = make_workload(workload, n, args.ops, args.seed)
+            for backend in backends:
+                if backend == "plain" and workload == "sorted" and n > args.plain_sorted_limit:
+                    print(f"[INFO] {backend}/{workload}/n={n}: пропуск (O(n^2))")
+                    results.append({"backend": backend, "workload": workload, "n": n,
+                                    "skipped": "O(n^2) on sorted input"})
+                    continue
+                print(f"[INFO] {backend}/{workload}/n={n}...")
+                row = run_case(backend, workload, n, work, not args.no_memory)
+                if "error" in row:
+                    print(f"    [ERROR] {row['error']}")
+                results.append(row)
+
+    # Итоговая таблица
+    print()
+    print(
+        f"{'backend':<14} {'workload':<8} {'n':>9} {'insert/s':>9} {'bulk/s':>9} {'search/s':>9} {'batch/s':>9} {'mixed/s':>9} "
+        f"{'delete/s':>9} {'trav/s':>9} {'peak MB':>8} {'B/key':>6} {'height':>7}  recursion"
+    )
+    for row in results:
+        if "skipped" in row:
+            print(f"{row['backend']:<14} {row['workload']:<8} {row['n']:>9}  skipped: {row['skipped']}")
+            continue
+        peak = f"{row['peak_mb']:.1f}" if "peak_mb" in row else "-"
+        per_key = f"{row['bytes_per_key']:.0f}" if "bytes_per_key" in row else "-"
+        print(
+            f"{row['backend']:<14} {row['workload']:<8} {row['n']:>9} "
+            f"{fmt_rate(row.get('insert_ops')):>9} {fmt_rate(row.get('build_ops')):>9} "
+            f"{fmt_rate(row.get('search_ops')):>9} "
+            f"{fmt_rate(row.get('batch_ops')):>9} "
+            f"{fmt_rate(row.get('mixed_ops')):>9} {fmt_rate(row.get('delete_ops')):>9} "
+            f"{fmt_rate(row.get('traverse_keys')):>9} {peak:>8} {per_key:>6} "
+            f"{row.get('height', '-'):>7}  {'ok' if row.get('recursion_safe') else 'UNSAFE'}"
+        )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[INFO] Результаты сохранены в: {args.output}")
+
+
+# Точка входа
+if __name__ == "__main__":
+    main()
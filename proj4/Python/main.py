@@ -1,5 +1,20 @@
+import gc
+import sys
+import heapq
+import mmap
+import queue
+import struct
+import threading
 import tkinter as tk
-from tkinter import ttk, messagebox
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from tkinter import ttk, messagebox, filedialog, font as tkfont
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен: без него search_many ищет по одному ключу
+    np = None
 
 
 # ==============================
@@ -12,12 +27,650 @@ class TreeNode:
     Каждый узел хранит:
     - key: значение (целое число),
     - left: ссылка на левого потомка,
-    - right: ссылка на правого потомка.
+    - right: ссылка на правого потомка,
+    - height: высота поддерева с корнем в этом узле (лист = 0),
+    - size: число узлов в этом поддереве.
+    height и size поддерживаются вставкой/удалением (update_node),
+    поэтому высота дерева и порядковые запросы не требуют обхода.
+
+    __slots__ убирает у каждого узла словарь атрибутов: узел занимает
+    в несколько раз меньше памяти, что важно для миллионов ключей.
     """
+    __slots__ = ("key", "left", "right", "height", "size")
+
     def __init__(self, key):
         self.key = key     # ключ (значение узла)
         self.left = None   # левый ребёнок
         self.right = None  # правый ребёнок
+        self.height = 0    # высота поддерева
+        self.size = 1      # размер поддерева
+
+    def copy(self):
+        """Копия узла с теми же детьми (для персистентного режима)."""
+        node = type(self)(self.key)
+        node.left, node.right = self.left, self.right
+        node.height, node.size = self.height, self.size
+        return node
+
+
+def node_height(node):
+    """Высота поддерева (пустое = -1)."""
+    return node.height if node is not None else -1
+
+
+def node_size(node):
+    """Число узлов в поддереве (пустое = 0)."""
+    return node.size if node is not None else 0
+
+
+def update_node(node):
+    """Пересчитывает height и size узла по его детям."""
+    left, right = node.left, node.right
+    node.height = 1 + max(node_height(left), node_height(right))
+    node.size = 1 + node_size(left) + node_size(right)
+
+
+def batch_flags(keys, batch, flags):
+    """
+    Переводит флаги пакетной операции из порядка batch (отсортированные
+    уникальные ключи) в порядок keys: array('b'), где 1 получает только
+    первое вхождение ключа с флагом.
+    """
+    result = array("b", bytes(len(keys)))
+    for i, key in enumerate(keys):
+        j = bisect_left(batch, key)
+        if flags[j]:
+            result[i] = 1
+            flags[j] = 0
+    return result
+
+
+class RBNode(TreeNode):
+    """
+    Узел красно-чёрного дерева: дополнительно хранит цвет
+    ссылки от родителя (red = True — красная ссылка).
+    Новый узел всегда красный.
+    """
+    __slots__ = ("red",)
+
+    def __init__(self, key):
+        # Поля задаются здесь же, без super().__init__: узлы создаются
+        # миллионами (bulk_load), и лишний вызов заметен
+        self.key = key
+        self.left = None
+        self.right = None
+        self.height = 0
+        self.size = 1
+        self.red = True
+
+    def copy(self):
+        node = super().copy()
+        node.red = self.red
+        return node
+
+
+@contextmanager
+def gc_paused():
+    """
+    Временно выключает циклический сборщик мусора. При создании
+    миллиона узлов подряд он запускается снова и снова и сканирует
+    все уже созданные узлы, хотя циклов между ними нет.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# ---------- РАСКЛАДКИ ДЛЯ МАССОВОЙ ЗАГРУЗКИ ----------
+# Раскладка — форма дерева из n отсортированных ключей, посчитанная
+# заранее по индексам: кортеж (left, right, size, height, red, root),
+# где первые пять — массивы длины n (left/right/size/height — array('i'),
+# red — array('b')), узел i хранит i-й ключ, а -1 — пустая ссылка.
+# По раскладке арена заполняется копированием массивов целиком, а узлы-
+# объекты связываются за один проход — без рекурсии по дереву.
+
+# С какого числа ключей раскладку считает numpy: на малых поддеревьях
+# insert_many накладные расходы векторных операций больше выигрыша
+LAYOUT_NUMPY_MIN = 2048
+
+
+def _layout_arrays(n, left, right, size, height, red, root):
+    """Переводит массивы numpy (длины n или больше) в раскладку из array."""
+    return (
+        array("i", left[:n].astype(np.int32).tobytes()),
+        array("i", right[:n].astype(np.int32).tobytes()),
+        array("i", size[:n].astype(np.int32).tobytes()),
+        array("i", height[:n].astype(np.int32).tobytes()),
+        array("b", red[:n].astype(np.int8).tobytes()),
+        root,
+    )
+
+
+def balanced_layout(n):
+    """
+    Идеально сбалансированное дерево: корень отрезка [lo, hi) — его
+    середина, размер узла — длина отрезка, высота — floor(log2(размер)).
+    Высота всего дерева минимальна: floor(log2(n)).
+    """
+    if np is not None and n >= LAYOUT_NUMPY_MIN:
+        # Все отрезки одного уровня обрабатываются разом: log2(n) шагов
+        left = np.full(n, -1, dtype=np.int64)
+        right = np.full(n, -1, dtype=np.int64)
+        size = np.ones(n, dtype=np.int64)
+        height = np.zeros(n, dtype=np.int64)
+        lo = np.zeros(1, dtype=np.int64)
+        hi = np.array([n], dtype=np.int64)
+        while len(lo):
+            mid = (lo + hi) // 2
+            size[mid] = hi - lo
+            height[mid] = np.frexp(hi - lo)[1] - 1   # floor(log2), точно для целых
+            has_left, has_right = lo < mid, mid + 1 < hi
+            left[mid[has_left]] = (lo + mid)[has_left] // 2
+            right[mid[has_right]] = (mid + 1 + hi)[has_right] // 2
+            lo, hi = (np.concatenate([lo[has_left], mid[has_right] + 1]),
+                      np.concatenate([mid[has_left], hi[has_right]]))
+        return _layout_arrays(n, left, right, size, height, np.zeros(n, dtype=np.int8), n // 2)
+
+    left = array("i", [-1]) * n
+    right = array("i", [-1]) * n
+    size = array("i", [1]) * n
+    height = array("i", [0]) * n
+    # Отрезки длины 1 — листья, для них значения по умолчанию уже верны
+    stack = [(0, n)] if n > 1 else []
+    while stack:
+        lo, hi = stack.pop()
+        mid = (lo + hi) // 2
+        size[mid] = hi - lo
+        height[mid] = (hi - lo).bit_length() - 1
+        if lo < mid:
+            left[mid] = (lo + mid) // 2
+            if mid - lo > 1:
+                stack.append((lo, mid))
+        if mid + 1 < hi:
+            right[mid] = (mid + 1 + hi) // 2
+            if hi - mid > 2:
+                stack.append((mid + 1, hi))
+    return left, right, size, height, array("b", bytes(n)), n // 2 if n else -1
+
+
+def llrb_layout(n):
+    """
+    Левостороннее красно-чёрное дерево через 2-3 дерево. Берётся
+    наибольшая чёрная высота b, при которой n ключей помещаются в 2-3
+    дерево (от 2^b - 1 до 3^b - 1 ключей), и каждый отрезок становится
+    2-узлом или, если в два поддерева высоты b - 1 ключи не влезают,
+    3-узлом (чёрный узел с красным левым ребёнком и три поддерева поровну).
+
+    Ссылки и размеры расставляются сверху вниз, высоты — снизу вверх.
+    Массивы на один элемент длиннее: индекс -1 попадает в этот лишний
+    элемент, где высота пустого поддерева -1, а left[-1] хранит корень.
+    """
+    if n == 0:
+        return array("i"), array("i"), array("i"), array("i"), array("b"), -1
+    black_height = (n + 1).bit_length() - 1
+    # Максимум ключей в 2-3 дереве чёрной высоты b: 3^b - 1
+    capacity = [3 ** b - 1 for b in range(black_height + 1)]
+
+    if np is not None and n >= LAYOUT_NUMPY_MIN:
+        left = np.full(n + 1, -1, dtype=np.int64)
+        right = np.full(n + 1, -1, dtype=np.int64)
+        size = np.zeros(n + 1, dtype=np.int64)
+        height = np.full(n + 1, -1, dtype=np.int64)
+        red = np.zeros(n + 1, dtype=np.int8)
+        lo = np.zeros(1, dtype=np.int64)
+        hi = np.array([n], dtype=np.int64)
+        parent = np.array([n], dtype=np.int64)
+        is_right = np.zeros(1, dtype=bool)
+        # Отрезки одного шага имеют одну чёрную высоту b; уровни
+        # запоминаются, чтобы потом посчитать высоты в обратном порядке
+        levels = []
+        for b in range(black_height, 0, -1):
+            if not len(lo):
+                break
+            count = hi - lo
+            two = count - 1 <= 2 * capacity[b - 1]
+            mid = lo + count // 2
+            q, r = np.divmod(count - 2, 3)
+            first = lo + q + (r > 0)
+            second = first + 1 + q + (r > 1)
+            root = np.where(two, mid, second)
+            right[parent[is_right]] = root[is_right]
+            left[parent[~is_right]] = root[~is_right]
+            size[root] = count
+            three = ~two
+            first, second, lo3, hi3 = first[three], second[three], lo[three], hi[three]
+            red[first] = 1
+            left[second] = first
+            size[first] = second - lo3
+            levels.append((first, root))
+
+            mid, lo2, hi2 = mid[two], lo[two], hi[two]
+            child_lo = np.concatenate([lo2, mid + 1, lo3, first + 1, second + 1])
+            child_hi = np.concatenate([mid, hi2, first, second, hi3])
+            child_parent = np.concatenate([mid, mid, first, first, second])
+            child_right = np.concatenate([
+                np.zeros(len(mid), dtype=bool), np.ones(len(mid), dtype=bool),
+                np.zeros(len(first), dtype=bool), np.ones(2 * len(first), dtype=bool),
+            ])
+            keep = child_lo < child_hi
+            lo, hi = child_lo[keep], child_hi[keep]
+            parent, is_right = child_parent[keep], child_right[keep]
+
+        # Дети красного узла лежат уровнем ниже, а сам он — левый ребёнок
+        # чёрного узла своего уровня, поэтому красные считаются первыми
+        for reds, blacks in reversed(levels):
+            for nodes in (reds, blacks):
+                height[nodes] = np.maximum(height[left[nodes]], height[right[nodes]]) + 1
+        return _layout_arrays(n, left, right, size, height, red, int(left[n]))
+
+    left = array("i", [-1]) * (n + 1)
+    right = array("i", [-1]) * (n + 1)
+    size = array("i", [0]) * (n + 1)
+    height = array("i", [-1]) * (n + 1)
+    red = array("b", bytes(n + 1))
+    links = (left, right)
+    # Узлы в порядке обхода сверху вниз: в обратном порядке дети
+    # встречаются раньше родителей
+    order = []
+    stack = [(0, n, black_height, n, 0)]
+    while stack:
+        lo, hi, b, parent, side = stack.pop()
+        count = hi - lo
+        if count - 1 <= 2 * capacity[b - 1]:
+            # 2-узел: один чёрный ключ и два поддерева поровну
+            mid = lo + count // 2
+            links[side][parent] = mid
+            size[mid] = count
+            order.append(mid)
+            if lo < mid:
+                stack.append((lo, mid, b - 1, mid, 0))
+            if mid + 1 < hi:
+                stack.append((mid + 1, hi, b - 1, mid, 1))
+            continue
+
+        # 3-узел: красный ключ слева от чёрного и три поддерева поровну
+        q, r = divmod(count - 2, 3)
+        first = lo + q + (1 if r > 0 else 0)
+        second = first + 1 + q + (1 if r > 1 else 0)
+        links[side][parent] = second
+        red[first] = 1
+        left[second] = first
+        size[second] = count
+        size[first] = second - lo
+        order.append(second)
+        order.append(first)
+        if lo < first:
+            stack.append((lo, first, b - 1, first, 0))
+        if first + 1 < second:
+            stack.append((first + 1, second, b - 1, first, 1))
+        if second + 1 < hi:
+            stack.append((second + 1, hi, b - 1, second, 1))
+
+    root = left[n]
+    left[n] = -1
+    for i in reversed(order):
+        a, b = height[left[i]], height[right[i]]
+        height[i] = (a if a > b else b) + 1
+    for a in (left, right, size, height, red):
+        del a[n:]
+    return left, right, size, height, red, root
+
+
+class NodeArena:
+    """
+    Компактное хранилище узлов («арена»): поля всех узлов лежат
+    в параллельных массивах, а узел — это просто индекс в них:
+    - keys: array('q') — 8 байт,
+    - left, right, size, height: array('i') — по 4 байта,
+    - red: array('b') — 1 байт,
+    - пустая ссылка — индекс -1.
+    Итого около 25 байт на ключ против ~72 у объекта TreeNode с int-ключом.
+    Освобождённые индексы образуют список свободных (free list),
+    связанный через массив left, и переиспользуются при вставке.
+    Ключи — только целые числа в диапазоне int64, узлов — до 2^31.
+
+    Это режим экономии памяти, а не скорости: в CPython чтение элемента
+    array создаёт новый int, а доступ к полю объекта со __slots__ — нет.
+    Поиск, вставка и удаление идут прямо по индексам (методы ниже и
+    BinarySearchTree._insert_index/_delete_index) и достигают 0.6–1
+    от скорости обычных узлов; обходы — примерно вдвое медленнее;
+    пакетные операции ходят через ArenaNode и заметно медленнее.
+    bulk_load, наоборот, быстрее обычных узлов: массивы раскладки
+    копируются целиком (build_sorted).
+    """
+    def __init__(self):
+        self.keys = array("q")
+        self.left = array("i")
+        self.right = array("i")
+        self.size = array("i")
+        self.height = array("i")
+        self.red = array("b")
+        self.free_head = -1   # первый свободный индекс (-1 — свободных нет)
+        self.free_count = 0
+
+    def __len__(self):
+        """Число живых узлов."""
+        return len(self.keys) - self.free_count
+
+    def close(self):
+        """Освобождает внешние ресурсы арены; у арены в памяти их нет."""
+
+    def memory_bytes(self):
+        """Сколько байт занимают массивы арены."""
+        return sum(
+            a.itemsize * len(a)
+            for a in (self.keys, self.left, self.right, self.size, self.height, self.red)
+        )
+
+    def new_node(self, key):
+        """Выделяет узел и возвращает его представление ArenaNode."""
+        return ArenaNode(self, self.alloc(key))
+
+    def alloc(self, key):
+        """Выделяет узел (из списка свободных или в конце массивов), возвращает индекс."""
+        i = self.free_head
+        if i >= 0:
+            self.free_head = self.left[i]
+            self.free_count -= 1
+            self.keys[i] = key
+            self.left[i] = self.right[i] = -1
+            self.size[i] = 1
+            self.height[i] = 0
+            self.red[i] = 1
+        else:
+            i = len(self.keys)
+            self.keys.append(key)
+            self.left.append(-1)
+            self.right.append(-1)
+            self.size.append(1)
+            self.height.append(0)
+            self.red.append(1)
+        return i
+
+    def release(self, index):
+        """Возвращает индекс в список свободных."""
+        self.left[index] = self.free_head
+        self.free_head = index
+        self.free_count += 1
+
+    def build_sorted(self, keys, layout=balanced_layout):
+        """
+        Заполняет пустую арену деревом из отсортированных уникальных keys
+        формы layout (balanced_layout или llrb_layout) и возвращает индекс
+        корня (-1 для пустого). Индекс узла совпадает с позицией ключа
+        в keys, поэтому и ключи, и массивы раскладки берутся целиком.
+        """
+        self.keys = array("q", keys)
+        self.left, self.right, self.size, self.height, self.red, root = layout(len(keys))
+        self.free_head, self.free_count = -1, 0
+        return root
+
+    # ---------- Быстрые операции прямо по индексам ----------
+    # Без создания ArenaNode на каждом шаге: только чтение массивов.
+
+    def find(self, root, key):
+        """Индекс узла с ключом key в поддереве root или -1."""
+        keys, left, right = self.keys, self.left, self.right
+        i = root
+        while i >= 0:
+            k = keys[i]
+            if key == k:
+                return i
+            i = left[i] if key < k else right[i]
+        return -1
+
+    def iter_inorder(self, root):
+        keys, left, right = self.keys, self.left, self.right
+        stack = []
+        push, pop = stack.append, stack.pop
+        i = root
+        while True:
+            while i >= 0:
+                push(i)
+                i = left[i]
+            if not stack:
+                return
+            i = pop()
+            yield keys[i]
+            i = right[i]
+
+    def iter_preorder(self, root):
+        keys, left, right = self.keys, self.left, self.right
+        stack = [root] if root >= 0 else []
+        push, pop = stack.append, stack.pop
+        while stack:
+            i = pop()
+            yield keys[i]
+            r, l = right[i], left[i]
+            if r >= 0:
+                push(r)
+            if l >= 0:
+                push(l)
+
+    def iter_postorder(self, root):
+        keys, left, right = self.keys, self.left, self.right
+        stack = []
+        push, pop = stack.append, stack.pop
+        i = root
+        last = -1
+        while stack or i >= 0:
+            while i >= 0:
+                push(i)
+                i = left[i]
+            top = stack[-1]
+            r = right[top]
+            if r >= 0 and r != last:
+                i = r
+            else:
+                pop()
+                yield keys[top]
+                last = top
+
+    def update(self, i):
+        """Пересчитывает height и size узла i по его детям (как update_node)."""
+        height, size = self.height, self.size
+        l, r = self.left[i], self.right[i]
+        hl = height[l] if l >= 0 else -1
+        hr = height[r] if r >= 0 else -1
+        height[i] = 1 + (hl if hl > hr else hr)
+        size[i] = 1 + (size[l] if l >= 0 else 0) + (size[r] if r >= 0 else 0)
+
+    def rotate_left(self, i):
+        """Левый поворот вокруг i, возвращает индекс нового корня."""
+        left, right = self.left, self.right
+        j = right[i]
+        right[i] = left[j]
+        left[j] = i
+        self.update(i)
+        self.update(j)
+        return j
+
+    def rotate_right(self, i):
+        """Правый поворот вокруг i, возвращает индекс нового корня."""
+        left, right = self.left, self.right
+        j = left[i]
+        left[i] = right[j]
+        right[j] = i
+        self.update(i)
+        self.update(j)
+        return j
+
+    def is_red(self, i):
+        return i >= 0 and self.red[i] == 1
+
+
+class ArenaNode:
+    """
+    Лёгкое представление узла арены с тем же интерфейсом, что у TreeNode
+    (key, left, right, height, size, red), поэтому все алгоритмы дерева
+    работают с ареной без изменений. Хранит только индекс: чтение
+    и запись идут прямо в массивы арены.
+    Два представления одного индекса равны (== и hash), но это разные
+    объекты — узлы арены сравниваются через ==, а не is.
+    """
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other):
+        if not isinstance(other, ArenaNode):
+            return NotImplemented
+        return self.index == other.index and self.arena is other.arena
+
+    def __hash__(self):
+        return self.index
+
+    @property
+    def key(self):
+        return self.arena.keys[self.index]
+
+    @key.setter
+    def key(self, value):
+        self.arena.keys[self.index] = value
+
+    @property
+    def left(self):
+        i = self.arena.left[self.index]
+        return ArenaNode(self.arena, i) if i >= 0 else None
+
+    @left.setter
+    def left(self, node):
+        self.arena.left[self.index] = node.index if node is not None else -1
+
+    @property
+    def right(self):
+        i = self.arena.right[self.index]
+        return ArenaNode(self.arena, i) if i >= 0 else None
+
+    @right.setter
+    def right(self, node):
+        self.arena.right[self.index] = node.index if node is not None else -1
+
+    @property
+    def height(self):
+        return self.arena.height[self.index]
+
+    @height.setter
+    def height(self, value):
+        self.arena.height[self.index] = value
+
+    @property
+    def size(self):
+        return self.arena.size[self.index]
+
+    @size.setter
+    def size(self, value):
+        self.arena.size[self.index] = value
+
+    @property
+    def red(self):
+        return bool(self.arena.red[self.index])
+
+    @red.setter
+    def red(self, value):
+        self.arena.red[self.index] = 1 if value else 0
+
+
+# ---------- ДВОИЧНЫЙ ФОРМАТ ДЕРЕВА (dump/load) ----------
+# Файл — это заголовок и массивы арены, где узлы пронумерованы в порядке
+# preorder (корень — 0, левый ребёнок узла i — всегда i + 1):
+#   заголовок: сигнатура b"BSTD", версия, вид дерева, число узлов n,
+#   keys (int64 × n), left, right, size, height (int32 × n), red (int8 × n).
+# Всё little-endian. Ссылки — индексы (-1 — пусто), так что загрузка —
+# это копирование массивов без единого сравнения ключей, а сам файл
+# можно отобразить в память (mmap) и искать прямо в нём.
+
+DUMP_MAGIC = b"BSTD"
+DUMP_VERSION = 1
+DUMP_HEADER = struct.Struct("<4sHHq")   # 16 байт: массивы дальше выровнены на 8
+DUMP_FIELDS = (
+    ("keys", "q"), ("left", "i"), ("right", "i"),
+    ("size", "i"), ("height", "i"), ("red", "b"),
+)
+
+
+def read_dump_sections(buffer):
+    """
+    Разбирает файл dump() в buffer (memoryview байтов).
+    Возвращает (вид дерева, {имя массива: memoryview нужного типа}).
+    Если файл не того формата или обрезан — ValueError.
+    """
+    if len(buffer) < DUMP_HEADER.size:
+        raise ValueError("Файл слишком короткий для дампа дерева")
+    magic, version, kind, n = DUMP_HEADER.unpack_from(buffer)
+    if magic != DUMP_MAGIC:
+        raise ValueError("Это не дамп дерева (неверная сигнатура)")
+    if version != DUMP_VERSION:
+        raise ValueError(f"Неподдерживаемая версия дампа: {version}")
+
+    sections = {}
+    offset = DUMP_HEADER.size
+    for name, code in DUMP_FIELDS:
+        nbytes = n * array(code).itemsize
+        if offset + nbytes > len(buffer):
+            raise ValueError("Дамп дерева обрезан")
+        sections[name] = buffer[offset:offset + nbytes].cast(code)
+        offset += nbytes
+    if offset != len(buffer):
+        raise ValueError("Лишние байты в конце дампа дерева")
+    return kind, sections
+
+
+class MappedArena(NodeArena):
+    """
+    Арена только для чтения поверх файла dump(), отображённого в память:
+    массивы — это memoryview прямо на страницы файла, поэтому открытие
+    дерева любого размера мгновенно, а в память подгружается лишь то,
+    что затронул поиск. Изменять такое дерево нельзя (TypeError).
+    Работает на little-endian платформах (x86, ARM).
+
+    close() (или выход из with) отпускает memoryview и закрывает
+    отображение; после этого обращение к узлам даёт ValueError.
+    Без close() отображение закрывается, когда арену соберёт сборщик мусора.
+    """
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ValueError("mapped=True поддерживается только на little-endian платформах")
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self.mmap)]
+        try:
+            self.kind, sections = read_dump_sections(self._views[0])
+        except ValueError:
+            self.close()
+            raise
+        for name, view in sections.items():
+            setattr(self, name, view)
+            self._views.append(view)
+        self.free_head, self.free_count = -1, 0
+
+    def close(self):
+        """Закрывает отображение файла (повторный вызов ничего не делает)."""
+        if self.mmap.closed:
+            return
+        # mmap нельзя закрыть, пока на него смотрит хоть один memoryview
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def alloc(self, key):
+        raise TypeError("Дерево, отображённое из файла, доступно только для чтения")
+
+    def release(self, index):
+        raise TypeError("Дерево, отображённое из файла, доступно только для чтения")
 
 
 class BinarySearchTree:
@@ -26,36 +679,158 @@ class BinarySearchTree:
     Содержит:
     - root: корень дерева,
     - методы для вставки, поиска, удаления и обходов.
+
+    Каждый узел хранит высоту и размер своего поддерева, поэтому
+    height() и len() — O(1), а select(k)/rank(key) — O(высоты).
+
+    Обычное BST не балансируется: при вставке ключей по возрастанию
+    оно вырождается в список. Сбалансированные варианты (AVLTree,
+    RedBlackTree) наследуют весь интерфейс и переопределяют только
+    тип узла (node_class) и восстановление баланса (_balance).
+
+    arena=True включает компактное хранение: узлы лежат в массивах
+    NodeArena (около 25 байт на ключ вместо ~72 у объектов TreeNode),
+    публичные методы не меняются. Ключи в этом режиме — только int64.
+    Память экономится ценой скорости: обходы примерно вдвое медленнее
+    (см. NodeArena).
+
+    persistent=True включает персистентный режим (копирование пути):
+    вставка и удаление не меняют существующие узлы, а копируют те,
+    что лежат на пути от корня (O(log n) узлов для сбалансированных
+    деревьев); остальные поддеревья общие у старой и новой версии.
+    snapshot() за O(1) возвращает неизменяемую далее версию дерева —
+    на этом построены undo/redo в визуализаторе. С arena не совмещается.
+
+    dump(path)/load(path) сохраняют и загружают дерево в компактном
+    двоичном формате за O(n), без повторной вставки ключей.
+
+    search_many/insert_many/delete_many обрабатывают пачку ключей одним
+    проходом по дереву (O(k log(n/k)) вместо k спусков от корня)
+    и возвращают array('b') с результатом для каждого ключа.
     """
-    def __init__(self):
+    node_class = TreeNode
+    dump_kind = 0   # код вида дерева в заголовке dump()
+    layout = staticmethod(balanced_layout)   # форма дерева для bulk_load
+
+    def __init__(self, arena=False, persistent=False):
+        if arena and persistent:
+            raise ValueError("Режимы arena и persistent не совмещаются")
         self.root = None  # изначально дерево пустое
+        self.arena = NodeArena() if arena else None
+        self.persistent = persistent
+        # Узлы, созданные текущей операцией: их можно менять на месте
+        self._fresh = set()
+
+    # ---------- ТОЧКИ РАСШИРЕНИЯ ДЛЯ СБАЛАНСИРОВАННЫХ ДЕРЕВЬЕВ ----------
+    def _make_node(self, key):
+        """Создаёт новый узел: объект node_class или узел арены."""
+        if self.arena is not None:
+            return self.arena.new_node(key)
+        node = self.node_class(key)
+        if self.persistent:
+            self._fresh.add(node)
+        return node
+
+    def _free_node(self, node):
+        """Узел удалён из дерева: в режиме арены его индекс освобождается."""
+        if self.arena is not None:
+            self.arena.release(node.index)
+
+    def _mut(self, node):
+        """
+        Возвращает узел, который можно менять на месте. В персистентном
+        режиме это копия (один раз за операцию): исходный узел может
+        принадлежать старым версиям дерева. Иначе — сам узел.
+        """
+        if not self.persistent or node is None or node in self._fresh:
+            return node
+        node = node.copy()
+        self._fresh.add(node)
+        return node
 
-    # ---------- ВСТАВКА ----------
-    def insert(self, key):
+    def _copy_path(self, path):
         """
-        Вставка нового ключа в BST.
-        Если такой ключ уже есть, мы его не дублируем.
+        В персистентном режиме заменяет узлы пути (от корня вниз)
+        их копиями и связывает копии между собой и с корнем.
         """
+        if not self.persistent:
+            return
+        for i, node in enumerate(path):
+            node = path[i] = self._mut(node)
+            if i == 0:
+                self.root = node
+            else:
+                parent = path[i - 1]
+                if node.key < parent.key:
+                    parent.left = node
+                else:
+                    parent.right = node
 
-        # Вспомогательная рекурсивная функция
-        def _insert(node, key):
-            # Если дошли до пустого места — создаём новый узел
-            if node is None:
-                return TreeNode(key)
+    def _balance(self, node):
+        """
+        Вызывается для каждого узла на пути вставки/удаления снизу вверх.
+        Возвращает (возможно, новый) корень поддерева.
+        Обычное BST ничего не балансирует, только пересчитывает
+        высоту и размер узла.
+        """
+        update_node(node)
+        return node
 
-            # Если новый ключ меньше текущего, идём влево
-            if key < node.key:
-                node.left = _insert(node.left, key)
+    def _rebalance_path(self, path):
+        """
+        Проходит путь (список узлов от корня вниз) снизу вверх,
+        вызывает _balance для каждого узла и подвешивает результат
+        обратно к родителю. Сторона определяется сравнением ключей,
+        поэтому направление спуска хранить не нужно.
+        """
+        for i in range(len(path) - 1, -1, -1):
+            node = self._balance(path[i])
+            if i == 0:
+                self.root = node
+            else:
+                parent = path[i - 1]
+                if node.key < parent.key:
+                    parent.left = node
+                else:
+                    parent.right = node
 
-            # Если новый ключ больше текущего, идём вправо
-            elif key > node.key:
-                node.right = _insert(node.right, key)
+    # ---------- ВСТАВКА ----------
+    def insert(self, key):
+        """
+        Вставка нового ключа в BST.
+        Если такой ключ уже есть, мы его не дублируем.
 
+        Без рекурсии: спускаемся циклом, запоминая путь (стек узлов),
+        и потом балансируем его снизу вверх. Поэтому даже вырожденное
+        дерево из миллиона узлов не упирается в предел рекурсии.
+        """
+        if self.arena is not None:
+            return self._insert_index(key)
+        self._fresh.clear()
+        path = []           # узлы от корня до родителя нового узла
+        node = self.root
+        while node is not None:
             # Если key == node.key, дублировать не будем — просто ничего не делаем
-            return node
+            if key == node.key:
+                return
+            path.append(node)
+            # Меньше — идём влево, больше — вправо
+            node = node.left if key < node.key else node.right
+
+        # Дошли до пустого места — создаём новый узел
+        self._copy_path(path)
+        new_node = self._make_node(key)
+        if not path:
+            self.root = new_node
+            return
+        parent = path[-1]
+        if key < parent.key:
+            parent.left = new_node
+        else:
+            parent.right = new_node
 
-        # Запускаем вставку от корня
-        self.root = _insert(self.root, key)
+        # Восстанавливаем баланс на обратном пути
+        self._rebalance_path(path)
 
     # ---------- ПРОСТОЙ ПОИСК ----------
     def search(self, key):
@@ -63,6 +838,13 @@ class BinarySearchTree:
         Обычный поиск узла по ключу.
         Возвращает сам узел (TreeNode) или None, если не найден.
         """
+        if self.arena is not None:
+            # В режиме арены ищем прямо по массивам
+            if self.root is None:
+                return None
+            i = self.arena.find(self.root.index, key)
+            return ArenaNode(self.arena, i) if i >= 0 else None
+
         current = self.root  # начинаем с корня
         while current is not None:
             if key == current.key:
@@ -111,47 +893,56 @@ class BinarySearchTree:
         1) узел — лист,
         2) один ребёнок,
         3) два ребёнка (применяем стандартную замену на inorder-последователя).
-        """
 
-        # Вспомогательная рекурсивная функция удаления
-        def _delete(node, key):
-            # если узел пустой — возвращаем None
-            if node is None:
-                return None
+        Как и вставка, работает циклом со стеком пройденных узлов.
+        """
+        if self.arena is not None:
+            return self._delete_index(key)
+        self._fresh.clear()
+        # Ищем узел для удаления, запоминая путь
+        path = []
+        node = self.root
+        while node is not None and key != node.key:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+
+        # Ключа нет — ничего не делаем
+        if node is None:
+            return
 
-            # Ищем узел для удаления
-            if key < node.key:
-                node.left = _delete(node.left, key)
-            elif key > node.key:
-                node.right = _delete(node.right, key)
+        if node.left is not None and node.right is not None:
+            # Случай 3: два ребёнка.
+            # Ищем минимальный элемент в правом поддереве (inorder-последователь),
+            # переписываем ключ на найденный и дальше удаляем уже последователя
+            target = len(path)
+            path.append(node)
+            removed = node.right
+            while removed.left is not None:
+                path.append(removed)
+                removed = removed.left
+            self._copy_path(path)
+            path[target].key = removed.key
+        else:
+            removed = node
+            self._copy_path(path)
+
+        # Случаи 1 и 2: у удаляемого узла не больше одного ребёнка —
+        # родитель начинает ссылаться прямо на этого ребёнка (или на None)
+        child = removed.left if removed.left is not None else removed.right
+        if not path:
+            self.root = child
+        else:
+            parent = path[-1]
+            # При замене на последователя его ключ равен ключу parent,
+            # и он всегда справа — отсюда строгое сравнение
+            if removed.key < parent.key:
+                parent.left = child
             else:
-                # Нашли узел для удаления
-
-                # Случай 1: нет детей (лист)
-                if node.left is None and node.right is None:
-                    return None
-
-                # Случай 2: только один ребёнок
-                if node.left is None:
-                    # только правый ребёнок
-                    return node.right
-                if node.right is None:
-                    # только левый ребёнок
-                    return node.left
-
-                # Случай 3: два ребёнка
-                # Ищем минимальный элемент в правом поддереве (inorder-последователь)
-                min_larger_node = self._find_min(node.right)
-                # Переписываем ключ на найденный
-                node.key = min_larger_node.key
-                # Удаляем узел с этим ключом в правом поддереве
-                node.right = _delete(node.right, min_larger_node.key)
-
-            # Возвращаем (возможно, изменённый) узел наверх
-            return node
+                parent.right = child
+        self._free_node(removed)
 
-        # Запускаем удаление от корня
-        self.root = _delete(self.root, key)
+        # Восстанавливаем баланс на обратном пути
+        self._rebalance_path(path)
 
     def _find_min(self, node):
         """
@@ -163,76 +954,1979 @@ class BinarySearchTree:
             current = current.left
         return current
 
+    # ---------- РЕЖИМ АРЕНЫ: ВСТАВКА И УДАЛЕНИЕ ПО ИНДЕКСАМ ----------
+    # Те же алгоритмы, что insert/delete выше, но путь — список индексов,
+    # а поля читаются прямо из массивов арены: через ArenaNode каждое
+    # обращение к left/right создавало бы новый объект.
+
+    def _balance_index(self, i):
+        """Аналог _balance для узла арены i; возвращает индекс корня поддерева."""
+        self.arena.update(i)
+        return i
+
+    def _rebalance_indices(self, path):
+        """Аналог _rebalance_path для пути из индексов арены."""
+        arena = self.arena
+        keys, left, right = arena.keys, arena.left, arena.right
+        balance = self._balance_index
+        for pos in range(len(path) - 1, -1, -1):
+            i = balance(path[pos])
+            if pos == 0:
+                self.root = ArenaNode(arena, i)
+            else:
+                parent = path[pos - 1]
+                if keys[i] < keys[parent]:
+                    left[parent] = i
+                else:
+                    right[parent] = i
+
+    def _insert_index(self, key):
+        arena = self.arena
+        keys, left, right = arena.keys, arena.left, arena.right
+        path = []
+        i = self._root_index()
+        while i >= 0:
+            k = keys[i]
+            if key == k:
+                return
+            path.append(i)
+            i = left[i] if key < k else right[i]
+
+        i = arena.alloc(key)
+        if not path:
+            self.root = ArenaNode(arena, i)
+            return
+        parent = path[-1]
+        if key < keys[parent]:
+            left[parent] = i
+        else:
+            right[parent] = i
+        self._rebalance_indices(path)
+
+    def _delete_index(self, key):
+        arena = self.arena
+        keys, left, right = arena.keys, arena.left, arena.right
+        path = []
+        i = self._root_index()
+        while i >= 0 and key != keys[i]:
+            path.append(i)
+            i = left[i] if key < keys[i] else right[i]
+        if i < 0:
+            return
+
+        if left[i] >= 0 and right[i] >= 0:
+            # Два ребёнка: ключ заменяется на inorder-последователя
+            path.append(i)
+            removed = right[i]
+            while left[removed] >= 0:
+                path.append(removed)
+                removed = left[removed]
+            keys[i] = keys[removed]
+        else:
+            removed = i
+
+        child = left[removed] if left[removed] >= 0 else right[removed]
+        if not path:
+            self.root = ArenaNode(arena, child) if child >= 0 else None
+        else:
+            parent = path[-1]
+            if keys[removed] < keys[parent]:
+                left[parent] = child
+            else:
+                right[parent] = child
+        arena.release(removed)
+        self._rebalance_indices(path)
+
     # ---------- ОБХОДЫ ----------
+    # iter_* — ленивые генераторы на явном стеке: ключи выдаются по одному,
+    # список целиком не строится и глубина дерева не ограничена рекурсией.
+    # inorder/preorder/postorder оставлены для совместимости и возвращают списки.
+
+    def iter_inorder(self):
+        """
+        Симметричный обход (Inorder): Left - Root - Right.
+        Выдаёт ключи по возрастанию.
+        """
+        if self.arena is not None:
+            yield from self.arena.iter_inorder(self._root_index())
+            return
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            # Спускаемся влево до упора, откладывая узлы на стек
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key
+            node = node.right
+
+    def iter_preorder(self):
+        """
+        Прямой обход (Preorder): Root - Left - Right.
+        """
+        if self.arena is not None:
+            yield from self.arena.iter_preorder(self._root_index())
+            return
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            yield node.key
+            # Правого кладём первым, чтобы левый вышел раньше
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+    def iter_postorder(self):
+        """
+        Обратный обход (Postorder): Left - Right - Root.
+        Узел выдаётся, когда его правое поддерево уже пройдено
+        (last — последний выданный узел).
+        """
+        if self.arena is not None:
+            yield from self.arena.iter_postorder(self._root_index())
+            return
+        stack = []
+        node = self.root
+        last = None
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            top = stack[-1]
+            if top.right is not None and top.right != last:
+                # Правое поддерево ещё не обходили
+                node = top.right
+            else:
+                stack.pop()
+                yield top.key
+                last = top
+
+    def _root_index(self):
+        """Индекс корня в арене (-1 — дерево пустое)."""
+        return self.root.index if self.root is not None else -1
+
+    def __iter__(self):
+        """Итерация по дереву — ключи по возрастанию."""
+        return self.iter_inorder()
+
     def inorder(self):
         """
         Симметричный обход (Inorder): Left - Root - Right.
         Возвращает список ключей.
         """
-        result = []
+        return list(self.iter_inorder())
+
+    def preorder(self):
+        """
+        Прямой обход (Preorder): Root - Left - Right.
+        """
+        return list(self.iter_preorder())
+
+    def postorder(self):
+        """
+        Обратный обход (Postorder): Left - Right - Root.
+        """
+        return list(self.iter_postorder())
+
+    # ---------- ВЫСОТА И РАЗМЕР ----------
+    def height(self):
+        """
+        Возвращает высоту дерева, считая:
+        - пустое дерево: -1,
+        - дерево с одним узлом (только корень): 0.
+        Высота нужна для аккуратной отрисовки уровней.
+
+        Берётся из корня за O(1).
+        """
+        return node_height(self.root)
 
-        def _inorder(node):
-            if node is None:
+    def __len__(self):
+        """Количество ключей в дереве (O(1))."""
+        return node_size(self.root)
+
+    # ---------- УПОРЯДОЧЕННЫЕ ЗАПРОСЫ ----------
+    # Все запросы спускаются только по нужной ветке: O(высоты) на старт
+    # и O(1) амортизированно на каждый следующий ключ.
+
+    def iter_successors(self, key, inclusive=False):
+        """
+        Ленивый генератор ключей больше key (при inclusive — не меньше)
+        по возрастанию. key может и не быть в дереве.
+        На стеке лежат узлы, от которых спуск ушёл влево, — это и есть
+        ближайшие большие ключи; правые поддеревья раскрываются по мере
+        выдачи, как в iter_inorder.
+        """
+        stack = []
+        node = self.root
+        while node is not None:
+            if node.key > key or (inclusive and node.key == key):
+                stack.append(node)
+                node = node.left
+            else:
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.key
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def iter_predecessors(self, key, inclusive=False):
+        """
+        Ленивый генератор ключей меньше key (при inclusive — не больше)
+        по убыванию. Зеркален iter_successors.
+        """
+        stack = []
+        node = self.root
+        while node is not None:
+            if node.key < key or (inclusive and node.key == key):
+                stack.append(node)
+                node = node.right
+            else:
+                node = node.left
+        while stack:
+            node = stack.pop()
+            yield node.key
+            node = node.left
+            while node is not None:
+                stack.append(node)
+                node = node.right
+
+    def range(self, lo, hi):
+        """
+        Ленивый генератор ключей из отрезка [lo, hi] по возрастанию
+        за O(высоты + k), где k — число выданных ключей: обходятся
+        только поддеревья, пересекающие отрезок.
+        """
+        for key in self.iter_successors(lo, inclusive=True):
+            if key > hi:
                 return
-            _inorder(node.left)
-            result.append(node.key)
-            _inorder(node.right)
+            yield key
 
-        _inorder(self.root)
-        return result
+    def floor(self, key):
+        """Наибольший ключ <= key или None."""
+        return next(self.iter_predecessors(key, inclusive=True), None)
 
-    def preorder(self):
+    def ceil(self, key):
+        """Наименьший ключ >= key или None."""
+        return next(self.iter_successors(key, inclusive=True), None)
+
+    def successor(self, key):
+        """Следующий ключ (наименьший > key) или None."""
+        return next(self.iter_successors(key), None)
+
+    def predecessor(self, key):
+        """Предыдущий ключ (наибольший < key) или None."""
+        return next(self.iter_predecessors(key), None)
+
+    def k_nearest(self, key, k):
         """
-        Прямой обход (Preorder): Root - Left - Right.
+        k ключей, ближайших к key (по |ключ - key|), в порядке удаления;
+        при равном расстоянии меньший ключ идёт первым. Ключи должны
+        поддерживать вычитание (числа).
+        Два встречных генератора (вверх от key и вниз от него) сливаются,
+        как при слиянии отсортированных списков: O(высоты + k).
         """
+        up = self.iter_successors(key, inclusive=True)
+        down = self.iter_predecessors(key)
+        above = next(up, None)
+        below = next(down, None)
         result = []
+        while len(result) < k and (above is not None or below is not None):
+            if below is None or (above is not None and above - key < key - below):
+                result.append(above)
+                above = next(up, None)
+            else:
+                result.append(below)
+                below = next(down, None)
+        return result
 
-        def _preorder(node):
-            if node is None:
-                return
-            result.append(node.key)
-            _preorder(node.left)
-            _preorder(node.right)
+    # ---------- МАССОВАЯ ЗАГРУЗКА ----------
+    def bulk_load(self, iterable):
+        """
+        Заменяет содержимое дерева ключами из iterable.
+        Ключи сортируются и очищаются от дублей (O(n log n), а для уже
+        отсортированного входа — O(n)), затем дерево строится сразу
+        идеально сбалансированным за O(n), без поиска места для каждого
+        ключа. Высота результата минимальна: floor(log2(n)).
+        """
+        keys = sorted(set(iterable))
+        if self.arena is not None:
+            self.arena.close()
+            self.arena = NodeArena()
+        with gc_paused():
+            self.root = self._build_sorted(keys)
+        self._fresh.clear()
+
+    @classmethod
+    def from_iterable(cls, iterable, **options):
+        """Создаёт дерево (options — аргументы конструктора) и загружает ключи."""
+        tree = cls(**options)
+        tree.bulk_load(iterable)
+        return tree
+
+    # ---------- ПАКЕТНЫЕ ОПЕРАЦИИ ----------
+    # Пачка ключей сортируется и проходит по дереву одним спуском:
+    # в каждом узле отсортированный отрезок пачки делится по node.key
+    # (bisect) на левую и правую части, и каждая часть уходит только
+    # в своё поддерево. Общие верхние уровни сравниваются один раз на
+    # пачку, а не на каждый ключ: O(k log(n/k)) узлов вместо O(k log n).
+    # Все спуски — на явном стеке, как и остальные операции.
+
+    def search_many(self, keys):
+        """
+        Ищет пачку ключей. Возвращает array('b') той же длины и в том же
+        порядке: 1 — ключ есть, 0 — нет. Повторы в пачке допускаются.
+        """
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        batch = [keys[i] for i in order]
+        found = array("b", bytes(len(keys)))
+        if self.root is None or not batch:
+            return found
+
+        if self.arena is not None:
+            # По индексам арены, без объектов ArenaNode
+            a = self.arena
+            akeys, left, right = a.keys, a.left, a.right
+            stack = [(self.root.index, 0, len(batch))]
+            while stack:
+                i, lo, hi = stack.pop()
+                if hi - lo == 1:
+                    if a.find(i, batch[lo]) >= 0:
+                        found[order[lo]] = 1
+                    continue
+                key = akeys[i]
+                m = bisect_left(batch, key, lo, hi)
+                m2 = m
+                if m < hi and batch[m] == key:
+                    m2 = bisect_right(batch, key, m, hi)
+                    for j in range(m, m2):
+                        found[order[j]] = 1
+                if lo < m and left[i] >= 0:
+                    stack.append((left[i], lo, m))
+                if m2 < hi and right[i] >= 0:
+                    stack.append((right[i], m2, hi))
+            return found
+
+        stack = [(self.root, 0, len(batch))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo == 1:
+                # Один ключ на поддерево — дальше обычный спуск, без bisect
+                key = batch[lo]
+                while node is not None:
+                    if key == node.key:
+                        found[order[lo]] = 1
+                        break
+                    node = node.left if key < node.key else node.right
+                continue
+            key = node.key
+            m = bisect_left(batch, key, lo, hi)
+            m2 = m
+            if m < hi and batch[m] == key:
+                m2 = bisect_right(batch, key, m, hi)
+                for j in range(m, m2):
+                    found[order[j]] = 1
+            if lo < m and node.left is not None:
+                stack.append((node.left, lo, m))
+            if m2 < hi and node.right is not None:
+                stack.append((node.right, m2, hi))
+        return found
+
+    def insert_many(self, keys):
+        """
+        Вставляет пачку ключей за один проход (объединение дерева
+        с пачкой). Возвращает array('b') в порядке keys: 1 — ключ
+        добавлен, 0 — он уже был (или повторяет ключ раньше в пачке).
+
+        Спуск делит пачку по ключам узлов; ключи, дошедшие до пустого
+        места, становятся идеально сбалансированным поддеревом
+        (_build_subtree), а на обратном пути каждый пройденный узел
+        заново соединяет два своих обновлённых поддерева (_join).
+        У AVL и LLRB _join восстанавливает баланс, поэтому результат —
+        то же корректное дерево, что и после вставки по одному ключу.
+        """
+        keys = list(keys)
+        batch = sorted(set(keys))
+        added = bytearray(len(batch))
+        self._fresh.clear()
+
+        with gc_paused():
+            # В results — пары (поддерево, его ранг), см. _rank
+            results = []
+            stack = [(self.root, self._rank(self.root), 0, len(batch), False)]
+            while stack:
+                node, rank, lo, hi, joined = stack.pop()
+                if joined:
+                    right, right_rank = results.pop()
+                    left, left_rank = results.pop()
+                    results.append(self._join(left, left_rank, node, right, right_rank))
+                elif lo == hi:
+                    results.append((node, rank))   # поддерево не меняется
+                elif node is None:
+                    added[lo:hi] = b"\x01" * (hi - lo)
+                    subtree = self._build_subtree(batch[lo:hi])
+                    results.append((subtree, self._rank(subtree)))
+                else:
+                    m = bisect_left(batch, node.key, lo, hi)
+                    m2 = m + 1 if m < hi and batch[m] == node.key else m
+                    child_rank = self._child_rank(node, rank)
+                    stack.append((node, rank, lo, hi, True))
+                    stack.append((node.right, child_rank, m2, hi, False))
+                    stack.append((node.left, child_rank, lo, m, False))
+        self.root = results[0][0]
+        return batch_flags(keys, batch, added)
+
+    def delete_many(self, keys):
+        """
+        Удаляет пачку ключей за один проход (разность дерева и пачки).
+        Возвращает array('b') в порядке keys: 1 — ключ удалён, 0 — его
+        не было (или он повторяет ключ раньше в пачке).
+
+        Спуск как у insert_many; найденный узел выбрасывается, а два его
+        поддерева сливаются через _join2, остальные узлы пути заново
+        соединяют свои поддеревья через _join.
+        """
+        keys = list(keys)
+        batch = sorted(set(keys))
+        removed = bytearray(len(batch))
+        self._fresh.clear()
+
+        with gc_paused():
+            results = []
+            stack = [(self.root, self._rank(self.root), 0, len(batch), -1)]
+            while stack:
+                node, rank, lo, hi, joined = stack.pop()
+                if joined >= 0:
+                    right, right_rank = results.pop()
+                    left, left_rank = results.pop()
+                    if joined:
+                        self._free_node(node)
+                        results.append(self._join2(left, left_rank, right, right_rank))
+                    else:
+                        results.append(self._join(left, left_rank, node, right, right_rank))
+                elif lo == hi or node is None:
+                    results.append((node, rank))
+                else:
+                    m = bisect_left(batch, node.key, lo, hi)
+                    match = m < hi and batch[m] == node.key
+                    if match:
+                        removed[m] = 1
+                    child_rank = self._child_rank(node, rank)
+                    stack.append((node, rank, lo, hi, int(match)))
+                    stack.append((node.right, child_rank, m + match, hi, -1))
+                    stack.append((node.left, child_rank, lo, m, -1))
+        self.root = results[0][0]
+        return batch_flags(keys, batch, removed)
+
+    def _rank(self, node):
+        """
+        Ранг поддерева — то, что _join нужно знать о нём для балансировки
+        (у LLRB — чёрная высота). Пакетные операции считают его один раз
+        для корня, а дальше передают вниз через _child_rank и вверх из
+        _join, не обходя дерево заново. Обычному BST и AVL (у него высота
+        и так хранится в узле) ранг не нужен: 0.
+        """
+        return 0
+
+    def _child_rank(self, node, rank):
+        """Ранг детей узла node с рангом rank."""
+        return rank
+
+    def _join(self, left, left_rank, node, right, right_rank):
+        """
+        Соединяет поддеревья left < node.key < right (с рангами left_rank
+        и right_rank) в одно с корнем около node и возвращает пару
+        (корень, ранг). Обычное BST просто подвешивает их к node;
+        сбалансированные деревья переопределяют метод и восстанавливают баланс.
+        """
+        node = self._mut(node)
+        node.left = left
+        node.right = right
+        update_node(node)
+        return node, 0
+
+    def _join2(self, left, left_rank, right, right_rank):
+        """
+        Соединяет поддеревья left < right без среднего ключа: минимум
+        right отрезается (по пути его поддеревья заново собираются
+        через _join) и становится средним узлом. O(высоты).
+        Возвращает (корень, ранг), как _join.
+        """
+        if left is None:
+            return right, right_rank
+        if right is None:
+            return left, left_rank
+        path = []
+        node, rank = right, right_rank
+        while node.left is not None:
+            path.append((node, rank))
+            node, rank = node.left, self._child_rank(node, rank)
+        rest, rest_rank = node.right, self._child_rank(node, rank)
+        for parent, parent_rank in reversed(path):
+            rest, rest_rank = self._join(
+                rest, rest_rank, parent, parent.right, self._child_rank(parent, parent_rank))
+        return self._join(left, left_rank, node, rest, rest_rank)
+
+    def _attach_spine(self, path, subtree, to_right):
+        """
+        path — спуск по правому (to_right) или левому краю поддерева.
+        Подвешивает subtree на место последнего шага и балансирует
+        путь снизу вверх. Возвращает новый корень поддерева.
+        """
+        for node in reversed(path):
+            node = self._mut(node)
+            if to_right:
+                node.right = subtree
+            else:
+                node.left = subtree
+            subtree = self._balance(node)
+        return subtree
+
+    # ---------- СОХРАНЕНИЕ И ЗАГРУЗКА ----------
+    def dump(self, path):
+        """
+        Сохраняет дерево в файл path в двоичном формате (см. DUMP_FIELDS):
+        около 25 байт на ключ, форма дерева (и цвета LLRB) сохраняется
+        как есть. Ключи должны помещаться в int64.
+        """
+        arrays = self._preorder_arrays()
+        with open(path, "wb") as f:
+            f.write(DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, self.dump_kind, len(arrays["keys"])))
+            for name, _ in DUMP_FIELDS:
+                a = arrays[name]
+                if sys.byteorder != "little":
+                    a.byteswap()
+                a.tofile(f)
+
+    def _preorder_arrays(self):
+        """Массивы узлов, перенумерованных в порядке preorder (для dump)."""
+        arrays = {name: array(code) for name, code in DUMP_FIELDS}
+        keys, left, right = arrays["keys"], arrays["left"], arrays["right"]
+        size, height, red = arrays["size"], arrays["height"], arrays["red"]
+
+        if self.arena is not None:
+            # По индексам арены, без объектов ArenaNode
+            a = self.arena
+            stack = [(self.root.index, -1, False)] if self.root is not None else []
+            while stack:
+                j, parent, is_left = stack.pop()
+                i = len(keys)
+                if parent >= 0:
+                    (left if is_left else right)[parent] = i
+                keys.append(a.keys[j])
+                left.append(-1)
+                right.append(-1)
+                size.append(a.size[j])
+                height.append(a.height[j])
+                red.append(a.red[j])
+                # Правого кладём первым, чтобы левый получил индекс i + 1
+                if a.right[j] >= 0:
+                    stack.append((a.right[j], i, False))
+                if a.left[j] >= 0:
+                    stack.append((a.left[j], i, True))
+            return arrays
+
+        stack = [(self.root, -1, False)] if self.root is not None else []
+        while stack:
+            node, parent, is_left = stack.pop()
+            i = len(keys)
+            if parent >= 0:
+                (left if is_left else right)[parent] = i
+            keys.append(node.key)
+            left.append(-1)
+            right.append(-1)
+            size.append(node.size)
+            height.append(node.height)
+            red.append(1 if getattr(node, "red", False) else 0)
+            if node.right is not None:
+                stack.append((node.right, i, False))
+            if node.left is not None:
+                stack.append((node.left, i, True))
+        return arrays
+
+    @classmethod
+    def load(cls, path, mapped=False, **options):
+        """
+        Загружает дерево из файла dump(). Класс берётся из заголовка
+        (BinarySearchTree.load вернёт и AVL, и красно-чёрное дерево);
+        загрузка через подкласс другого вида — ValueError.
+        options — аргументы конструктора (arena, persistent).
+
+        Обычная загрузка — O(n): массивы читаются целиком, узлы
+        связываются по индексам, ключи не сравниваются.
+        mapped=True отображает файл в память (MappedArena): открытие O(1),
+        поиск, обходы и порядковые запросы работают прямо по файлу,
+        а изменение дерева даёт TypeError. Файл остаётся открытым до
+        close() дерева (или выхода из with) либо до bulk_load.
+        """
+        if mapped:
+            arena = MappedArena(path)
+            try:
+                tree = cls._class_for_dump(arena.kind)(arena=True, **options)
+            except ValueError:
+                arena.close()
+                raise
+            tree.arena = arena
+            tree.root = ArenaNode(arena, 0) if len(arena) else None
+            return tree
+
+        with open(path, "rb") as f:
+            data = f.read()
+        kind, sections = read_dump_sections(memoryview(data))
+        tree = cls._class_for_dump(kind)(**options)
+        arrays = {}
+        for name, code in DUMP_FIELDS:
+            a = arrays[name] = array(code)
+            a.frombytes(sections[name].cast("B"))
+            if sys.byteorder != "little":
+                a.byteswap()
+        with gc_paused():
+            tree._load_arrays(arrays)
+        return tree
+
+    @classmethod
+    def _class_for_dump(cls, kind):
+        """Класс дерева по коду вида из заголовка дампа."""
+        for tree_cls in TREE_KINDS.values():
+            if tree_cls.dump_kind == kind:
+                break
+        else:
+            raise ValueError(f"Неизвестный вид дерева в дампе: {kind}")
+        if not issubclass(tree_cls, cls):
+            raise ValueError(f"В дампе {tree_cls.__name__}, а загружается {cls.__name__}")
+        return tree_cls
+
+    def _load_arrays(self, arrays):
+        """Собирает дерево из массивов дампа (корень — индекс 0)."""
+        keys = arrays["keys"]
+        if self.arena is not None:
+            self.arena.close()
+            arena = self.arena = NodeArena()
+            for name, _ in DUMP_FIELDS:
+                setattr(arena, name, arrays[name])
+            self.root = ArenaNode(arena, 0) if keys else None
+            return
+
+        nodes = [self.node_class(key) for key in keys]
+        for node, l, r, s, h in zip(nodes, arrays["left"], arrays["right"],
+                                    arrays["size"], arrays["height"]):
+            if l >= 0:
+                node.left = nodes[l]
+            if r >= 0:
+                node.right = nodes[r]
+            node.size = s
+            node.height = h
+        if issubclass(self.node_class, RBNode):
+            for node, red in zip(nodes, arrays["red"]):
+                node.red = red == 1
+        self.root = nodes[0] if nodes else None
+
+    def close(self):
+        """
+        Освобождает файл, отображённый load(mapped=True); дерево после
+        этого использовать нельзя. Для остальных деревьев ничего не делает.
+        Дерево — контекстный менеджер: with Tree.load(path, mapped=True) as t.
+        """
+        if self.arena is not None:
+            self.arena.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ---------- СНИМКИ (ПЕРСИСТЕНТНЫЙ РЕЖИМ) ----------
+    def snapshot(self):
+        """
+        Текущая версия дерева за O(1): новое дерево того же класса
+        с тем же корнем. Дальнейшие изменения любого из двух деревьев
+        копируют узлы и не видны в другом.
+        """
+        if not self.persistent:
+            raise ValueError("snapshot() доступен только при persistent=True")
+        tree = type(self)(persistent=True)
+        tree.root = self.root
+        return tree
+
+    def _build_sorted(self, keys):
+        """
+        Строит дерево из отсортированного списка уникальных ключей по
+        раскладке self.layout: у BST и AVL — идеально сбалансированной,
+        у LLRB — через 2-3 дерево. Размеры, высоты и цвета берутся из
+        раскладки, так что update_node не нужен. Возвращает корень.
+        """
+        if self.arena is not None:
+            root = self.arena.build_sorted(keys, self.layout)
+            return ArenaNode(self.arena, root) if root >= 0 else None
+        return self._build_subtree(keys)
+
+    def _build_subtree(self, keys):
+        """
+        Как _build_sorted, но из новых узлов, не трогая остальные узлы
+        арены: поддерево для insert_many.
+        """
+        n = len(keys)
+        if n == 0:
+            return None
+        layout = self.layout(n)
+        root = layout[-1]
+        if self.arena is not None:
+            # Индексы выделяются заново, ссылки раскладки переводятся в них;
+            # последний элемент — пустая ссылка для индекса -1 раскладки
+            arena = self.arena
+            index = [arena.alloc(key) for key in keys]
+            index.append(-1)
+            left, right, size, height, red = arena.left, arena.right, arena.size, arena.height, arena.red
+            for i, l, r, s, h, c in zip(index, *layout[:5]):
+                left[i] = index[l]
+                right[i] = index[r]
+                size[i] = s
+                height[i] = h
+                red[i] = c
+            return ArenaNode(arena, index[root])
+
+        nodes = list(map(self.node_class, keys))
+        if self.persistent:
+            self._fresh.update(nodes)
+        # Последний элемент — None для пустой ссылки -1 раскладки
+        nodes.append(None)
+        self._link_nodes(nodes, *layout[:5])
+        return nodes[root]
+
+    @staticmethod
+    def _link_nodes(nodes, left, right, size, height, red):
+        """Расставляет узлам-объектам ссылки, размеры и высоты из раскладки."""
+        for node, l, r, s, h in zip(nodes, left, right, size, height):
+            node.left = nodes[l]
+            node.right = nodes[r]
+            node.size = s
+            node.height = h
+
+    # ---------- ПОРЯДКОВЫЕ ЗАПРОСЫ ----------
+    def select(self, k):
+        """
+        Возвращает k-й по возрастанию ключ (k с нуля) за O(высоты):
+        по размерам левых поддеревьев сразу видно, в какую сторону идти.
+        Если k вне диапазона — IndexError.
+        """
+        if not 0 <= k < len(self):
+            raise IndexError(f"select: индекс {k} вне диапазона [0, {len(self)})")
+        node = self.root
+        while True:
+            left_size = node_size(node.left)
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node.key
+            else:
+                # Пропускаем левое поддерево и сам узел
+                k -= left_size + 1
+                node = node.right
 
-        _preorder(self.root)
+    def rank(self, key):
+        """
+        Возвращает количество ключей дерева, строго меньших key
+        (для существующего ключа — его позицию в inorder), за O(высоты).
+        """
+        result = 0
+        node = self.root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif key == node.key:
+                return result + node_size(node.left)
+            else:
+                result += node_size(node.left) + 1
+                node = node.right
         return result
 
-    def postorder(self):
+
+class AVLTree(BinarySearchTree):
+    """
+    AVL-дерево: в каждом узле высоты левого и правого поддеревьев
+    отличаются не больше чем на 1. После вставки/удаления баланс
+    восстанавливается поворотами, поэтому высота дерева — O(log n)
+    при любом порядке вставки.
+    """
+    dump_kind = 1
+
+    @staticmethod
+    def _balance_factor(node):
+        """Разница высот левого и правого поддеревьев."""
+        return node_height(node.left) - node_height(node.right)
+
+    def _rotate_right(self, node):
         """
-        Обратный обход (Postorder): Left - Right - Root.
+        Правый поворот:
+              node            new_root
+             /       ->           \
+         new_root                 node
         """
-        result = []
+        node = self._mut(node)
+        new_root = self._mut(node.left)
+        node.left = new_root.right
+        new_root.right = node
+        update_node(node)
+        update_node(new_root)
+        return new_root
+
+    def _rotate_left(self, node):
+        """Левый поворот (зеркальный правому)."""
+        node = self._mut(node)
+        new_root = self._mut(node.right)
+        node.right = new_root.left
+        new_root.left = node
+        update_node(node)
+        update_node(new_root)
+        return new_root
+
+    def _balance(self, node):
+        """
+        Пересчитывает высоту узла и, если поддеревья разошлись
+        по высоте больше чем на 1, делает один или два поворота.
+        """
+        update_node(node)
+        factor = self._balance_factor(node)
+
+        # Перевес слева
+        if factor > 1:
+            # Случай «лево-право»: сначала поворачиваем левого ребёнка
+            if self._balance_factor(node.left) < 0:
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+
+        # Перевес справа
+        if factor < -1:
+            # Случай «право-лево»
+            if self._balance_factor(node.right) > 0:
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+
+        return node
+
+    def _balance_factor_index(self, i):
+        height, l, r = self.arena.height, self.arena.left[i], self.arena.right[i]
+        return (height[l] if l >= 0 else -1) - (height[r] if r >= 0 else -1)
+
+    def _balance_index(self, i):
+        """То же, что _balance, для узла арены i."""
+        arena = self.arena
+        left, right = arena.left, arena.right
+        arena.update(i)
+        factor = self._balance_factor_index(i)
+        if factor > 1:
+            if self._balance_factor_index(left[i]) < 0:
+                left[i] = arena.rotate_left(left[i])
+            return arena.rotate_right(i)
+        if factor < -1:
+            if self._balance_factor_index(right[i]) > 0:
+                right[i] = arena.rotate_right(right[i])
+            return arena.rotate_left(i)
+        return i
+
+    def _join(self, left, left_rank, node, right, right_rank):
+        """
+        Соединение для пакетных операций: если высоты left и right
+        разошлись больше чем на 1, спускаемся по краю более высокого
+        до поддерева подходящей высоты, подвешиваем туда node и
+        балансируем край снизу вверх. O(разницы высот).
+        Высоты хранятся в узлах, так что ранги не нужны.
+        """
+        hl, hr = node_height(left), node_height(right)
+        if hl > hr + 1:
+            path = []
+            while node_height(left) > hr + 1:
+                path.append(left)
+                left = left.right
+            root, _ = super()._join(left, 0, node, right, 0)
+            return self._attach_spine(path, root, to_right=True), 0
+        if hr > hl + 1:
+            path = []
+            while node_height(right) > hl + 1:
+                path.append(right)
+                right = right.left
+            root, _ = super()._join(left, 0, node, right, 0)
+            return self._attach_spine(path, root, to_right=False), 0
+        return super()._join(left, 0, node, right, 0)
+
+
+class RedBlackTree(BinarySearchTree):
+    """
+    Красно-чёрное дерево в левостороннем варианте (LLRB, Седжвик):
+    красные ссылки бывают только левыми, двух красных подряд нет,
+    а на любом пути от корня до пустого места одинаково чёрных ссылок.
+    Высота дерева не больше 2·log2(n).
+    """
 
-        def _postorder(node):
-            if node is None:
-                return
-            _postorder(node.left)
-            _postorder(node.right)
-            result.append(node.key)
+    node_class = RBNode
+    dump_kind = 2
+
+    @staticmethod
+    def _is_red(node):
+        return node is not None and node.red
+
+    def _rotate_left(self, node):
+        """Поворачивает правую красную ссылку влево."""
+        node = self._mut(node)
+        new_root = self._mut(node.right)
+        node.right = new_root.left
+        new_root.left = node
+        new_root.red = node.red
+        node.red = True
+        update_node(node)
+        update_node(new_root)
+        return new_root
+
+    def _rotate_right(self, node):
+        """Поворачивает левую красную ссылку вправо."""
+        node = self._mut(node)
+        new_root = self._mut(node.left)
+        node.left = new_root.right
+        new_root.right = node
+        new_root.red = node.red
+        node.red = True
+        update_node(node)
+        update_node(new_root)
+        return new_root
+
+    def _flip_colors(self, node):
+        """
+        Меняет цвет узла и обоих детей (разбиение/слияние 4-узла).
+        Сам node должен быть уже изменяемым (см. _mut), детей копируем здесь.
+        """
+        node.left = self._mut(node.left)
+        node.right = self._mut(node.right)
+        node.red = not node.red
+        node.left.red = not node.left.red
+        node.right.red = not node.right.red
+
+    def _balance(self, node):
+        """Восстанавливает свойства LLRB на обратном пути."""
+        update_node(node)
+        if self._is_red(node.right) and not self._is_red(node.left):
+            node = self._rotate_left(node)
+        if self._is_red(node.left) and self._is_red(node.left.left):
+            node = self._rotate_right(node)
+        if self._is_red(node.left) and self._is_red(node.right):
+            self._flip_colors(node)
+        return node
+
+    def _move_red_left(self, node):
+        """
+        Узел красный, а node.left и node.left.left чёрные:
+        делаем node.left или одного из его детей красным.
+        """
+        self._flip_colors(node)
+        if self._is_red(node.right.left):
+            node.right = self._rotate_right(node.right)
+            node = self._rotate_left(node)
+            self._flip_colors(node)
+        return node
+
+    def _move_red_right(self, node):
+        """
+        Узел красный, а node.right и node.right.left чёрные:
+        делаем node.right или одного из его детей красным.
+        """
+        self._flip_colors(node)
+        if self._is_red(node.left.left):
+            node = self._rotate_right(node)
+            self._flip_colors(node)
+        return node
+
+    # ---------- ТЕ ЖЕ ПРЕОБРАЗОВАНИЯ ДЛЯ УЗЛОВ АРЕНЫ (ПО ИНДЕКСАМ) ----------
+    def _rotate_left_index(self, i):
+        red = self.arena.red
+        color = red[i]
+        j = self.arena.rotate_left(i)
+        red[j], red[i] = color, 1
+        return j
+
+    def _rotate_right_index(self, i):
+        red = self.arena.red
+        color = red[i]
+        j = self.arena.rotate_right(i)
+        red[j], red[i] = color, 1
+        return j
+
+    def _flip_colors_index(self, i):
+        arena = self.arena
+        red = arena.red
+        red[i] ^= 1
+        red[arena.left[i]] ^= 1
+        red[arena.right[i]] ^= 1
+
+    def _balance_index(self, i):
+        # Цвета проверяются на месте, без is_red: это самый частый вызов
+        arena = self.arena
+        left, right, red = arena.left, arena.right, arena.red
+        arena.update(i)
+        l, r = left[i], right[i]
+        if r >= 0 and red[r] and (l < 0 or not red[l]):
+            i = self._rotate_left_index(i)
+            l = left[i]
+        if l >= 0 and red[l]:
+            ll = left[l]
+            if ll >= 0 and red[ll]:
+                i = self._rotate_right_index(i)
+                l = left[i]
+            r = right[i]
+            if r >= 0 and red[r] and red[l]:
+                self._flip_colors_index(i)
+        return i
+
+    def _move_red_left_index(self, i):
+        arena = self.arena
+        self._flip_colors_index(i)
+        if arena.is_red(arena.left[arena.right[i]]):
+            arena.right[i] = self._rotate_right_index(arena.right[i])
+            i = self._rotate_left_index(i)
+            self._flip_colors_index(i)
+        return i
+
+    def _move_red_right_index(self, i):
+        arena = self.arena
+        self._flip_colors_index(i)
+        if arena.is_red(arena.left[arena.left[i]]):
+            i = self._rotate_right_index(i)
+            self._flip_colors_index(i)
+        return i
+
+    # ---------- МАССОВАЯ ЗАГРУЗКА ----------
+    layout = staticmethod(llrb_layout)
+
+    @staticmethod
+    def _link_nodes(nodes, left, right, size, height, red):
+        for node, l, r, s, h, c in zip(nodes, left, right, size, height, map(bool, red)):
+            node.left = nodes[l]
+            node.right = nodes[r]
+            node.size = s
+            node.height = h
+            node.red = c
+
+    # ---------- ВСТАВКА ----------
+    def insert(self, key):
+        """Вставка как в BST + балансировка; корень всегда чёрный."""
+        super().insert(key)
+        if self.root.red:
+            self.root = self._mut(self.root)
+            self.root.red = False
+
+    # ---------- ПАКЕТНЫЕ ОПЕРАЦИИ ----------
+    def insert_many(self, keys):
+        result = super().insert_many(keys)
+        self._blacken_root()
+        return result
+
+    def delete_many(self, keys):
+        result = super().delete_many(keys)
+        self._blacken_root()
+        return result
+
+    def _blacken_root(self):
+        if self.root is not None and self.root.red:
+            self.root = self._mut(self.root)
+            self.root.red = False
+
+    def _blacken(self, node):
+        """Поддерево с чёрным корнем (красный корень перекрашивается)."""
+        if node is not None and node.red:
+            node = self._mut(node)
+            node.red = False
+        return node
+
+    @staticmethod
+    def _black_height(node):
+        """Число чёрных узлов на пути от node до пустого места."""
+        count = 0
+        while node is not None:
+            if not node.red:
+                count += 1
+            node = node.left
+        return count
+
+    def _rank(self, node):
+        """Ранг для _join — чёрная высота (считается обходом края)."""
+        return self._black_height(node)
+
+    def _child_rank(self, node, rank):
+        """У обоих детей чёрная высота на 1 меньше, если node чёрный."""
+        return rank if node.red else rank - 1
+
+    def _join(self, left, left_rank, node, right, right_rank):
+        """
+        Соединение LLRB-поддеревьев для пакетных операций; ранги —
+        чёрные высоты left и right, поэтому край заново не обходится.
+        Корни left и right перекрашиваются в чёрный (чёрная высота +1);
+        при равной чёрной высоте node становится чёрным корнем над ними.
+        Иначе node — красный узел, который вставляется в край более
+        высокого поддерева на уровне с той же чёрной высотой, и край
+        балансируется снизу вверх, как после обычной вставки: повороты
+        и перекраска чёрную высоту не меняют. Корень результата может
+        быть красным.
+        """
+        bl, br = left_rank, right_rank
+        if left is not None and left.red:
+            left, bl = self._blacken(left), bl + 1
+        if right is not None and right.red:
+            right, br = self._blacken(right), br + 1
+        node = self._mut(node)
+        if bl == br:
+            node.red = False
+            return super()._join(left, bl, node, right, br)[0], bl + 1
+
+        node.red = True
+        if bl > br:
+            # Правые ссылки в LLRB чёрные: каждый шаг вправо — минус один
+            path = []
+            for _ in range(bl - br):
+                path.append(left)
+                left = left.right
+            root, _ = super()._join(left, br, node, right, br)
+            return self._attach_spine(path, root, to_right=True), bl
+
+        # Слева бывают красные ссылки: останавливаемся на чёрном узле
+        path = []
+        height = br
+        while self._is_red(right) or height > bl:
+            path.append(right)
+            if not right.red:
+                height -= 1
+            right = right.left
+        root, _ = super()._join(left, bl, node, right, bl)
+        return self._attach_spine(path, root, to_right=False), br
+
+    # ---------- УДАЛЕНИЕ ----------
+    def delete(self, key):
+        """
+        Удаление в LLRB: по пути вниз заранее «одалживаем» красную
+        ссылку (_move_red_left/_move_red_right), чтобы удаляемый узел
+        не оказался чёрным листом, а на обратном пути балансируем.
+        Если ключа нет — дерево не меняется.
+
+        Спуск идёт циклом; узлы пути складываются в стек и затем
+        балансируются снизу вверх (_rebalance_path).
+        """
+        if self.search(key) is None:
+            return
+        if self.arena is not None:
+            return self._delete_index(key)
+        self._fresh.clear()
+        # В персистентном режиме каждый узел спуска сначала копируется
+        persistent = self.persistent
+
+        # Если оба ребёнка корня чёрные, временно делаем корень красным
+        if not self._is_red(self.root.left) and not self._is_red(self.root.right):
+            self.root = self._mut(self.root)
+            self.root.red = True
+
+        path = []          # пройденные узлы (их потом балансируем)
+        went_left = False  # с какой стороны текущий узел висит у path[-1]
+
+        def attach(subtree):
+            """Подвешивает (новый) корень текущего поддерева к родителю."""
+            if not path:
+                self.root = subtree
+            elif went_left:
+                path[-1].left = subtree
+            else:
+                path[-1].right = subtree
+
+        node = self.root
+        while True:
+            if persistent:
+                node = self._mut(node)
+                attach(node)
+            if key < node.key:
+                if not self._is_red(node.left) and not self._is_red(node.left.left):
+                    node = self._move_red_left(node)
+                    attach(node)
+                path.append(node)
+                went_left, node = True, node.left
+                continue
+
+            if self._is_red(node.left):
+                node = self._rotate_right(node)
+                attach(node)
+            if key == node.key and node.right is None:
+                # Удаляемый узел — лист (левого ребёнка у него тоже нет)
+                attach(None)
+                self._free_node(node)
+                break
+            if not self._is_red(node.right) and not self._is_red(node.right.left):
+                node = self._move_red_right(node)
+                attach(node)
+            if key != node.key:
+                path.append(node)
+                went_left, node = False, node.right
+                continue
+
+            # Два ребёнка: заменяем ключ на inorder-последователя
+            # и удаляем минимум правого поддерева
+            node.key = self._find_min(node.right).key
+            path.append(node)
+            went_left, node = False, node.right
+            while node.left is not None:
+                if persistent:
+                    node = self._mut(node)
+                    attach(node)
+                if not self._is_red(node.left) and not self._is_red(node.left.left):
+                    node = self._move_red_left(node)
+                    attach(node)
+                path.append(node)
+                went_left, node = True, node.left
+            attach(None)
+            self._free_node(node)
+            break
+
+        self._rebalance_path(path)
+        if self.root is not None and self.root.red:
+            self.root = self._mut(self.root)
+            self.root.red = False
+
+    def _delete_index(self, key):
+        """Тот же спуск, что в delete, по индексам арены (ключ точно есть)."""
+        arena = self.arena
+        keys, left, right, red, is_red = arena.keys, arena.left, arena.right, arena.red, arena.is_red
+        root = self.root.index
+        if not is_red(left[root]) and not is_red(right[root]):
+            red[root] = 1
+
+        path = []
+        went_left = False
+
+        def attach(j):
+            nonlocal root
+            if not path:
+                root = j
+            elif went_left:
+                left[path[-1]] = j
+            else:
+                right[path[-1]] = j
+
+        i = root
+        while True:
+            if key < keys[i]:
+                if not is_red(left[i]) and not is_red(left[left[i]]):
+                    i = self._move_red_left_index(i)
+                    attach(i)
+                path.append(i)
+                went_left, i = True, left[i]
+                continue
+
+            if is_red(left[i]):
+                i = self._rotate_right_index(i)
+                attach(i)
+            if key == keys[i] and right[i] < 0:
+                attach(-1)
+                arena.release(i)
+                break
+            if not is_red(right[i]) and not is_red(left[right[i]]):
+                i = self._move_red_right_index(i)
+                attach(i)
+            if key != keys[i]:
+                path.append(i)
+                went_left, i = False, right[i]
+                continue
+
+            successor = right[i]
+            while left[successor] >= 0:
+                successor = left[successor]
+            keys[i] = keys[successor]
+            path.append(i)
+            went_left, i = False, right[i]
+            while left[i] >= 0:
+                if not is_red(left[i]) and not is_red(left[left[i]]):
+                    i = self._move_red_left_index(i)
+                    attach(i)
+                path.append(i)
+                went_left, i = True, left[i]
+            attach(-1)
+            arena.release(i)
+            break
+
+        self.root = ArenaNode(arena, root) if root >= 0 else None
+        self._rebalance_indices(path)
+        if self.root is not None and red[self.root.index]:
+            red[self.root.index] = 0
+
+
+class ConcurrentTree:
+    """
+    Потокобезопасное дерево: один писатель за раз и сколько угодно
+    читателей без блокировок.
+
+    Внутри — персистентное дерево tree_cls(persistent=True). Писатель
+    под замком меняет его (копируя путь, старые узлы не трогаются)
+    и одной операцией присваивания публикует новый снимок (snapshot).
+    Читатель берёт текущий снимок и работает только с ним: узлы
+    опубликованной версии больше никогда не меняются, поэтому читатель
+    не увидит ни полуготовый поворот, ни замену ключа на последователя
+    при удалении узла с двумя детьми. Читатели не захватывают замков
+    и на сборках Python без GIL масштабируются по ядрам.
+
+    Для нескольких согласованных запросов подряд берите snapshot()
+    один раз и спрашивайте его: все ответы будут про одну версию.
+    """
+    def __init__(self, tree_cls=RedBlackTree):
+        self._lock = threading.Lock()     # сериализует писателей
+        self._writer = tree_cls(persistent=True)
+        self._current = self._writer.snapshot()
+        self.version = 0                  # число опубликованных изменений
+
+    def snapshot(self):
+        """Текущая опубликованная версия — неизменяемое дерево, O(1)."""
+        return self._current
+
+    def _publish(self):
+        """Публикует результат записи (вызывается под замком)."""
+        self._current = self._writer.snapshot()
+        self.version += 1
+
+    # ---------- ЗАПИСЬ (под замком) ----------
+    def insert(self, key):
+        with self._lock:
+            self._writer.insert(key)
+            self._publish()
+
+    def delete(self, key):
+        with self._lock:
+            self._writer.delete(key)
+            self._publish()
+
+    def bulk_load(self, iterable):
+        with self._lock:
+            self._writer.bulk_load(iterable)
+            self._publish()
+
+    def insert_many(self, keys):
+        """Вся пачка публикуется одной версией."""
+        with self._lock:
+            result = self._writer.insert_many(keys)
+            self._publish()
+        return result
+
+    def delete_many(self, keys):
+        with self._lock:
+            result = self._writer.delete_many(keys)
+            self._publish()
+        return result
+
+    # ---------- ЧТЕНИЕ (без замков, по текущему снимку) ----------
+    def search(self, key):
+        return self._current.search(key)
+
+    def __contains__(self, key):
+        return self._current.search(key) is not None
+
+    def __len__(self):
+        return len(self._current)
+
+    def __iter__(self):
+        return iter(self._current)
+
+    def height(self):
+        return self._current.height()
+
+    def range(self, lo, hi):
+        return self._current.range(lo, hi)
+
+    def floor(self, key):
+        return self._current.floor(key)
+
+    def ceil(self, key):
+        return self._current.ceil(key)
+
+    def select(self, k):
+        return self._current.select(k)
+
+    def rank(self, key):
+        return self._current.rank(key)
+
+    def search_many(self, keys):
+        return self._current.search_many(keys)
+
+
+class EytzingerNode:
+    """
+    Представление узла EytzingerTree с интерфейсом TreeNode (key, left,
+    right, height, size, red) — только для чтения: дерево меняется
+    целиком, а не поворотами узлов. Хранит раскладку, число ключей
+    и индекс в ней; раскладка после изменения дерева строится заново,
+    так что ранее полученные узлы продолжают показывать свою версию.
+    Как и ArenaNode, два представления одного узла равны (== и hash).
+    """
+    __slots__ = ("layout", "n", "index")
+
+    def __init__(self, layout, n, index):
+        self.layout = layout
+        self.n = n
+        self.index = index
+
+    def __eq__(self, other):
+        if not isinstance(other, EytzingerNode):
+            return NotImplemented
+        return self.index == other.index and self.layout is other.layout
+
+    def __hash__(self):
+        return self.index
+
+    @property
+    def key(self):
+        return self.layout[self.index]
+
+    @property
+    def left(self):
+        i = 2 * self.index
+        return EytzingerNode(self.layout, self.n, i) if i <= self.n else None
+
+    @property
+    def right(self):
+        i = 2 * self.index + 1
+        return EytzingerNode(self.layout, self.n, i) if i <= self.n else None
+
+    @property
+    def height(self):
+        # Уровень d поддерева непуст, пока index * 2^d <= n
+        return (self.n // self.index).bit_length() - 1
+
+    @property
+    def size(self):
+        # Уровень поддерева — отрезок индексов [lo, hi], обрезанный по n
+        size, lo, hi = 0, self.index, self.index
+        while lo <= self.n:
+            size += min(hi, self.n) - lo + 1
+            lo, hi = 2 * lo, 2 * hi + 1
+        return size
+
+    @property
+    def red(self):
+        return False
+
+
+class EytzingerTree(BinarySearchTree):
+    """
+    Статическое дерево поиска в массивах — для больших деревьев,
+    которые в основном читают. Узлов-объектов и указателей нет:
+    - keys: array('q') — ключи по возрастанию (обход inorder, select,
+      rank, диапазоны — прямо по индексам, поиск — bisect на C),
+    - layout: те же ключи в раскладке Эйтцингера — полное двоичное
+      дерево, записанное по уровням: корень в [1], дети узла i — в [2i]
+      и [2i + 1]. Верхние уровни лежат рядом и не вылетают из кэша,
+      а спуск — арифметика индексов.
+
+    search_many(keys) спускается по layout сразу всей пачкой запросов:
+    с numpy это log2(n) векторных шагов по массиву индексов, без numpy —
+    bisect для каждого ключа.
+
+    Интерфейс — тот же, что у BinarySearchTree: root, search и
+    search_with_path возвращают узлы EytzingerNode (представления
+    раскладки, только для чтения), работают dump/load, persistent=True
+    и snapshot(), поэтому дерево есть в TREE_KINDS — в визуализаторе
+    и как ConcurrentTree(EytzingerTree). Режима arena нет: ключи и так
+    лежат в массиве; поэтому нет и load(mapped=True).
+
+    insert/delete сдвигают хвост отсортированного массива (O(n), но это
+    memmove на C); в персистентном режиме изменение пишет в копию
+    массива — снимки держат прежний. layout после изменений
+    перестраивается лениво, при первом обращении к узлам, за O(n);
+    snapshot() строит его сразу, чтобы читатели снимка ничего не меняли.
+    Ключи — только int64.
+    """
+    node_class = EytzingerNode
+    dump_kind = 3
+
+    def __init__(self, arena=False, persistent=False):
+        if arena:
+            raise ValueError("EytzingerTree хранит ключи в массиве: режим arena (и mapped) не нужен")
+        self.keys = array("q")
+        self._layout = None   # раскладка Эйтцингера (None — устарела)
+        self.arena = None
+        self.persistent = persistent
+
+    @property
+    def root(self):
+        n = len(self.keys)
+        return EytzingerNode(self._get_layout(), n, 1) if n else None
+
+    def snapshot(self):
+        """Текущая версия за O(1) (плюс постройка layout, если он устарел)."""
+        if not self.persistent:
+            raise ValueError("snapshot() доступен только при persistent=True")
+        tree = type(self)(persistent=True)
+        tree.keys, tree._layout = self.keys, self._get_layout()
+        return tree
+
+    # ---------- ИЗМЕНЕНИЕ ----------
+    def _writable_keys(self):
+        """keys для изменения на месте; в персистентном режиме — копия."""
+        if self.persistent:
+            self.keys = self.keys[:]
+        self._layout = None
+        return self.keys
+
+    def insert(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return
+        self._writable_keys().insert(i, key)
+
+    def delete(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self._writable_keys()[i]
+
+    def bulk_load(self, iterable):
+        """Заменяет содержимое ключами из iterable (сортировка и удаление дублей)."""
+        self.keys = array("q", sorted(set(iterable)))
+        self._layout = None
 
-        _postorder(self.root)
+    def _locate(self, batch):
+        """
+        Для отсортированной пачки (только с numpy): ключи дерева и пачка
+        как массивы int64, позиции вставки пачки в ключи (searchsorted)
+        и маска «ключ уже есть». Оба массива отсортированы, поэтому это
+        двоичный поиск на C, без повторной сортировки, как у np.union1d.
+        """
+        current = np.frombuffer(self.keys, dtype=np.int64)
+        new = np.array(batch, dtype=np.int64)
+        positions = np.searchsorted(current, new)
+        if len(current):
+            found = current[np.minimum(positions, len(current) - 1)] == new
+        else:
+            found = np.zeros(len(new), dtype=bool)
+        return current, new, positions, found
+
+    def insert_many(self, keys):
+        """
+        Вставляет пачку одним слиянием с массивом ключей вместо k сдвигов
+        хвоста: с numpy — np.insert по позициям из searchsorted, без него —
+        копированием кусков массива между точками вставки. Возвращает
+        array('b') как BinarySearchTree.insert_many.
+        """
+        keys = list(keys)
+        batch = sorted(set(keys))
+        if np is not None:
+            current, new, positions, found = self._locate(batch)
+            added = bytearray((~found).tobytes())
+            if any(added):
+                merged = np.insert(current, positions[~found], new[~found])
+                self.keys = array("q", merged.tobytes())
+                self._layout = None
+            return batch_flags(keys, batch, added)
+
+        current = self.keys
+        added = bytearray(len(batch))
+        merged = array("q")
+        start = 0
+        for j, key in enumerate(batch):
+            i = bisect_left(current, key, start)
+            if i < len(current) and current[i] == key:
+                continue
+            merged += current[start:i]
+            merged.append(key)
+            added[j] = 1
+            start = i
+        if any(added):
+            merged += current[start:]
+            self.keys = merged
+            self._layout = None
+        return batch_flags(keys, batch, added)
+
+    def delete_many(self, keys):
+        """
+        Удаляет пачку одним проходом по массиву: с numpy — np.delete по
+        позициям из searchsorted, без него — копированием кусков массива
+        между удаляемыми ключами.
+        """
+        keys = list(keys)
+        batch = sorted(set(keys))
+        if np is not None:
+            current, _, positions, found = self._locate(batch)
+            removed = bytearray(found.tobytes())
+            if any(removed):
+                self.keys = array("q", np.delete(current, positions[found]).tobytes())
+                self._layout = None
+            return batch_flags(keys, batch, removed)
+
+        current = self.keys
+        removed = bytearray(len(batch))
+        kept = array("q")
+        start = 0
+        for j, key in enumerate(batch):
+            i = bisect_left(current, key, start)
+            if i < len(current) and current[i] == key:
+                kept += current[start:i]
+                removed[j] = 1
+                start = i + 1
+        if any(removed):
+            kept += current[start:]
+            self.keys = kept
+            self._layout = None
+        return batch_flags(keys, batch, removed)
+
+    # ---------- ПОИСК ----------
+    def search(self, key):
+        """Узел с ключом key или None: bisect по keys, затем индекс в layout."""
+        keys = self.keys
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return None
+        return EytzingerNode(self._get_layout(), len(keys), self._layout_index(i))
+
+    def _layout_index(self, rank):
+        """
+        Индекс в layout ключа keys[rank], O(1). Узлы нижнего (глубины d)
+        уровня полного дерева — это первые m нечётных позиций inorder
+        (p = rank + 1), остальные узлы образуют совершенное дерево из
+        2^d - 1 узлов, где у позиции p индекс (p | 2^d) >> (ctz(p) + 1).
+        """
+        n = len(self.keys)
+        d = n.bit_length() - 1
+        m = n - (1 << d) + 1      # узлов на нижнем уровне
+        p = rank + 1
+        if p <= 2 * m:
+            if p % 2:
+                return (1 << d) + p // 2
+            p //= 2
+        else:
+            p -= m
+        return (p | (1 << d)) >> (p & -p).bit_length()
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def search_many(self, keys):
+        """
+        Ищет пачку ключей. Возвращает array('b') той же длины:
+        1 — ключ есть, 0 — нет.
+        С numpy все запросы спускаются по layout одновременно: на каждом
+        уровне i = 2i + (layout[i] < ключ). В конце i указывает на первый
+        ключ >= искомого (Khuong, Morin: убрать из i хвост единиц и ещё
+        один бит — нулевой i значит, что все ключи меньше).
+        """
+        if np is None:
+            return array("b", [1 if key in self else 0 for key in keys])
+
+        queries = np.asarray(keys, dtype=np.int64)
+        result = array("b", bytes(len(queries)))
+        n = len(self.keys)
+        if n == 0 or len(queries) == 0:
+            return result
+
+        layout = np.frombuffer(self._get_layout(), dtype=np.int64)
+        i = np.ones(len(queries), dtype=np.int64)
+        for _ in range(n.bit_length()):
+            inside = i <= n
+            i = np.where(inside, 2 * i + (layout[np.minimum(i, n)] < queries), i)
+        i //= 2 * ((i + 1) & ~i)
+        found = (i > 0) & (layout[i] == queries)
+        result = array("b")
+        result.frombytes(found.astype(np.int8).tobytes())
         return result
 
-    # ---------- ВЫСОТА ДЕРЕВА ----------
+    # ---------- РАСКЛАДКА ЭЙТЦИНГЕРА ----------
+    def _get_layout(self):
+        """layout (array('q') длины n + 1, [0] не используется), строится при необходимости."""
+        if self._layout is None:
+            self._layout = self._build_layout()
+        return self._layout
+
+    def _build_layout(self):
+        n = len(self.keys)
+        layout = array("q", bytes(8 * (n + 1)))
+        if n == 0:
+            return layout
+
+        if np is not None:
+            # По уровням: у каждого узла уровня известен его отрезок
+            # отсортированных ключей [lo, lo + m). Поддеревья полного дерева
+            # тоже полные, так что размер левого поддерева L считается
+            # формулой, ключ узла — keys[lo + L].
+            positions = []
+            lo = np.zeros(1, dtype=np.int64)
+            m = np.array([n], dtype=np.int64)
+            first = 1   # индекс первого узла уровня
+            while True:
+                levels = np.frexp(m)[1] - 1       # floor(log2(m)), точно для целых
+                half = np.where(levels > 0, 1 << np.maximum(levels - 1, 0), 0)
+                last = m - ((1 << levels) - 1)    # узлов на нижнем уровне поддерева
+                left = np.where(levels > 0, half - 1 + np.minimum(last, half), 0)
+                positions.append(lo + left)
+                count = min(2 * first, n - (2 * first - 1))   # узлов на следующем уровне
+                if count <= 0:
+                    break
+                lo = np.stack([lo, lo + left + 1], axis=1).ravel()[:count]
+                m = np.stack([left, m - left - 1], axis=1).ravel()[:count]
+                first *= 2
+            keys = np.frombuffer(self.keys, dtype=np.int64)
+            view = np.frombuffer(layout, dtype=np.int64)
+            view[1:] = keys[np.concatenate(positions)]
+            return layout
+
+        # Без numpy: обход inorder по индексам раскладки
+        keys = self.keys
+        stack = []
+        i, k = 1, 0
+        while stack or i <= n:
+            while i <= n:
+                stack.append(i)
+                i *= 2
+            i = stack.pop()
+            layout[i] = keys[k]
+            k += 1
+            i = 2 * i + 1
+        return layout
+
+    # ---------- РАЗМЕР И ОБХОДЫ ----------
+    def __len__(self):
+        return len(self.keys)
+
     def height(self):
+        """Высота полного дерева: floor(log2(n)), пустое — -1."""
+        return len(self.keys).bit_length() - 1
+
+    def iter_inorder(self):
+        return iter(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def iter_preorder(self):
+        layout, n = self._get_layout(), len(self.keys)
+        stack = [1] if n else []
+        while stack:
+            i = stack.pop()
+            yield layout[i]
+            if 2 * i + 1 <= n:
+                stack.append(2 * i + 1)
+            if 2 * i <= n:
+                stack.append(2 * i)
+
+    def iter_postorder(self):
         """
-        Возвращает высоту дерева, считая:
-        - пустое дерево: -1,
-        - дерево с одним узлом (только корень): 0.
-        Высота нужна для аккуратной отрисовки уровней.
+        Postorder без стека: следующий узел считается по индексу.
+        Первый в поддереве j — самый нижний левый потомок (в полном
+        дереве узел без левого ребёнка — лист). После левого ребёнка
+        идёт поддерево правого брата, после правого — родитель.
         """
-        def _height(node):
-            if node is None:
-                return -1
-            return 1 + max(_height(node.left), _height(node.right))
+        layout, n = self._get_layout(), len(self.keys)
+        if n == 0:
+            return
+        i = 1
+        while 2 * i <= n:
+            i *= 2
+        while True:
+            yield layout[i]
+            if i == 1:
+                return
+            if i % 2 == 0 and i + 1 <= n:
+                i += 1
+                while 2 * i <= n:
+                    i *= 2
+            else:
+                i //= 2
 
-        return _height(self.root)
+    def inorder(self):
+        return self.keys.tolist()
+
+    # ---------- ПОРЯДКОВЫЕ ЗАПРОСЫ ----------
+    def select(self, k):
+        if not 0 <= k < len(self.keys):
+            raise IndexError(f"select: индекс {k} вне диапазона [0, {len(self.keys)})")
+        return self.keys[k]
+
+    def rank(self, key):
+        return bisect_left(self.keys, key)
+
+    # range, floor, ceil, successor, predecessor, k_nearest — из
+    # BinarySearchTree, поверх этих двух итераторов
+    def iter_successors(self, key, inclusive=False):
+        keys = self.keys
+        i = bisect_left(keys, key) if inclusive else bisect_right(keys, key)
+        for j in range(i, len(keys)):
+            yield keys[j]
+
+    def iter_predecessors(self, key, inclusive=False):
+        keys = self.keys
+        i = bisect_right(keys, key) if inclusive else bisect_left(keys, key)
+        for j in range(i - 1, -1, -1):
+            yield keys[j]
+
+    # ---------- СОХРАНЕНИЕ И ЗАГРУЗКА ----------
+    # dump/load — из BinarySearchTree: в файл пишется полное дерево
+    # раскладки в обычном формате, при загрузке берутся только ключи
+    def _preorder_arrays(self):
+        """Массивы для dump: узлы раскладки, перенумерованные в preorder."""
+        arrays = {name: array(code) for name, code in DUMP_FIELDS}
+        keys, left, right = arrays["keys"], arrays["left"], arrays["right"]
+        size, height, red = arrays["size"], arrays["height"], arrays["red"]
+        layout, n = self._get_layout(), len(self.keys)
+
+        # Размеры поддеревьев снизу вверх; дети листьев — за пределами n
+        sizes = array("i", [0]) * (2 * n + 2)
+        for i in range(n, 0, -1):
+            sizes[i] = 1 + sizes[2 * i] + sizes[2 * i + 1]
+
+        stack = [(1, -1, False)] if n else []
+        while stack:
+            j, parent, is_left = stack.pop()
+            i = len(keys)
+            if parent >= 0:
+                (left if is_left else right)[parent] = i
+            keys.append(layout[j])
+            left.append(-1)
+            right.append(-1)
+            size.append(sizes[j])
+            height.append((n // j).bit_length() - 1)
+            red.append(0)
+            if 2 * j + 1 <= n:
+                stack.append((2 * j + 1, i, False))
+            if 2 * j <= n:
+                stack.append((2 * j, i, True))
+        return arrays
+
+    def _load_arrays(self, arrays):
+        """Форма из дампа не нужна: ключи сортируются, layout строится заново."""
+        self.keys = array("q", sorted(arrays["keys"]))
+        self._layout = None
+
+
+# Варианты дерева, доступные в визуализаторе: название -> класс.
+# Все они подклассы BinarySearchTree с узлами (у EytzingerTree —
+# представлениями раскладки); load() находит класс по коду вида из дампа.
+TREE_KINDS = {
+    "BST": BinarySearchTree,
+    "AVL": AVLTree,
+    "Red-Black": RedBlackTree,
+    "Eytzinger": EytzingerTree,
+}
 
 
 # ==============================
 #   GUI: Визуализатор BST
 # ==============================
 
+class KeyLines:
+    """
+    Ленивые строки лога со списком ключей: по per_line ключей в строке,
+    первая строка начинается с title. Строка собирается только когда
+    её запросили, поэтому миллион ключей не превращается в миллион строк.
+    """
+    def __init__(self, title, keys, per_line=16):
+        self.title = title
+        self.keys = keys
+        self.per_line = per_line
+
+    def __len__(self):
+        return max(1, -(-len(self.keys) // self.per_line))
+
+    def __getitem__(self, i):
+        chunk = self.keys[i * self.per_line:(i + 1) * self.per_line]
+        prefix = self.title if i == 0 else " " * len(self.title)
+        return prefix + " ".join(map(str, chunk))
+
+
+class ChainedLines:
+    """Несколько последовательностей строк (списки, KeyLines) как одна."""
+    def __init__(self, *parts):
+        self.parts = parts
+        self.starts = []    # номер первой строки каждой части
+        total = 0
+        for part in parts:
+            self.starts.append(total)
+            total += len(part)
+        self.total = total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, i):
+        j = bisect_right(self.starts, i) - 1
+        return self.parts[j][i - self.starts[j]]
+
+
+class VirtualLog(ttk.Frame):
+    """
+    Лог, который рисует только видимые строки. Строки — любая
+    последовательность (список, KeyLines, ChainedLines): текстовое поле
+    содержит лишь те несколько строк, что помещаются в окно, а полоса
+    прокрутки двигает номер первой видимой строки. Поэтому вывод
+    обходов дерева из миллиона ключей не подвешивает окно.
+    """
+    def __init__(self, master, height=5):
+        super().__init__(master)
+        self.lines = []
+        self.top = 0          # номер первой видимой строки
+        self._linespace = None  # высота строки шрифта в пикселях
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(self, height=height, wrap="word", state=tk.DISABLED)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Прокрутку текстового поля заменяем своей: в нём только видимые строки
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.text.bind(sequence, self._on_wheel)
+        self.text.bind("<Configure>", lambda event: self._render())
+
+    def set_lines(self, lines):
+        """Заменяет содержимое лога и прокручивает его в начало."""
+        self.lines = lines
+        self.top = 0
+        self._render()
+
+    def _visible_rows(self):
+        """Сколько строк помещается в текстовое поле."""
+        height = self.text.winfo_height()
+        if height <= 1:
+            # Окно ещё не показано — берём высоту из настроек
+            return int(self.text.cget("height"))
+        if self._linespace is None:
+            self._linespace = tkfont.Font(font=self.text.cget("font")).metrics("linespace")
+        return max(1, height // self._linespace)
+
+    def yview(self, *args):
+        """Команда полосы прокрутки: ("moveto", доля) или ("scroll", n, "units"/"pages")."""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.lines))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self.top += step * self._visible_rows() if args[2] == "pages" else step
+        self._render()
+
+    def _on_wheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.top -= 3
+        else:
+            self.top += 3
+        self._render()
+        return "break"
+
+    def _render(self):
+        """Выводит в текстовое поле только видимые строки."""
+        rows = self._visible_rows()
+        total = len(self.lines)
+        self.top = max(0, min(self.top, total - rows))
+        end = min(total, self.top + rows)
+
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(self.lines[i] for i in range(self.top, end)))
+        self.text.configure(state=tk.DISABLED)
+        if total:
+            self.scrollbar.set(self.top / total, end / total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+
 class BSTVisualizer(tk.Tk):
     """
     Класс основного окна приложения.
@@ -253,8 +2947,16 @@ class BSTVisualizer(tk.Tk):
         # Стартовый размер окна (можно менять вручную)
         self.geometry("900x600")
 
-        # Само дерево BST
-        self.bst = BinarySearchTree()
+        # Само дерево BST (вариант выбирается в выпадающем списке Tree).
+        # Дерево персистентное: снимок версии стоит O(1), а изменение
+        # копирует только путь от корня — на этом построены Undo/Redo
+        self.tree_kind = "BST"
+        self.bst = TREE_KINDS[self.tree_kind](persistent=True)
+
+        # История для Undo/Redo: списки (вид дерева, снимок)
+        self.history = []
+        self.future = []
+        self.history_limit = 200         # сколько шагов назад помним
 
         # Ключ, который нужно подсветить на холсте
         self.highlight_key = None
@@ -269,10 +2971,31 @@ class BSTVisualizer(tk.Tk):
         self.canvas_height = 400         # начальная высота холста
         self.node_radius = 18            # радиус кругов-узлов
         self.max_level_height = 80       # максимальное расстояние по вертикали между уровнями
+        self.resize_delay_ms = 120       # задержка перерисовки после изменения размера
+        self.lod_min_width = 16          # поддерево уже стольких пикселей рисуется треугольником
+
+        # Масштаб и сдвиг вида (колесо мыши — масштаб, перетаскивание — сдвиг)
+        self.zoom = 1.0
+        self.pan_x = 0.0
+        self.pan_y = 0.0
+        self.level_height = 0            # шаг между уровнями при zoom = 1 (из последней отрисовки)
+        self._drag_from = None           # последняя точка перетаскивания
+
+        # Отложенная перерисовка после изменения размера (id задачи after)
+        self._resize_job = None
+
+        # Фоновые задачи (импорт, смена типа, обходы): выполняются в отдельном
+        # потоке, а результат забирается в потоке Tk опросом через after()
+        self.worker_poll_ms = 50
+        self._job = None                 # название текущей задачи (None — нет)
+        self._job_results = queue.Queue()
 
         # Строим интерфейс
         self._build_ui()
 
+        # Состояние рендерера: какие элементы холста уже нарисованы
+        self._reset_canvas()
+
     # ---------- Построение интерфейса ----------
     def _build_ui(self):
         """
@@ -313,6 +3036,32 @@ class BSTVisualizer(tk.Tk):
         btn_clear = ttk.Button(control_frame, text="Clear Tree", command=self.on_clear_tree)
         btn_clear.pack(side=tk.LEFT, padx=5)
 
+        # Кнопки отмены и повтора (также Ctrl+Z / Ctrl+Y)
+        btn_undo = ttk.Button(control_frame, text="Undo", command=self.on_undo)
+        btn_undo.pack(side=tk.LEFT, padx=5)
+        btn_redo = ttk.Button(control_frame, text="Redo", command=self.on_redo)
+        btn_redo.pack(side=tk.LEFT, padx=5)
+        self.bind("<Control-z>", self.on_undo)
+        self.bind("<Control-y>", self.on_redo)
+
+        # Кнопка загрузки ключей из файла (сразу сбалансированное дерево)
+        btn_import = ttk.Button(control_frame, text="Import...", command=self.on_import)
+        btn_import.pack(side=tk.LEFT, padx=5)
+
+        # Кнопка возврата к исходному масштабу и положению
+        btn_reset_view = ttk.Button(control_frame, text="Reset View", command=self.on_reset_view)
+        btn_reset_view.pack(side=tk.LEFT, padx=5)
+
+        # Выбор варианта дерева: обычное BST, AVL или красно-чёрное
+        ttk.Label(control_frame, text="Tree:").pack(side=tk.LEFT, padx=(10, 0))
+        self.kind_var = tk.StringVar(value=self.tree_kind)
+        kind_box = ttk.Combobox(
+            control_frame, textvariable=self.kind_var, values=list(TREE_KINDS),
+            state="readonly", width=10
+        )
+        kind_box.pack(side=tk.LEFT, padx=5)
+        kind_box.bind("<<ComboboxSelected>>", self.on_change_kind)
+
         # Метка для краткого статуса (успех, ошибка и т.д.)
         self.status_label = ttk.Label(control_frame, text="Tree is empty.", foreground="gray")
         self.status_label.pack(side=tk.LEFT, padx=15)
@@ -325,6 +3074,14 @@ class BSTVisualizer(tk.Tk):
         # При изменении размера холста автоматически перерисовываем дерево
         self.canvas.bind("<Configure>", self.on_canvas_resize)
 
+        # Масштаб колесом мыши (Windows/macOS — <MouseWheel>, X11 — кнопки 4/5)
+        # и сдвиг перетаскиванием левой кнопкой
+        self.canvas.bind("<MouseWheel>", self.on_zoom)
+        self.canvas.bind("<Button-4>", self.on_zoom)
+        self.canvas.bind("<Button-5>", self.on_zoom)
+        self.canvas.bind("<ButtonPress-1>", self.on_pan_start)
+        self.canvas.bind("<B1-Motion>", self.on_pan_move)
+
         # ------ НИЖНИЙ ЛОГ ------
         # Это обычная текстовая ячейка, не только для Traversals,
         # сюда мы выводим:
@@ -342,9 +3099,9 @@ class BSTVisualizer(tk.Tk):
         # Подпись "Log:"
         ttk.Label(traversals_frame, text="Log:").pack(anchor=tk.W)
 
-        # Само текстовое поле лога
-        self.text_log = tk.Text(traversals_frame, height=5)
-        self.text_log.pack(fill=tk.X, expand=False)
+        # Само текстовое поле лога (рисует только видимые строки)
+        self.text_log = VirtualLog(traversals_frame, height=5)
+        self.text_log.pack(fill=tk.BOTH, expand=True)
 
     # ---------- Вспомогательные методы для ввода и лога ----------
     def _get_key_from_entry(self):
@@ -367,13 +3124,57 @@ class BSTVisualizer(tk.Tk):
         """
         Перезаписывает содержимое нижнего текстового поля.
         Если передана строка — выводим её.
-        Если список строк — соединяем через перенос строки.
+        Если список строк (или ленивая последовательность вроде
+        KeyLines) — каждую строку отдельно, видимые рисует VirtualLog.
         """
-        self.text_log.delete("1.0", tk.END)
         if isinstance(lines, str):
-            self.text_log.insert(tk.END, lines)
+            lines = lines.split("\n")
+        self.text_log.set_lines(lines)
+
+    # ---------- Фоновые задачи ----------
+    def _run_job(self, name, work, done):
+        """
+        Запускает work() в фоновом потоке, чтобы окно не замирало,
+        а done(результат) вызывает потом в потоке Tk: поток кладёт
+        результат в очередь, _poll_job забирает его через after().
+        work не должен трогать виджеты. Одновременно идёт одна задача;
+        пока она идёт, дерево не меняется (см. _is_busy).
+        """
+        if self._is_busy():
+            return
+        self._job = name
+        self.status_label.config(text=f"{name}...", foreground="gray")
+
+        def target():
+            try:
+                result = (True, work())
+            except Exception as e:  # ошибку показываем в потоке Tk
+                result = (False, e)
+            self._job_results.put((done, result))
+
+        threading.Thread(target=target, daemon=True).start()
+        self.after(self.worker_poll_ms, self._poll_job)
+
+    def _poll_job(self):
+        """Проверяет, готова ли фоновая задача; если нет — ждёт дальше."""
+        try:
+            done, (ok, value) = self._job_results.get_nowait()
+        except queue.Empty:
+            self.after(self.worker_poll_ms, self._poll_job)
+            return
+        name, self._job = self._job, None
+        if ok:
+            done(value)
         else:
-            self.text_log.insert(tk.END, "\n".join(lines))
+            self.status_label.config(text=f"{name} failed.", foreground="red")
+            messagebox.showerror(f"{name} error", str(value))
+
+    def _is_busy(self):
+        """Идёт ли фоновая задача (тогда менять дерево нельзя — сообщаем в статусе)."""
+        if self._job is None:
+            return False
+        self.status_label.config(text=f"Busy: {self._job}... Please wait.", foreground="orange")
+        return True
 
     def _describe_search_path(self, key, path_nodes, operation_name="search"):
         """
@@ -426,6 +3227,8 @@ class BSTVisualizer(tk.Tk):
         3. Вставляем ключ в дерево.
         4. Перерисовываем дерево.
         """
+        if self._is_busy():
+            return
         key = self._get_key_from_entry()
         if key is None:
             return
@@ -438,6 +3241,7 @@ class BSTVisualizer(tk.Tk):
 
         # Если дерево пустое — просто создаём корень
         if self.bst.root is None:
+            self._remember()
             self.bst.insert(key)
             self.status_label.config(text=f"Inserted key {key} as root.", foreground="green")
             lines.append(f"Вставка {key}: дерево было пустым, новый корень = {key}.")
@@ -468,8 +3272,19 @@ class BSTVisualizer(tk.Tk):
                         )
 
                 # Теперь реально вставляем ключ в дерево
+                self._remember()
                 self.bst.insert(key)
                 self.status_label.config(text=f"Inserted key {key}.", foreground="green")
+                if self.tree_kind == "Eytzinger":
+                    lines.append(
+                        "После вставки дерево Eytzinger заново раскладывается в полное дерево, "
+                        "поэтому узлы могут поменять положение."
+                    )
+                elif self.tree_kind != "BST":
+                    lines.append(
+                        f"После вставки дерево {self.tree_kind} восстанавливает баланс поворотами "
+                        f"на пути к корню, поэтому узлы могут поменять положение."
+                    )
 
         # Пишем все шаги в лог
         self._log(lines)
@@ -485,6 +3300,8 @@ class BSTVisualizer(tk.Tk):
         3. Объясняем, как "восполняется" место удалённого узла.
         4. Удаляем и перерисовываем.
         """
+        if self._is_busy():
+            return
         key = self._get_key_from_entry()
         if key is None:
             return
@@ -550,12 +3367,20 @@ class BSTVisualizer(tk.Tk):
                 f"Ищем inorder-последователя — минимальный элемент в правом поддереве: {succ.key}."
             )
             lines.append(
-                f"Заменяем ключ {node.key} на {succ.key}, затем рекурсивно удаляем узел {succ.key} "
+                f"Заменяем ключ {node.key} на {succ.key}, затем удаляем узел {succ.key} "
                 f"в правом поддереве. Так «восполняется» место удалённого узла, "
                 f"и свойство BST сохраняется."
             )
 
+        if self.tree_kind == "Eytzinger":
+            lines.append("Затем дерево Eytzinger заново раскладывается в полное дерево.")
+        elif self.tree_kind != "BST":
+            lines.append(
+                f"Затем дерево {self.tree_kind} восстанавливает баланс поворотами на пути к корню."
+            )
+
         # Реально удаляем ключ из дерева
+        self._remember()
         self.bst.delete(key)
         self.status_label.config(text=f"Deleted key {key}.", foreground="green")
 
@@ -625,9 +3450,8 @@ class BSTVisualizer(tk.Tk):
             return
 
         if self.current_search_step < len(self.search_path_keys):
-            # Подсвечиваем очередной узел
-            self.highlight_key = self.search_path_keys[self.current_search_step]
-            self.redraw_tree()
+            # Подсвечиваем очередной узел (перекрашиваются только два узла)
+            self._set_highlight(self.search_path_keys[self.current_search_step])
 
             # Переходим к следующему шагу
             self.current_search_step += 1
@@ -638,13 +3462,10 @@ class BSTVisualizer(tk.Tk):
             # Анимация закончилась
             if self.search_target_found:
                 # Если ключ был найден, оставляем подсветку на последнем узле пути
-                self.highlight_key = self.search_path_keys[-1]
+                self._set_highlight(self.search_path_keys[-1])
             else:
                 # Если не найден — убираем подсветку
-                self.highlight_key = None
-
-            # Перерисовываем дерево, чтобы обновить подсветку
-            self.redraw_tree()
+                self._set_highlight(None)
 
             # Сбрасываем информацию об анимации
             self.search_path_keys = None
@@ -653,69 +3474,362 @@ class BSTVisualizer(tk.Tk):
     def on_show_traversals(self):
         """
         Обработчик кнопки Show Traversals.
-        Просто выводим в лог три обхода:
+        Выводим в лог три обхода:
         - Inorder,
         - Preorder,
         - Postorder.
+        Обходы считаются в фоновом потоке по снимку дерева, а в лог
+        попадают ленивыми строками (KeyLines): рисуются только видимые.
         """
-        inorder = self.bst.inorder()
-        preorder = self.bst.preorder()
-        postorder = self.bst.postorder()
+        tree = self.bst.snapshot()
 
-        lines = [
-            "Обходы дерева:",
-            "Inorder (LNR):   " + " ".join(map(str, inorder)),
-            "Preorder (NLR):  " + " ".join(map(str, preorder)),
-            "Postorder (LRN): " + " ".join(map(str, postorder)),
-        ]
-        self._log(lines)
+        def work():
+            return tree.inorder(), tree.preorder(), tree.postorder()
+
+        def done(result):
+            inorder, preorder, postorder = result
+            self._log(ChainedLines(
+                [f"Обходы дерева (узлов: {len(tree)}, высота: {tree.height()}):"],
+                KeyLines("Inorder (LNR):   ", inorder),
+                KeyLines("Preorder (NLR):  ", preorder),
+                KeyLines("Postorder (LRN): ", postorder),
+            ))
+            self.status_label.config(text=f"Traversals of {len(tree)} key(s).", foreground="green")
+
+        self._run_job("Traversals", work, done)
 
     # ---------- Обработчики кнопок: ОЧИСТКА ----------
     def on_clear_tree(self):
         """
         Обработчик кнопки Clear Tree.
         Полностью очищает дерево, холст и лог.
+        Прежнее дерево остаётся в истории — очистку можно отменить.
         """
-        self.bst = BinarySearchTree()   # создаём новое пустое дерево
+        if self._is_busy():
+            return
+        self._remember()
+        self.bst = TREE_KINDS[self.tree_kind](persistent=True)   # создаём новое пустое дерево
         self.highlight_key = None
         self.search_path_keys = None
-        self.canvas.delete("all")       # очищаем рисунок
-        self.text_log.delete("1.0", tk.END)  # очищаем лог
+        self._reset_canvas()            # очищаем рисунок
+        self._log([])                   # очищаем лог
         self.status_label.config(text="Tree is empty.", foreground="gray")
 
+    # ---------- Обработчики кнопок: ИМПОРТ ----------
+    def on_import(self):
+        """
+        Обработчик кнопки Import...
+        Читает целые ключи из текстового файла (через пробелы, запятые
+        или переводы строк), добавляет к ним ключи текущего дерева
+        и строит дерево заново через bulk_load — за O(n) после сортировки,
+        без пошаговой вставки и логирования пути каждого ключа.
+        Чтение и построение идут в фоновом потоке (_run_job).
+        """
+        if self._is_busy():
+            return
+        path = filedialog.askopenfilename(
+            title="Import keys",
+            filetypes=[("Text files", "*.txt *.csv"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+
+        kind = self.tree_kind
+        old = self.bst.snapshot()
+
+        def work():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    tokens = f.read().replace(",", " ").split()
+            except OSError as e:
+                raise ValueError(f"Cannot read file:\n{e}") from e
+
+            keys = []
+            for token in tokens:
+                try:
+                    keys.append(int(token))
+                except ValueError:
+                    raise ValueError(f"'{token}' is not a valid integer.") from None
+
+            tree = TREE_KINDS[kind](persistent=True)
+            tree.bulk_load(list(old) + keys)
+            return tree, len(keys)
+
+        def done(result):
+            tree, count = result
+            before = len(old)
+            self._remember()
+            self.bst = tree
+            self.highlight_key = None
+            self.search_path_keys = None
+            self.status_label.config(
+                text=f"Imported {len(tree) - before} new key(s).", foreground="green"
+            )
+            self._log(
+                f"Импорт из {path}: прочитано ключей — {count}, новых — {len(tree) - before}. "
+                f"Дерево построено заново: узлов {len(tree)}, высота {tree.height()}."
+            )
+            self.redraw_tree()
+
+        self._run_job("Import", work, done)
+
+    # ---------- Смена варианта дерева ----------
+    def on_change_kind(self, event=None):
+        """
+        Обработчик выбора в списке Tree.
+        Создаёт дерево нового вида и переносит в него все ключи:
+        в обычное BST — вставкой в порядке preorder (это сохраняет форму),
+        в сбалансированные — сразу через bulk_load.
+        Перенос идёт в фоновом потоке (_run_job).
+        """
+        kind = self.kind_var.get()
+        if kind == self.tree_kind:
+            return
+        if self._is_busy():
+            self.kind_var.set(self.tree_kind)
+            return
+
+        old = self.bst.snapshot()
+
+        def work():
+            keys = old.preorder()
+            tree = TREE_KINDS[kind](persistent=True)
+            if kind == "BST":
+                for key in keys:
+                    tree.insert(key)
+            else:
+                tree.bulk_load(keys)
+            return tree
+
+        def done(tree):
+            self._remember()
+            self.tree_kind = kind
+            self.bst = tree
+            self.highlight_key = None
+            self.search_path_keys = None
+            self.status_label.config(text=f"Tree type: {kind}.", foreground="green")
+            self._log(f"Тип дерева изменён на {kind}: перенесено ключей — {len(tree)}, высота {tree.height()}.")
+            self.redraw_tree()
+
+        self._run_job(f"Converting to {kind}", work, done)
+
+    # ---------- Отмена и повтор ----------
+    def _remember(self):
+        """
+        Кладёт снимок текущего дерева в историю перед изменением.
+        Снимок стоит O(1): узлы общие с деревом, а изменения их копируют.
+        Новое действие обнуляет цепочку Redo.
+        """
+        self.history.append((self.tree_kind, self.bst.snapshot()))
+        if len(self.history) > self.history_limit:
+            del self.history[0]
+        self.future.clear()
+
+    def on_undo(self, event=None):
+        """Кнопка Undo (Ctrl+Z): возврат к предыдущей версии дерева."""
+        if self._is_busy():
+            return
+        if not self.history:
+            self.status_label.config(text="Nothing to undo.", foreground="orange")
+            return
+        self.future.append((self.tree_kind, self.bst.snapshot()))
+        self._restore(*self.history.pop(), "Undo")
+
+    def on_redo(self, event=None):
+        """Кнопка Redo (Ctrl+Y): повтор отменённого действия."""
+        if self._is_busy():
+            return
+        if not self.future:
+            self.status_label.config(text="Nothing to redo.", foreground="orange")
+            return
+        self.history.append((self.tree_kind, self.bst.snapshot()))
+        self._restore(*self.future.pop(), "Redo")
+
+    def _restore(self, kind, tree, action):
+        """Делает версию tree текущим деревом и перерисовывает его."""
+        self.tree_kind = kind
+        self.kind_var.set(kind)
+        self.bst = tree
+        self.highlight_key = None
+        self.search_path_keys = None
+        self.status_label.config(
+            text=f"{action}: {len(tree)} key(s).", foreground="green"
+        )
+        self._log(
+            f"{action}: восстановлена версия дерева {kind} — узлов {len(tree)}, "
+            f"высота {tree.height()}. Шагов назад: {len(self.history)}, вперёд: {len(self.future)}."
+        )
+        self.redraw_tree()
+
     # ---------- Обработка изменения размера холста ----------
     def on_canvas_resize(self, event):
         """
         Срабатывает, когда пользователь меняет размер окна,
         и, соответственно, меняется размер холста.
-        Мы сохраняем новые размеры и перерисовываем дерево,
-        чтобы оно красиво растягивалось.
+        Мы сохраняем новые размеры, а перерисовку откладываем:
+        пока окно тянут, событий приходит десятки в секунду, и дерево
+        перерисуется один раз — через resize_delay_ms после последнего.
         """
         self.canvas_width = event.width
         self.canvas_height = event.height
+        if self._resize_job is not None:
+            self.after_cancel(self._resize_job)
+        self._resize_job = self.after(self.resize_delay_ms, self._on_resize_done)
+
+    def _on_resize_done(self):
+        """Отложенная перерисовка после изменения размера."""
+        self._resize_job = None
+        self.redraw_tree()
+
+    # ---------- Масштаб и сдвиг вида ----------
+    def on_zoom(self, event):
+        """
+        Колесо мыши: увеличивает или уменьшает масштаб в 1.25 раза.
+        Точка дерева под курсором остаётся на месте: экранная координата
+        равна мировой * масштаб - pan, поэтому pan пересчитывается так,
+        чтобы для курсора она не изменилась. По вертикали масштаб —
+        это шаг между уровнями (см. _level_step).
+        """
+        zoom_in = getattr(event, "delta", 0) > 0 or getattr(event, "num", None) == 4
+        factor = 1.25 if zoom_in else 0.8
+        new_zoom = min(max(self.zoom * factor, 0.1), 1e7)
+
+        self.pan_x = (event.x + self.pan_x) * (new_zoom / self.zoom) - event.x
+        old_step = self._level_step(self.level_height, self.zoom)
+        if old_step > 0:
+            ratio_y = self._level_step(self.level_height, new_zoom) / old_step
+            self.pan_y = (event.y + self.pan_y - 40) * ratio_y + 40 - event.y
+        self.zoom = new_zoom
+        self.redraw_tree()
+
+    def _level_step(self, level_height, zoom):
+        """
+        Шаг между уровнями на экране. Растёт с масштабом, но не больше
+        max_level_height (или исходного шага, если он уже больше):
+        широкое дерево при увеличении раздвигается по горизонтали,
+        а нижние уровни остаются недалеко.
+        """
+        if zoom <= 1:
+            return level_height * zoom
+        return min(level_height * zoom, max(level_height, self.max_level_height))
+
+    def on_pan_start(self, event):
+        """Начало перетаскивания вида."""
+        self._drag_from = (event.x, event.y)
+
+    def on_pan_move(self, event):
+        """Перетаскивание: сдвигаем вид вслед за мышью."""
+        if self._drag_from is None:
+            return
+        last_x, last_y = self._drag_from
+        self.pan_x -= event.x - last_x
+        self.pan_y -= event.y - last_y
+        self._drag_from = (event.x, event.y)
+        self.redraw_tree()
+
+    def on_reset_view(self):
+        """Кнопка Reset View: исходный масштаб и положение."""
+        self.zoom = 1.0
+        self.pan_x = self.pan_y = 0.0
         self.redraw_tree()
 
     # ---------- ОТРИСОВКА ДЕРЕВА ----------
+    # Рендерер сохраняет элементы холста между перерисовками:
+    # каждый узел рисуется один раз, а дальше его элементы только
+    # двигаются (coords) и перекрашиваются (itemconfig). Создаются
+    # и удаляются элементы лишь у появившихся и исчезнувших узлов.
+    #
+    # Рисуется только то, что попадает в окно (с учётом масштаба и сдвига):
+    # поддеревья за пределами окна отбрасываются целиком, а поддеревья,
+    # которым по горизонтали досталось меньше lod_min_width пикселей,
+    # рисуются одним треугольником с числом узлов (размер поддерева
+    # хранится в узле). Так число элементов холста зависит от размера
+    # окна, а не от размера дерева.
+    #
+    # Всё состояние привязано к ключу узла (ключи в дереве уникальны):
+    #   node_items[key] — (id круга, id текста) обычного узла,
+    #   tri_items[key] — (id треугольника, id текста) свёрнутого поддерева,
+    #   edge_items[key] — id линии от родителя к узлу key,
+    #   node_pos, tri_state, edge_pos, node_style — что нарисовано сейчас,
+    #   layout[key] — (вид, x, y, ключ родителя, красный ли, доп. данные),
+    #     где вид: "node" — узел, "tri" — свёрнутое поддерево,
+    #     "edge" — узел за окном, от которого рисуется только ребро.
+
+    def _reset_canvas(self):
+        """Полностью очищает холст и состояние рендерера."""
+        self.canvas.delete("all")
+        self.node_items = {}
+        self.tri_items = {}
+        self.edge_items = {}
+        self.node_pos = {}
+        self.tri_state = {}
+        self.edge_pos = {}
+        self.node_style = {}
+        self.layout = {}
+        self.empty_item = None
+
+    def _node_style(self, key, red):
+        """Цвета узла: (заливка, контур)."""
+        if self.highlight_key is not None and key == self.highlight_key:
+            # Узел подсвечен (например, в ходе поиска)
+            return "yellow", "red"
+        if red:
+            # Красный узел красно-чёрного дерева
+            return "salmon", "darkred"
+        # Обычный узел
+        return "lightblue", "black"
+
+    def _restyle(self, key):
+        """Перекрашивает один узел, если он нарисован и его цвета изменились."""
+        items = self.node_items.get(key)
+        if items is None:
+            return
+        style = self._node_style(key, self.layout[key][4])
+        if style != self.node_style[key]:
+            fill_color, outline_color = style
+            self.canvas.itemconfig(items[0], fill=fill_color, outline=outline_color)
+            self.node_style[key] = style
+
+    def _set_highlight(self, key):
+        """
+        Переносит подсветку на узел key (None — снять подсветку).
+        Меняются только два элемента: старый и новый подсвеченный узел.
+        """
+        old_key = self.highlight_key
+        self.highlight_key = key
+        for k in (old_key, key):
+            if k is not None:
+                self._restyle(k)
+
     def redraw_tree(self):
         """
         Основной метод отрисовки дерева на холсте.
-        1. Очищаем холст.
-        2. Если дерево пустое — пишем текст.
-        3. Иначе рассчитываем координаты узлов и рисуем их.
+        1. Если дерево пустое — убираем узлы и пишем текст.
+        2. Иначе рассчитываем раскладку видимой части (_compute_positions).
+        3. Удаляем элементы того, что пропало из раскладки, создаём
+           элементы нового, а существующие двигаем и перекрашиваем,
+           только если их координаты или цвета изменились.
         """
-        # Сначала очищаем всё
-        self.canvas.delete("all")
+        canvas = self.canvas
 
         # Если дерево пустое — просто показываем надпись
         if self.bst.root is None:
-            self.canvas.create_text(
-                self.canvas_width // 2,
-                self.canvas_height // 2,
-                text="Tree is empty.",
-                fill="gray",
-                font=("Arial", 16)
-            )
+            if self.node_items or self.tri_items:
+                self._reset_canvas()
+            center = (self.canvas_width // 2, self.canvas_height // 2)
+            if self.empty_item is None:
+                self.empty_item = canvas.create_text(
+                    *center,
+                    text="Tree is empty.",
+                    fill="gray",
+                    font=("Arial", 16)
+                )
+            else:
+                canvas.coords(self.empty_item, *center)
             return
+        if self.empty_item is not None:
+            canvas.delete(self.empty_item)
+            self.empty_item = None
 
         # Получаем высоту дерева (сколько уровней)
         tree_height = self.bst.height()  # 0, 1, 2, ...
@@ -732,121 +3846,171 @@ class BSTVisualizer(tk.Tk):
             #   - равномерное распределение по высоте холста
             level_height = min(self.max_level_height, usable_height / tree_height)
 
-        # Словарь: узел -> (x, y), где будем рисовать
-        positions = {}
-
-        # Сначала вычисляем координаты всех узлов
-        self._compute_positions(
-            node=self.bst.root,
-            depth=0,
-            x_min=0,
-            x_max=self.canvas_width,
-            level_height=level_height,
-            positions=positions
-        )
-
-        # Затем рисуем линии (рёбра) между узлами
-        self._draw_edges(self.bst.root, positions)
-
-        # И после этого рисуем сами узлы (круги + текст)
-        self._draw_nodes(self.bst.root, positions)
+        self.level_height = level_height
+        layout = self._compute_positions(level_height)
+        self.layout = layout
+
+        # 1. Удаляем элементы того, чего больше нет в раскладке
+        for key in [k for k in self.node_items if layout.get(k, ("",))[0] != "node"]:
+            canvas.delete(*self.node_items.pop(key))
+            del self.node_pos[key]
+            del self.node_style[key]
+        for key in [k for k in self.tri_items if layout.get(k, ("",))[0] != "tri"]:
+            canvas.delete(*self.tri_items.pop(key))
+            del self.tri_state[key]
+        for key in [k for k in self.edge_items if k not in layout or layout[k][3] is None]:
+            canvas.delete(self.edge_items.pop(key))
+            del self.edge_pos[key]
+
+        # 2. Рёбра: создаём новые, двигаем изменившиеся
+        new_edges = False
+        for key, (_, x, y, parent, _, _) in layout.items():
+            if parent is None:
+                continue
+            px, py = layout[parent][1:3]
+            coords = (px, py, x, y)
+            line = self.edge_items.get(key)
+            if line is None:
+                self.edge_items[key] = canvas.create_line(*coords, tags="edge")
+                new_edges = True
+            elif self.edge_pos[key] != coords:
+                canvas.coords(line, *coords)
+            self.edge_pos[key] = coords
+        # Линии всегда под кругами и треугольниками
+        if new_edges:
+            canvas.tag_lower("edge")
+
+        # 3. Узлы и свёрнутые поддеревья
+        r = self.node_radius
+        for key, (kind, x, y, _, red, extra) in layout.items():
+            if kind == "node":
+                self._draw_node(key, x, y, r, red)
+            elif kind == "tri":
+                self._draw_subtree(key, x, y, extra)
+
+    def _draw_node(self, key, x, y, r, red):
+        """Рисует узел (круг + ключ) или двигает/перекрашивает уже нарисованный."""
+        canvas = self.canvas
+        items = self.node_items.get(key)
+        if items is None:
+            fill_color, outline_color = self._node_style(key, red)
+            # Рисуем круг (овал) — сам узел
+            oval = canvas.create_oval(
+                x - r, y - r,
+                x + r, y + r,
+                fill=fill_color,
+                outline=outline_color,
+                width=2
+            )
+            # Рисуем текст (ключ) в центре круга
+            text = canvas.create_text(
+                x, y,
+                text=str(key),
+                font=("Arial", 10),
+                fill="black"
+            )
+            self.node_items[key] = (oval, text)
+            self.node_style[key] = (fill_color, outline_color)
+        else:
+            if self.node_pos[key] != (x, y):
+                canvas.coords(items[0], x - r, y - r, x + r, y + r)
+                canvas.coords(items[1], x, y)
+            self._restyle(key)
+        self.node_pos[key] = (x, y)
 
-    def _compute_positions(self, node, depth, x_min, x_max, level_height, positions):
+    def _draw_subtree(self, key, x, y, extra):
+        """
+        Рисует свёрнутое поддерево: треугольник от его корня
+        до нижнего уровня шириной в отведённый поддереву интервал,
+        внутри — число узлов.
+        """
+        canvas = self.canvas
+        x_min, x_max, y_bottom, count = extra
+        coords = (x, y, x_max, y_bottom, x_min, y_bottom)
+        state = (coords, count)
+        items = self.tri_items.get(key)
+        if items is None:
+            polygon = canvas.create_polygon(*coords, fill="lightgray", outline="gray")
+            text = canvas.create_text(
+                x, (y + 2 * y_bottom) / 3,
+                text=str(count),
+                font=("Arial", 8),
+                fill="black"
+            )
+            self.tri_items[key] = (polygon, text)
+        elif self.tri_state[key] != state:
+            polygon, text = items
+            canvas.coords(polygon, *coords)
+            canvas.coords(text, x, (y + 2 * y_bottom) / 3)
+            canvas.itemconfig(text, text=str(count))
+        self.tri_state[key] = state
+
+    def _compute_positions(self, level_height):
         """
-        Рекурсивно вычисляет координаты (x, y) для каждого узла дерева.
+        Вычисляет раскладку видимой части дерева.
 
-        Идея:
+        Идея (при zoom = 1 и без сдвига):
         - x = середина интервала [x_min, x_max],
         - y = отступ сверху + depth * level_height,
         где depth — глубина узла (0 для корня, 1 для его детей и т.д.).
+        Левое поддерево получает левую половину интервала, правое — правую.
+        С масштабом интервал корня растягивается в zoom раз, шаг уровня
+        считает _level_step, а всё сдвигается на (pan_x, pan_y).
+
+        Поддерево целиком лежит в интервале своего корня и ниже него,
+        поэтому, если интервал не пересекает окно или корень ниже окна,
+        поддерево не обходится (от видимого родителя рисуется только
+        ребро). Поддерево с интервалом уже lod_min_width становится
+        треугольником. Обход идёт по явному стеку, без рекурсии.
+        Возвращает словарь: ключ -> (вид, x, y, ключ родителя, красный ли,
+        доп. данные треугольника).
         """
-        if node is None:
-            return
-
-        # x — середина доступного интервала по горизонтали
-        x = (x_min + x_max) // 2
-
-        # Если высота между уровнями 0 — ставим дерево примерно по центру
-        if level_height == 0:
-            y = self.canvas_height // 2
-        else:
-            # Иначе отступ сверху 40 пикселей + depth * level_height
-            y = 40 + int(depth * level_height)
-
-        # Запоминаем координаты для этого узла
-        positions[node] = (x, y)
-
-        # Левое поддерево получает левую часть интервала [x_min, x)
-        self._compute_positions(node.left, depth + 1, x_min, x, level_height, positions)
-        # Правое поддерево получает правую часть интервала (x, x_max]
-        self._compute_positions(node.right, depth + 1, x, x_max, level_height, positions)
-
-    def _draw_edges(self, node, positions):
-        """
-        Рисует линии (рёбра) между узлом и его детьми.
-        """
-        if node is None:
-            return
-
-        x, y = positions[node]
-
-        # Если есть левый ребёнок — соединяем линией
-        if node.left is not None:
-            x_left, y_left = positions[node.left]
-            self.canvas.create_line(x, y, x_left, y_left)
-            self._draw_edges(node.left, positions)
-
-        # Если есть правый ребёнок — соединяем линией
-        if node.right is not None:
-            x_right, y_right = positions[node.right]
-            self.canvas.create_line(x, y, x_right, y_right)
-            self._draw_edges(node.right, positions)
-
-    def _draw_nodes(self, node, positions):
-        """
-        Рисует сами узлы:
-        - круг,
-        - текст внутри (ключ),
-        - подсветку, если этот узел сейчас выделен (поиск).
-        """
-        if node is None:
-            return
-
-        x, y = positions[node]
-        r = self.node_radius
-
-        # Определяем цвета в зависимости от того, подсвечен узел или нет
-        if self.highlight_key is not None and node.key == self.highlight_key:
-            # Узел подсвечен (например, в ходе поиска)
-            fill_color = "yellow"
-            outline_color = "red"
-            text_color = "black"
-        else:
-            # Обычный узел
-            fill_color = "lightblue"
-            outline_color = "black"
-            text_color = "black"
-
-        # Рисуем круг (овал) — сам узел
-        self.canvas.create_oval(
-            x - r, y - r,
-            x + r, y + r,
-            fill=fill_color,
-            outline=outline_color,
-            width=2
-        )
-
-        # Рисуем текст (ключ) в центре круга
-        self.canvas.create_text(
-            x, y,
-            text=str(node.key),
-            font=("Arial", 10),
-            fill=text_color
-        )
-
-        # Рекурсивно рисуем левое и правое поддерево
-        self._draw_nodes(node.left, positions)
-        self._draw_nodes(node.right, positions)
+        layout = {}
+        zoom = self.zoom
+        width, height = self.canvas_width, self.canvas_height
+        margin = self.node_radius
+        step = self._level_step(level_height, zoom)
+        # Цвет есть только у узлов красно-чёрного дерева
+        colored = isinstance(self.bst, RedBlackTree)
+
+        stack = [(self.bst.root, 0, -self.pan_x, width * zoom - self.pan_x, None)]
+        while stack:
+            node, depth, x_min, x_max, parent_key = stack.pop()
+
+            # x — середина доступного интервала по горизонтали
+            x = (x_min + x_max) / 2
+
+            # Если высота между уровнями 0 — ставим дерево примерно по центру
+            if level_height == 0:
+                y = height / 2 - self.pan_y
+            else:
+                # Иначе отступ сверху 40 пикселей + depth * шаг уровня
+                y = 40 + depth * step - self.pan_y
+
+            # Поддерево за пределами окна — только ребро от родителя
+            if x_max < -margin or x_min > width + margin or y > height + margin:
+                if parent_key is not None:
+                    layout[node.key] = ("edge", x, y, parent_key, False, None)
+                continue
+
+            red = colored and node.red
+            has_children = node.left is not None or node.right is not None
+
+            # Слишком узкое поддерево — треугольник с числом узлов
+            if has_children and x_max - x_min < self.lod_min_width:
+                y_bottom = y + max(node.height, 1) * step
+                layout[node.key] = ("tri", x, y, parent_key, red, (x_min, x_max, y_bottom, node.size))
+                continue
+
+            layout[node.key] = ("node", x, y, parent_key, red, None)
+
+            # Левое поддерево получает левую часть интервала [x_min, x)
+            if node.left is not None:
+                stack.append((node.left, depth + 1, x_min, x, node.key))
+            # Правое поддерево получает правую часть интервала (x, x_max]
+            if node.right is not None:
+                stack.append((node.right, depth + 1, x, x_max, node.key))
+        return layout
 
 
 # ==============================
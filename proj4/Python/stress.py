@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# Запуск: "python stress.py" (из папки проекта), подробности — "python stress.py -h"
+
+"""
+Стресс-тест ConcurrentTree из main.py: один писатель и несколько читателей.
+
+1) В дерево загружаются «постоянные» чётные ключи, которые никто
+   не удаляет, и часть «временных» нечётных.
+2) Писатель без остановки удаляет и снова вставляет нечётные ключи.
+   Нечётный узел обычно имеет двух детей, поэтому удаление идёт через
+   замену ключа на inorder-последователя — а последователь чётный.
+3) Читатели всё это время проверяют, что дерево не «разорвано»:
+   - search находит каждый постоянный ключ,
+   - range(lo, hi) выдаёт строго возрастающие ключи и все постоянные
+     ключи отрезка (без пропусков и повторов).
+
+Режим concurrent (ConcurrentTree) обязан пройти без единой ошибки.
+Режим unsafe — то же самое на обычном дереве без синхронизации —
+показывает, что проверка действительно ловит разрывы. Чтобы гонку
+было видно за секунды, узлы при записи ключа отдают управление другим
+потокам (instrumented); --no-yield это отключает.
+В конце замеряется пропускная способность чтения при разном числе
+читателей (на сборках Python без GIL она растёт с числом потоков).
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+from itertools import islice
+
+from main import ConcurrentTree, TreeNode, TREE_KINDS
+
+# Ширина отрезка, который читатель проверяет через range
+RANGE_WIDTH = 64
+
+
+# ------------------------------------------------------
+#                 ПИСАТЕЛЬ И ЧИТАТЕЛИ
+# ------------------------------------------------------
+
+def instrumented(tree_cls):
+    """
+    Подкласс tree_cls, у узлов которого перезапись ключа (замена
+    на последователя при удалении) отдаёт управление другим потокам
+    (time.sleep(0)). Окно между заменой ключа и удалением узла
+    последователя становится широким, и разрыв у незащищённого дерева
+    ловится сразу. Первая запись ключа (новый узел) не задерживается.
+    У EytzingerTree узлы — представления массива, ключи в них не пишутся,
+    поэтому такое дерево возвращается как есть.
+    """
+    if not issubclass(tree_cls.node_class, TreeNode):
+        return tree_cls
+    slot = TreeNode.key
+
+    class YieldingNode(tree_cls.node_class):
+        __slots__ = ()
+
+        @property
+        def key(self):
+            return slot.__get__(self)
+
+        @key.setter
+        def key(self, value):
+            try:
+                slot.__get__(self)
+            except AttributeError:
+                slot.__set__(self, value)   # узел только создаётся
+                return
+            slot.__set__(self, value)
+            time.sleep(0)
+
+    return type(tree_cls.__name__, (tree_cls,), {"node_class": YieldingNode})
+
+
+def writer(tree, n_keys: int, stop: threading.Event, seed: int, counter: list):
+    """Удаляет и вставляет нечётные ключи, пока не выставлен stop."""
+    rng = random.Random(seed)
+    present = set(range(1, 2 * n_keys, 4))   # какие нечётные ключи сейчас в дереве
+    ops = 0
+    while not stop.is_set():
+        key = 2 * rng.randrange(n_keys) + 1
+        if key in present:
+            tree.delete(key)
+            present.discard(key)
+        else:
+            tree.insert(key)
+            present.add(key)
+        ops += 1
+    counter.append(ops)
+
+
+def check_once(tree, n_keys: int, rng: random.Random):
+    """
+    Одна проверка читателя. Возвращает описание разрыва или None.
+    Исключение внутри дерева тоже считается разрывом.
+    """
+    try:
+        stable = 2 * rng.randrange(n_keys)
+        if tree.search(stable) is None:
+            return f"search({stable}) не нашёл постоянный ключ"
+
+        lo = rng.randrange(2 * n_keys)
+        hi = lo + RANGE_WIDTH
+        # islice — защита от зацикливания на разорванном дереве
+        keys = list(islice(tree.range(lo, hi), 2 * RANGE_WIDTH + 2))
+        for a, b in zip(keys, keys[1:]):
+            if a >= b:
+                return f"range({lo}, {hi}): порядок нарушен ({a}, {b})"
+        got = {k for k in keys if k % 2 == 0}
+        want = set(range(lo + lo % 2, min(hi, 2 * n_keys - 2) + 1, 2))
+        if got != want:
+            return f"range({lo}, {hi}): пропущены постоянные ключи {sorted(want - got)[:5]}"
+    except Exception as e:  # любой сбой чтения — тоже разрыв
+        return f"исключение при чтении: {e!r}"
+    return None
+
+
+def reader(tree, n_keys: int, stop: threading.Event, seed: int, results: list):
+    """Проверяет дерево, пока не выставлен stop. Пишет (проверок, разрывов, примеры)."""
+    rng = random.Random(seed)
+    checks = torn = 0
+    examples = []
+    while not stop.is_set():
+        problem = check_once(tree, n_keys, rng)
+        checks += 1
+        if problem is not None:
+            torn += 1
+            if len(examples) < 3:
+                examples.append(problem)
+    results.append((checks, torn, examples))
+
+
+def make_tree(mode: str, kind: str, n_keys: int, yielding: bool = False):
+    """Дерево для режима: ConcurrentTree или голое дерево без синхронизации."""
+    keys = list(range(0, 2 * n_keys, 2)) + list(range(1, 2 * n_keys, 4))
+    tree_cls = instrumented(TREE_KINDS[kind]) if yielding else TREE_KINDS[kind]
+    if mode == "concurrent":
+        tree = ConcurrentTree(tree_cls)
+    else:
+        tree = tree_cls()
+    tree.bulk_load(keys)
+    return tree
+
+
+def run_stress(mode: str, kind: str, n_keys: int, readers: int, seconds: float, seed: int,
+               yielding: bool) -> dict:
+    """Один прогон писатель + readers читателей. Возвращает сводку."""
+    tree = make_tree(mode, kind, n_keys, yielding)
+    stop = threading.Event()
+    write_ops, results = [], []
+    threads = [threading.Thread(target=writer, args=(tree, n_keys, stop, seed, write_ops))]
+    threads += [
+        threading.Thread(target=reader, args=(tree, n_keys, stop, seed + 1 + i, results))
+        for i in range(readers)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    examples = [e for _, _, ex in results for e in ex]
+    return {
+        "mode": mode,
+        "writes": sum(write_ops),
+        "checks": sum(c for c, _, _ in results),
+        "torn": sum(t for _, t, _ in results),
+        "examples": examples[:5],
+    }
+
+
+# ------------------------------------------------------
+#              ПРОПУСКНАЯ СПОСОБНОСТЬ ЧТЕНИЯ
+# ------------------------------------------------------
+
+def read_throughput(kind: str, n_keys: int, readers: int, seconds: float, seed: int) -> float:
+    """
+    Поисков в секунду у readers потоков. Писателя нет, чтобы потоки
+    не делили время с ним: читатели не берут замков, и с GIL рост
+    ограничен одним ядром, а без GIL — числом ядер.
+    """
+    tree = make_tree("concurrent", kind, n_keys)
+    stop = threading.Event()
+    counts = []
+
+    def search_loop(i):
+        rng = random.Random(seed + i)
+        keys = [rng.randrange(2 * n_keys) for _ in range(1024)]
+        done = 0
+        while not stop.is_set():
+            for key in keys:
+                tree.search(key)
+            done += len(keys)
+        counts.append(done)
+
+    threads = [threading.Thread(target=search_loop, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds
+
+
+# ------------------------------------------------------
+#                     ОСНОВНАЯ ФУНКЦИЯ
+# ------------------------------------------------------
+
+def main():
+    """
+    Основная точка входа:
+    - Прогоняет стресс-тест в режимах concurrent и unsafe
+    - Замеряет чтение при разном числе читателей
+    - Завершается с кодом 1, если ConcurrentTree хоть раз «разорвался»
+    """
+    parser = argparse.ArgumentParser(description="Стресс-тест ConcurrentTree.")
+    parser.add_argument("--kind", default="BST", choices=list(TREE_KINDS), help="вид дерева (по умолчанию BST)")
+    parser.add_argument("--keys", type=int, default=2000, help="число постоянных ключей (по умолчанию 2000)")
+    parser.add_argument("--readers", type=int, default=4, help="читателей в стресс-тесте (по умолчанию 4)")
+    parser.add_argument("--seconds", type=float, default=3.0, help="длительность каждого прогона, с")
+    parser.add_argument("--seed", type=int, default=0, help="seed генераторов")
+    parser.add_argument(
+        "--no-yield", action="store_true",
+        help="не расширять окно гонки (узлы без time.sleep(0) при записи ключа)",
+    )
+    parser.add_argument(
+        "--modes", default="concurrent,unsafe",
+        help="режимы через запятую: concurrent, unsafe (по умолчанию оба)",
+    )
+    parser.add_argument(
+        "--scale", default="1,2,4,8",
+        help="число читателей для замера чтения через запятую; пусто — не замерять",
+    )
+    args = parser.parse_args()
+
+    # Частое переключение потоков — больше шансов поймать писателя посреди операции
+    sys.setswitchinterval(1e-5)
+
+    failed = False
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode not in ("concurrent", "unsafe"):
+            print(f"[ERROR] Неизвестный режим: {mode}")
+            sys.exit(1)
+        print(f"[INFO] Режим {mode}: {args.kind}, писатель + {args.readers} читателей, {args.seconds} с...")
+        res = run_stress(mode, args.kind, args.keys, args.readers, args.seconds, args.seed,
+                         not args.no_yield)
+        print(f"    записей {res['writes']}, проверок {res['checks']}, разрывов {res['torn']}")
+        for line in res["examples"]:
+            print(f"    [TORN] {line}")
+        if mode == "concurrent" and res["torn"]:
+            failed = True
+
+    scale = [int(x) for x in args.scale.split(",") if x.strip()]
+    if scale:
+        gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+        print()
+        print(f"[INFO] Чтение без писателя (GIL {'включён' if gil else 'выключен'}):")
+        print(f"{'readers':>8} {'searches/s':>12} {'speedup':>8}")
+        base = None
+        for readers in scale:
+            rate = read_throughput(args.kind, args.keys, readers, args.seconds, args.seed)
+            base = base or rate
+            print(f"{readers:>8} {rate:>12.0f} {rate / base:>8.2f}")
+
+    if failed:
+        print("[ERROR] ConcurrentTree выдал разорванное дерево")
+        sys.exit(1)
+
+
+# Точка входа
+if __name__ == "__main__":
+    main()
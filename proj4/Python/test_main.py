@@ -0,0 +1,288 @@
+# Запуск: "python -m pytest -q" (из папки проекта)
+
+"""
+Тесты деревьев из main.py против эталонной модели — множества
+и отсортированного списка ключей:
+
+- инварианты после каждой операции: порядок ключей, size и height
+  узлов, баланс AVL, свойства LLRB (нет правых красных ссылок и двух
+  красных подряд, одинаковая чёрная высота, чёрный корень),
+- select/rank и запросы по соседям,
+- режимы arena и persistent (снимки не меняются после новых правок),
+- dump/load, в том числе load(mapped=True) и close(),
+- пакетные insert_many/delete_many/search_many (флаги по каждому ключу),
+- bulk_load и раскладки (numpy и без него дают одно и то же),
+- ConcurrentTree.
+"""
+
+import random
+from bisect import bisect_left
+
+import pytest
+
+import main
+from main import (
+    TREE_KINDS, BinarySearchTree, AVLTree, RedBlackTree, EytzingerTree,
+    ConcurrentTree, balanced_layout, llrb_layout,
+)
+
+# Вид дерева и режим: EytzingerTree хранит ключи в массиве, arena у него нет
+CONFIGS = [
+    (cls, mode)
+    for cls in TREE_KINDS.values()
+    for mode in ("plain", "arena", "persistent")
+    if not (cls is EytzingerTree and mode == "arena")
+]
+
+
+def make_tree(cls, mode):
+    """Пустое дерево вида cls в режиме mode."""
+    return cls(arena=mode == "arena", persistent=mode == "persistent")
+
+
+def config_id(config):
+    cls, mode = config
+    return f"{cls.__name__}-{mode}"
+
+
+def check_invariants(tree):
+    """Проверяет форму дерева целиком; возвращает ключи в порядке inorder."""
+    keys = []
+    colored = isinstance(tree, RedBlackTree)
+
+    def walk(node, lo, hi):
+        """(высота, размер, чёрная высота) поддерева node."""
+        if node is None:
+            return -1, 0, 0
+        assert (lo is None or lo < node.key) and (hi is None or node.key < hi)
+        left_height, left_size, left_black = walk(node.left, lo, node.key)
+        keys.append(node.key)
+        right_height, right_size, right_black = walk(node.right, node.key, hi)
+        assert node.size == left_size + right_size + 1
+        assert node.height == max(left_height, right_height) + 1
+        if isinstance(tree, AVLTree):
+            assert abs(left_height - right_height) <= 1
+        if colored:
+            assert not (node.right is not None and node.right.red)
+            assert not (node.red and node.left is not None and node.left.red)
+            assert left_black == right_black
+            left_black += 0 if node.red else 1
+        return node.height, node.size, left_black
+
+    walk(tree.root, None, None)
+    if colored and tree.root is not None:
+        assert not tree.root.red
+    assert keys == list(tree)
+    assert len(tree) == len(keys)
+    assert tree.height() == (tree.root.height if tree.root is not None else -1)
+    return keys
+
+
+def check_queries(tree, model, rng):
+    """select/rank и запросы по соседям против отсортированного списка."""
+    ordered = sorted(model)
+    for k in range(len(ordered)):
+        assert tree.select(k) == ordered[k]
+    with pytest.raises(IndexError):
+        tree.select(len(ordered))
+    probes = [rng.randrange(-5, 400) for _ in range(30)]
+    for key in probes:
+        i = bisect_left(ordered, key)
+        assert tree.rank(key) == i
+        assert (tree.search(key) is not None) == (key in model)
+        assert tree.floor(key) == (ordered[i] if key in model else (ordered[i - 1] if i else None))
+        assert tree.ceil(key) == (ordered[i] if i < len(ordered) else None)
+        assert list(tree.range(key, key + 20)) == [k for k in ordered if key <= k <= key + 20]
+        nearest = sorted(ordered, key=lambda k: (abs(k - key), k))[:3]
+        assert tree.k_nearest(key, 3) == nearest
+
+
+def expected_flags(batch, present):
+    """Флаги пакетной операции: 1 получает первое вхождение ключа, для которого present."""
+    seen = set()
+    flags = []
+    for key in batch:
+        flags.append(1 if present(key) and key not in seen else 0)
+        seen.add(key)
+    return flags
+
+
+# ---------- ИНВАРИАНТЫ И ЗАПРОСЫ ----------
+
+@pytest.mark.parametrize("config", CONFIGS, ids=config_id)
+def test_random_operations_match_model(config):
+    rng = random.Random(1)
+    tree = make_tree(*config)
+    model = set()
+    for step in range(600):
+        key = rng.randrange(300)
+        if rng.random() < 0.6:
+            tree.insert(key)
+            model.add(key)
+        else:
+            tree.delete(key)
+            model.discard(key)
+        if step % 50 == 0:
+            assert check_invariants(tree) == sorted(model)
+    assert check_invariants(tree) == sorted(model)
+    check_queries(tree, model, rng)
+
+
+@pytest.mark.parametrize("config", CONFIGS, ids=config_id)
+def test_search_with_path_ends_at_key(config):
+    tree = make_tree(*config)
+    tree.bulk_load(range(0, 100, 3))
+    for key in range(-2, 102):
+        path = tree.search_with_path(key)
+        assert path[0] == tree.root
+        assert (path[-1].key == key) == (key % 3 == 0 and key < 100)
+
+
+# ---------- МАССОВАЯ ЗАГРУЗКА ----------
+
+@pytest.mark.parametrize("config", CONFIGS, ids=config_id)
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 7, 8, 100, 3000])
+def test_bulk_load(config, n):
+    tree = make_tree(*config)
+    keys = list(range(n)) * 2
+    random.Random(n).shuffle(keys)
+    tree.bulk_load(keys)
+    assert check_invariants(tree) == list(range(n))
+    if not isinstance(tree, RedBlackTree):
+        assert tree.height() == n.bit_length() - 1
+
+
+@pytest.mark.parametrize("layout", [balanced_layout, llrb_layout])
+def test_layout_without_numpy_matches_numpy(layout, monkeypatch):
+    if main.np is None:
+        pytest.skip("нужен numpy")
+    monkeypatch.setattr(main, "LAYOUT_NUMPY_MIN", 1)
+    for n in list(range(1, 70)) + [2048, 6561, 10000]:
+        vectorized = layout(n)
+        with monkeypatch.context() as m:
+            m.setattr(main, "np", None)
+            assert layout(n) == vectorized
+
+
+# ---------- ПАКЕТНЫЕ ОПЕРАЦИИ ----------
+
+@pytest.mark.parametrize("config", CONFIGS, ids=config_id)
+def test_batch_operations_match_model(config):
+    rng = random.Random(2)
+    tree = make_tree(*config)
+    model = set(rng.sample(range(1000), 200))
+    tree.bulk_load(model)
+    for _ in range(20):
+        batch = [rng.randrange(-10, 1010) for _ in range(rng.randrange(0, 120))]
+        flags = expected_flags(batch, lambda key: key not in model)
+        assert list(tree.insert_many(batch)) == flags
+        model.update(batch)
+        assert check_invariants(tree) == sorted(model)
+
+        batch = [rng.randrange(-10, 1010) for _ in range(rng.randrange(0, 120))]
+        flags = expected_flags(batch, lambda key: key in model)
+        assert list(tree.delete_many(batch)) == flags
+        model.difference_update(batch)
+        assert check_invariants(tree) == sorted(model)
+
+        probes = [rng.randrange(-10, 1010) for _ in range(50)]
+        assert list(tree.search_many(probes)) == [int(key in model) for key in probes]
+
+
+@pytest.mark.parametrize("cls", [RedBlackTree, EytzingerTree], ids=lambda cls: cls.__name__)
+def test_batch_operations_without_numpy(cls, monkeypatch):
+    monkeypatch.setattr(main, "np", None)
+    tree = cls.from_iterable(range(0, 200, 2))
+    assert list(tree.insert_many([1, 3, 3, 4])) == [1, 1, 0, 0]
+    assert list(tree.delete_many([0, 0, 5, 1])) == [1, 0, 0, 1]
+    assert list(tree.search_many([0, 2, 3])) == [0, 1, 1]
+    assert check_invariants(tree) == [2, 3] + list(range(4, 200, 2))
+
+
+# ---------- ПЕРСИСТЕНТНЫЙ РЕЖИМ ----------
+
+@pytest.mark.parametrize("cls", list(TREE_KINDS.values()), ids=lambda cls: cls.__name__)
+def test_snapshots_do_not_change(cls):
+    rng = random.Random(3)
+    tree = cls(persistent=True)
+    model = set()
+    snapshots = []
+    for _ in range(300):
+        key = rng.randrange(200)
+        if rng.random() < 0.6:
+            tree.insert(key)
+            model.add(key)
+        else:
+            tree.delete(key)
+            model.discard(key)
+        snapshots.append((tree.snapshot(), sorted(model)))
+    tree.insert_many(range(200, 260))
+    tree.delete_many(range(0, 100))
+    for snapshot, keys in snapshots:
+        assert check_invariants(snapshot) == keys
+
+
+def test_snapshot_requires_persistent():
+    with pytest.raises(ValueError):
+        RedBlackTree().snapshot()
+    with pytest.raises(ValueError):
+        AVLTree(arena=True, persistent=True)
+
+
+# ---------- DUMP / LOAD ----------
+
+@pytest.mark.parametrize("config", CONFIGS, ids=config_id)
+def test_dump_load_roundtrip(config, tmp_path):
+    cls, mode = config
+    tree = make_tree(cls, mode)
+    for key in random.Random(4).sample(range(10000), 500):
+        tree.insert(key)
+    path = tmp_path / "tree.bin"
+    tree.dump(path)
+
+    loaded = BinarySearchTree.load(path)
+    assert type(loaded) is cls
+    assert check_invariants(loaded) == list(tree)
+    if cls is not EytzingerTree:
+        # Форма (и цвета LLRB) сохраняется как есть
+        assert loaded.preorder() == tree.preorder()
+
+    if cls is EytzingerTree:
+        with pytest.raises(ValueError):
+            BinarySearchTree.load(path, mapped=True)
+        return
+    with BinarySearchTree.load(path, mapped=True) as mapped:
+        assert check_invariants(mapped) == list(tree)
+        assert list(mapped.search_many([tree.select(0), -1])) == [1, 0]
+        with pytest.raises(TypeError):
+            mapped.insert(-1)
+    with pytest.raises(ValueError):
+        mapped.search(tree.select(0))
+
+
+def test_load_rejects_other_kind(tmp_path):
+    path = tmp_path / "tree.bin"
+    AVLTree.from_iterable(range(10)).dump(path)
+    with pytest.raises(ValueError):
+        RedBlackTree.load(path)
+    (tmp_path / "junk.bin").write_bytes(b"not a tree dump")
+    with pytest.raises(ValueError):
+        BinarySearchTree.load(tmp_path / "junk.bin")
+
+
+# ---------- CONCURRENTTREE ----------
+
+@pytest.mark.parametrize("cls", list(TREE_KINDS.values()), ids=lambda cls: cls.__name__)
+def test_concurrent_tree(cls):
+    tree = ConcurrentTree(cls)
+    tree.bulk_load(range(0, 100, 2))
+    before = tree.snapshot()
+    tree.insert(5)
+    tree.delete(10)
+    assert list(tree.insert_many([7, 7, 8])) == [1, 0, 0]
+    assert list(tree.delete_many([12, 13])) == [1, 0]
+    assert tree.version == 5
+    assert list(before) == list(range(0, 100, 2))
+    assert 5 in tree and 10 not in tree and tree.search(7).key == 7
+    assert list(tree.range(4, 9)) == [4, 5, 6, 7, 8]
+    assert tree.select(0) == 0 and tree.rank(14) == len([k for k in tree if k < 14])